@@ -0,0 +1,646 @@
+# The Slang bytecode compiler and VM
+# Compiles Slang statements into bytecode and executes it on a stack machine.
+#
+# A code object holds the instructions of a program or of a function body as a
+# list of (opcode, a, b) triples, a constant pool, a table of the variable names
+# it uses and the line of the statement each instruction belongs to. Variables
+# are looked up by name in the environment stack like in the tree-walking
+# executor (see execute.find), since a function sees the variables of its
+# callers, so instructions refer to names by their index in the name table
+# rather than to fixed slots. Calls between bytecode functions run in the same
+# dispatch loop (see run) without recursing.
+#
+# Each statement list keeps its current result on the value stack, and blocks
+# are entered and left with jumps. The result objects of execute.execute_stms
+# are only made where they can be seen: a return unwinds the function's frame
+# at once, and a break at once ends the statement list holding its loop with
+# the result 0, which is where those result objects lead. Code objects can be
+# serialized (see dumps and loads) so compiled programs can be cached and
+# shipped.
+
+import marshal
+from sys import intern
+from . import closures
+from .execute import number, string, array, func, built_in_func, result, get_num
+
+# Configuration variables
+
+magic = 'slangbc'                           # Magic string of serialized code
+version = 1                                 # Format version of serialized code
+
+# Opcodes. They are grouped so that the VM dispatches on the range of an
+# opcode first, with the most frequent instructions first in each range. An
+# argument is a name index (n), a constant index (k), a jump target (t), a
+# count or a flag.
+
+LOAD = 0            # n: push the value of the variable
+CONST = 1           # k: push the constant
+RES = 2             # Pop a value and make it the result of the statement list
+ASSIGN = 3          # n: pop a value, bind the variable to it and make it the result
+STORE = 4           # n: bind the variable to the value on top
+TEST = 5            # t: pop a value and jump if its unwrapped value is falsy
+JUMP = 6            # t: jump
+CALL = 7            # k: call the function of call site (name, argument count)
+
+ENV = 8             # Push an empty environment and the initial result of a block
+LEAVE = 9           # t: pop the environment and result of an if-else branch and jump
+WHILE_END = 10      # t: pop the environment and result of a while iteration and jump
+FOR_NEXT = 11       # t, n: push an environment binding the variable to the next
+                    # element and the initial result of the body, or end and jump
+FOR_END = 12        # t: pop the environment and result of a for iteration and jump
+RETURN = 13         # Pop a value and return it from the function
+COMP_NEXT = 14      # t, n: bind the variable to the next element and push it, or
+                    # push the comprehension's array and jump
+COMP_TEST = 15      # t, flag: pop a value, and if it is falsy, pop the element and
+                    # jump, or else pop the element if the flag is set
+
+ADD = 16            # Arithmetic operators: pop two operands and push the value
+SUB = 17
+MUL = 18
+DIV = 19
+MOD = 20
+POW = 21
+EQ = 22             # Logical operators: pop two operands and push the value
+NE = 23
+LE = 24
+GE = 25
+LT = 26
+GT = 27
+AND = 28
+OR = 29
+NOT = 30            # Pop an operand and push its negation
+
+COMP_APPEND = 32    # t: pop a value, add it to the comprehension's array and jump
+LOAD_LIST = 33      # n: push the unwrapped value of the variable, which must be a list
+GET_INDEX = 34      # n: pop an index and replace the list on top with its element
+COMP_START = 35     # Pop an array and start a comprehension over it
+FOR_START = 36      # Pop an array and start iterating over it
+LOAD_ARRAY = 37     # n: push the unwrapped value of the variable
+VALUE = 38          # Replace the value on top with its unwrapped value
+SET_INDEX = 39      # Pop a value, an index and a list, set the element and push the value
+
+ARRAY = 40          # Pop the given number of values and push an array of them
+RANGE = 41          # Pop two numbers and push their range (inclusive if the flag is set)
+BLOCK = 42          # Push the initial result of a program or function body
+POP = 43            # Pop a value
+BREAK = 44          # t, count: pop the given number of blocks, make the result of the
+                    # statement list holding the while loop 0 and jump to its end
+BREAK_FOR = 45      # t, count: the same for a for loop
+DEFINE = 46         # k: bind a function to the function template (name, arguments, code)
+RAISE = 47          # k: raise a syntax error with the message
+
+zero = number(0)
+start = result(zero, False, False)          # Initial result of statement lists
+
+# Binary operators of each operator symbol
+arith_ops = {'+': ADD, '-': SUB, '*': MUL, '/': DIV, '%': MOD, '^': POW}
+log_ops = {'&&': AND, '||': OR, '==': EQ, '!=': NE, '<=': LE, '>=': GE, '<': LT, '>': GT}
+
+# A code object.
+class code(object):
+
+    def __init__(self, ops, consts, names, lines):
+        self.ops = ops                  # Instructions
+        self.consts = consts            # Constant pool
+        self.names = names              # Variable names
+        self.lines = lines              # Statement line of each instruction
+
+    def __repr__(self):
+        return 'code(%d instructions)' % len(self.ops)
+
+    # Run the code as a function body on the given environment stack, which
+    # already has the environment of the arguments, and return its result. This
+    # lets the other executors call functions compiled to bytecode.
+    def __call__(self, envs):
+        return run(self, envs)
+
+# Compiler
+
+# A code object under construction.
+class builder(object):
+
+    def __init__(self):
+        self.ops = []
+        self.consts = []
+        self.const_ids = dict()         # Index of each shared constant by key
+        self.names = []
+        self.name_ids = dict()          # Index of each name
+        self.lines = []
+        self.line = None                # Line of the statement being compiled
+
+    # Add an instruction and return its position.
+    def emit(self, op, a=0, b=0):
+        self.ops.append([op, a, b])
+        self.lines.append(self.line)
+        return len(self.ops)-1
+
+    # Return the position of the next instruction.
+    def label(self):
+        return len(self.ops)
+
+    # Set the jump target of the instruction at the given position.
+    def patch(self, pos, target):
+        self.ops[pos][1] = target
+
+    # Return the index of the given name.
+    def name(self, name):
+        if name not in self.name_ids:
+            self.name_ids[name] = len(self.names)
+            self.names.append(name)
+        return self.name_ids[name]
+
+    # Return the index of the given constant, under the given key if it can be
+    # shared.
+    def const(self, val, key=None):
+        if key != None and key in self.const_ids: return self.const_ids[key]
+        self.consts.append(val)
+        if key != None: self.const_ids[key] = len(self.consts)-1
+        return len(self.consts)-1
+
+    # Return the code object.
+    def code(self):
+        return code([tuple(op) for op in self.ops], self.consts, self.names, self.lines)
+
+# Compile the given expression node.
+def compile_exp(b, exp):
+    exp = exp.children[0]
+    sym = exp.sym
+    terms = exp.children
+
+    if sym == 'exp':                        # Subexpression
+        compile_exp(b, exp)
+
+    elif sym == 'prim':                     # Primitive
+        prim = terms[0]
+        if prim.sym == 'num':
+            val = get_num(prim.value)
+            b.emit(CONST, b.const(number(val), ('num', type(val), val)))
+        elif prim.sym == 'str':
+            b.emit(CONST, b.const(string(prim.value), ('str', prim.value)))
+        else:
+            b.emit(LOAD, b.name(prim.value))
+
+    elif sym == 'assign':                   # Assignment
+        target = terms[0]
+        if target.sym == 'id':
+            compile_exp(b, terms[1])
+            b.emit(STORE, b.name(target.value))
+        else:
+            b.emit(LOAD_ARRAY, b.name(target.children[0].value))
+            compile_exp(b, target.children[1])
+            b.emit(VALUE)
+            compile_exp(b, terms[1])
+            b.emit(SET_INDEX)
+
+    elif sym == 'arrAcc':                   # Array access
+        name = b.name(terms[0].value)
+        b.emit(LOAD_LIST, name)
+        compile_exp(b, terms[1])
+        b.emit(GET_INDEX, name)
+
+    elif sym == 'funExp':                   # Function call
+        args = terms[1].children
+        for arg in args:
+            compile_exp(b, arg)
+        b.emit(CALL, b.const((terms[0].value, len(args))))
+
+    elif sym == 'arrExp':                   # Array expression
+        exps = terms[0].children
+        for e in exps:
+            compile_exp(b, e)
+        b.emit(ARRAY, len(exps))
+
+    elif sym == 'rngExp':                   # Range expression
+        compile_exp(b, terms[0])
+        compile_exp(b, terms[2])
+        b.emit(RANGE, 1 if terms[1].value == '..' else 0)
+
+    elif sym == 'arrComp':                  # Array comprehension
+        cond = filter_exp = None
+        if terms[2].sym == ':':
+            cond = terms[3]
+            if len(terms) > 4: filter_exp = terms[5]
+        else:
+            filter_exp = terms[3]
+        compile_exp(b, terms[1])
+        b.emit(COMP_START)
+        top = b.emit(COMP_NEXT, 0, b.name(terms[0].value))
+        if cond:
+            compile_exp(b, cond)
+            b.emit(COMP_TEST, top, 1 if filter_exp else 0)
+        elif filter_exp:
+            b.emit(POP)
+        if filter_exp: compile_exp(b, filter_exp)
+        b.emit(COMP_APPEND, top)
+        b.patch(top, b.label())
+
+    elif sym == 'arithExp':                 # Arithmetic expression
+        compile_exp(b, terms[0])
+        compile_exp(b, terms[2])
+        b.emit(arith_ops.get(terms[1].sym, POW))
+
+    elif len(terms) == 3:                   # Binary logical expression
+        compile_exp(b, terms[0])
+        compile_exp(b, terms[2])
+        b.emit(log_ops.get(terms[1].sym, GT))
+
+    else:                                   # Unary logical expression (not)
+        compile_exp(b, terms[1])
+        b.emit(NOT)
+
+# A loop that a break statement ends: the positions of the instructions that
+# jump to the end of the statement list holding the loop, the number of blocks
+# from the statement list holding the break to the loop, and whether it is a
+# for loop.
+class loop(object):
+
+    def __init__(self, ends, depth, is_for):
+        self.ends = ends
+        self.depth = depth
+        self.is_for = is_for
+
+    # Return the loop seen from a block nested in the current one.
+    def nested(self):
+        return loop(self.ends, self.depth+1, self.is_for)
+
+# Compile the given statement (a line or a block), given whether it is in a
+# function body and the loop it is in (or None), adding the positions of the
+# instructions that jump to the end of its statement list to the given ends.
+def compile_stm(b, stm, incall, inloop, ends):
+    b.line = stm.children[0].start_line
+    if stm.sym == 'line':                   # Line
+        stm = stm.children[0]
+        if stm.sym == 'break':              # Break
+            if not inloop: b.emit(RAISE, b.const('cannot break outside of a loop.'))
+            else:
+                op = BREAK_FOR if inloop.is_for else BREAK
+                inloop.ends.append(b.emit(op, 0, inloop.depth+1))
+        elif stm.sym == 'retStm':           # Return
+            if not incall: b.emit(RAISE, b.const('cannot return outside of a function call.'))
+            else:
+                if stm.children: compile_exp(b, stm.children[0])
+                else: b.emit(CONST, b.const(zero, ('num', int, 0)))
+                b.emit(RETURN)
+        elif stm.children[0].sym == 'assign' and stm.children[0].children[0].sym == 'id':
+            assign = stm.children[0].children   # Variable assignment
+            compile_exp(b, assign[1])
+            b.emit(ASSIGN, b.name(assign[0].value))
+        else:                               # Expression
+            compile_exp(b, stm)
+            b.emit(RES)
+        return
+
+    stm = stm.children[0]                   # Block
+    terms = stm.children
+    if stm.sym == 'funBlk':                 # Function declaration
+        args = [t.value for t in terms[1].children]
+        body = compile_code(terms[2].children, True)
+        b.emit(DEFINE, b.const((terms[0].value, args, body)))
+
+    elif stm.sym == 'ifBlk':                # If-else block
+        inner = inloop.nested() if inloop else None
+        compile_exp(b, terms[0])
+        test = b.emit(TEST)
+        b.emit(ENV)
+        leave1 = compile_stms(b, terms[1].children, incall, inner, LEAVE)
+        b.patch(test, b.label())
+        b.emit(ENV)
+        leave2 = compile_stms(b, terms[2].children, incall, inner, LEAVE)
+        b.patch(leave1, b.label())
+        b.patch(leave2, b.label())
+
+    elif stm.sym == 'whileBlk':             # While block
+        top = b.label()
+        compile_exp(b, terms[0])
+        test = b.emit(TEST)
+        b.emit(ENV)
+        compile_stms(b, terms[1].children, incall, loop(ends, 0, False), WHILE_END, top)
+        b.patch(test, b.label())
+
+    else:                                   # For block
+        compile_exp(b, terms[1])
+        b.emit(FOR_START)
+        top = b.emit(FOR_NEXT, 0, b.name(terms[0].value))
+        compile_stms(b, terms[2].children, incall, loop(ends, 0, True), FOR_END, top)
+        b.patch(top, b.label())
+
+# Compile the given list of statements, given whether it is in a function body
+# and the loop it is in (or None), and end it with the given instruction, which
+# takes the result of the list. Return the position of that instruction.
+def compile_stms(b, stms, incall, inloop, end, target=0):
+    line = b.line
+    ends = []
+    for stm in stms:
+        compile_stm(b, stm, incall, inloop, ends)
+        b.line = line
+    pos = b.emit(end, target)
+    for k in ends:
+        b.patch(k, pos)
+    return pos
+
+# Return the code object of the given list of statements, given whether it is
+# a function body.
+def compile_code(stms, incall=False):
+    b = builder()
+    b.emit(BLOCK)
+    compile_stms(b, stms, incall, None, RETURN)
+    return b.code()
+
+# VM
+
+# Run the given code object on the given environment stack and return the
+# result of its statement list (see execute.execute_stms). Bytecode functions
+# called by the code run in the same loop, each in a frame that starts at a
+# depth of the environment and value stacks. An error is tagged with the line
+# of the statement that raised it, unless it was already tagged.
+def run(c, envs):
+    frames = []                             # Code, position and depths of each caller
+    stack = []
+    push = stack.append
+    pop = stack.pop
+    ops, consts, names = c.ops, c.consts, c.names
+    pc = 0
+    base = len(envs)                        # Environment stack depth of the frame
+    sbase = 0                               # Value stack depth of the frame
+    try:
+        while True:
+            op, a, b = ops[pc]
+            pc += 1
+
+            if op < ENV:                        # Variables, jumps and calls
+                if op == LOAD:
+                    name = names[a]
+                    for env in reversed(envs):
+                        if name in env:
+                            push(env[name])
+                            break
+                    else:
+                        raise NameError('name "%s" is not defined.' % str(name))
+                elif op == CONST:
+                    push(consts[a])
+                elif op == RES:
+                    val = pop()
+                    stack[-1] = val
+                elif op == ASSIGN or op == STORE:
+                    val = pop() if op == ASSIGN else stack[-1]
+                    name = names[a]
+                    for env in reversed(envs):
+                        if name in env:
+                            env[name] = val
+                            break
+                    else:
+                        envs[-1][name] = val
+                    if op == ASSIGN: stack[-1] = val
+                elif op == TEST:
+                    if not pop().value: pc = a
+                elif op == JUMP:
+                    pc = a
+                else:                           # CALL
+                    fname, argc = consts[a]
+                    k = len(stack)-argc
+                    args = stack[k:]
+                    del stack[k:]
+                    for env in reversed(envs):
+                        if fname in env:
+                            f = env[fname]
+                            break
+                    else:
+                        raise NameError('name "%s" is not defined.' % str(fname))
+                    if type(f) == built_in_func:    # Built-in function
+                        push(f.value(*[arg.value for arg in args]))
+                        continue
+                    elif type(f) != func:
+                        raise TypeError('value %s : %s is not a function.' % (fname, type(f)))
+                    if len(f.args) != argc:         # Function
+                        raise SyntaxError('function "%s" expected %d arguments but got %s.' % (fname, len(f.args), argc))
+                    envs.append(dict(zip(f.args, args)))
+                    if type(f.code) == code:        # Bytecode function
+                        frames.append((c, pc, base, sbase))
+                        c = f.code
+                        ops, consts, names = c.ops, c.consts, c.names
+                        pc = 0
+                        base = len(envs)
+                        sbase = len(stack)
+                    else:                           # Function of another executor
+                        if not f.code: f.code = closures.compile_stms(f.body, True, False)
+                        res = f.code(envs)
+                        envs.pop()
+                        push(res.res)
+
+            elif op < ADD:                      # Blocks, loops and returns
+                if op == ENV:
+                    envs.append({})
+                    push(start)
+                elif op == LEAVE:
+                    envs.pop()
+                    val = pop()
+                    stack[-1] = val
+                    pc = a
+                elif op == WHILE_END:
+                    envs.pop()
+                    val = pop()
+                    stack[-1] = result(val, False, False)
+                    pc = a
+                elif op == FOR_NEXT:
+                    val = next(stack[-1], stack)
+                    if val is stack:            # End of the iteration
+                        pop()
+                        pc = a
+                    else:
+                        envs.append({ names[b]: val })
+                        push(start)
+                elif op == FOR_END:
+                    envs.pop()
+                    val = pop()
+                    stack[-2] = val
+                    pc = a
+                elif op == RETURN:
+                    val = pop()
+                    del envs[base:]
+                    del stack[sbase:]
+                    if not frames: return result(val, False, False)
+                    envs.pop()
+                    c, pc, base, sbase = frames.pop()
+                    ops, consts, names = c.ops, c.consts, c.names
+                    push(val)
+                elif op == COMP_NEXT:
+                    val = next(stack[-1], stack)
+                    if val is stack:            # End of the comprehension
+                        pop()
+                        stack[-1] = array(stack[-1])
+                        envs.pop()
+                        pc = a
+                    else:
+                        envs[-1][names[b]] = val
+                        push(val)
+                else:                           # COMP_TEST
+                    if not pop().value:
+                        pop()
+                        pc = a
+                    elif b:
+                        pop()
+
+            elif op < COMP_APPEND:              # Operators
+                if op == NOT:
+                    stack[-1] = number(not stack[-1].value)
+                    continue
+                r = pop()
+                l = stack[-1]
+                if op >= EQ:
+                    if op == EQ: stack[-1] = number(l.value == r.value)
+                    elif op == NE: stack[-1] = number(l.value != r.value)
+                    elif op == LE: stack[-1] = number(l.value <= r.value)
+                    elif op == GE: stack[-1] = number(l.value >= r.value)
+                    elif op == LT: stack[-1] = number(l.value < r.value)
+                    elif op == GT: stack[-1] = number(l.value > r.value)
+                    elif op == AND: stack[-1] = number(l.value and r.value)
+                    else: stack[-1] = number(l.value or r.value)
+                    continue
+                tl = type(l)
+                tr = type(r)
+                if tl == number and tr == number:
+                    if op == ADD: stack[-1] = number(l.value + r.value)
+                    elif op == SUB: stack[-1] = number(l.value - r.value)
+                    elif op == MUL: stack[-1] = number(l.value * r.value)
+                    elif op == MOD: stack[-1] = number(l.value % r.value)
+                    elif op == DIV:
+                        if r.value == 0: raise ArithmeticError('cannot divide by 0.')
+                        stack[-1] = number(l.value / r.value)
+                    else: stack[-1] = number(l.value ** r.value)
+                elif op != ADD:
+                    sym = ('-', '*', '/', '%%', '^')[op-SUB]
+                    raise TypeError(('cannot perform operation %s '+sym+' %s') % (tl, tr))
+                elif tl == string and tr == string:
+                    stack[-1] = string(l.value + r.value)
+                elif string in (tl, tr) and number in (tl, tr):
+                    stack[-1] = string(str(l.value) + str(r.value))
+                elif tl == array and tr == array:
+                    stack[-1] = array(l.value + r.value)
+                else:
+                    raise TypeError('cannot perform operation %s + %s' % (tl, tr))
+
+            elif op < ARRAY:                    # Arrays
+                if op == COMP_APPEND:
+                    val = pop()
+                    stack[-2].append(val)
+                    pc = a
+                elif op == LOAD_LIST or op == LOAD_ARRAY:
+                    name = names[a]
+                    for env in reversed(envs):
+                        if name in env:
+                            val = env[name].value
+                            break
+                    else:
+                        raise NameError('name "%s" is not defined.' % str(name))
+                    if op == LOAD_LIST and type(val) != list:
+                        raise TypeError('cannot index into %s : %s.' % (name, type(val)))
+                    push(val)
+                elif op == GET_INDEX:
+                    i = pop().value
+                    arr = stack[-1]
+                    if i < 0 or i >= len(arr):
+                        raise IndexError('cannot access index %d of array "%s".' % (i, names[a]))
+                    stack[-1] = arr[i]
+                elif op == COMP_START:
+                    arr = pop().value
+                    if type(arr) != list:
+                        raise TypeError('cannot index into type %s.' % type(arr))
+                    push([])
+                    push(iter(arr))
+                    envs.append({})
+                elif op == FOR_START:
+                    push(iter(pop().value))
+                elif op == VALUE:
+                    stack[-1] = stack[-1].value
+                else:                           # SET_INDEX
+                    val = pop()
+                    i = pop()
+                    stack[-1][i] = val
+                    stack[-1] = val
+
+            elif op == ARRAY:                   # Everything else
+                k = len(stack)-a
+                vals = stack[k:]
+                del stack[k:]
+                push(array(vals))
+            elif op == RANGE:
+                h = pop()
+                l = stack[-1]
+                if type(l) == type(h) and type(l) == number:
+                    stack[-1] = array([number(i) for i in range(l.value, h.value+a)])
+                else:
+                    raise IndexError('cannot have range %s%s%s.' % (type(l), '..' if a else '...', type(h)))
+            elif op == BLOCK:
+                push(start)
+            elif op == POP:
+                pop()
+            elif op == BREAK or op == BREAK_FOR:
+                del envs[len(envs)-b:]
+                del stack[len(stack)-b-(op == BREAK_FOR):]
+                stack[-1] = zero
+                pc = a
+            elif op == DEFINE:
+                fname, args, body = consts[a]
+                f = func(fname, args, None, body)
+                for env in reversed(envs):
+                    if fname in env:
+                        env[fname] = f
+                        stack[-1] = None
+                        break
+                else:
+                    envs[-1][fname] = f
+                    stack[-1] = f
+            else:                               # RAISE
+                raise SyntaxError(consts[a])
+
+    except Exception as err:
+        if not hasattr(err, 'line'): err.line = c.lines[pc-1]
+        raise
+
+# Execute the program.
+def execute(envs, stms):
+    return run(compile_code(stms), envs)
+
+# Serialization.
+# A code object is serialized with marshal as a tuple of its instructions,
+# constants, names and lines, where each constant is a tagged tuple: a number,
+# a string, an error message, a call site or a function template, whose code
+# is serialized the same way. Loading serialized code never runs any of it.
+
+# Return the marshallable tuple of the given code object.
+def code_tuple(c):
+    consts = []
+    for val in c.consts:
+        if type(val) == number: consts.append(('num', val.value))
+        elif type(val) == string: consts.append(('str', val.value))
+        elif type(val) == str: consts.append(('msg', val))
+        elif len(val) == 3: consts.append(('fun', val[0], tuple(val[1]), code_tuple(val[2])))
+        else: consts.append(('call',) + val)
+    return (tuple(c.ops), tuple(consts), tuple(c.names), tuple(c.lines))
+
+# Return the code object of the given tuple (see code_tuple).
+def tuple_code(t):
+    ops, consts, names, lines = t
+    res = []
+    for val in consts:
+        if val[0] == 'num': res.append(number(val[1]))
+        elif val[0] == 'str': res.append(string(intern(val[1])))
+        elif val[0] == 'msg': res.append(val[1])
+        elif val[0] == 'fun': res.append((intern(val[1]), [intern(arg) for arg in val[2]], tuple_code(val[3])))
+        else: res.append((intern(val[1]), val[2]))
+    return code(list(ops), res, [intern(name) for name in names], list(lines))
+
+# Return the given code object serialized as bytes.
+def dumps(c):
+    return marshal.dumps((magic, version, code_tuple(c)))
+
+# Return the code object serialized in the given bytes. Raise an error if they
+# are not serialized code of this version.
+def loads(data):
+    try:
+        t = marshal.loads(data)
+    except (EOFError, ValueError, TypeError):
+        t = None
+    if type(t) != tuple or len(t) != 3 or t[0] != magic or t[1] != version:
+        raise ValueError('not version %d serialized Slang bytecode.' % version)
+    return tuple_code(t[2])
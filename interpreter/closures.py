@@ -0,0 +1,386 @@
+# The Slang closure compiler
+# Compiles Slang statements into Python closures and executes them.
+#
+# Every node of the tree is compiled once into a closure that has its operator,
+# literal values and the closures of its children bound, so running a program
+# only calls closures instead of dispatching on node symbols over and over (see
+# execute.evaluate and execute.execute_stms, whose behavior the closures match
+# exactly). Expressions compile to functions of the environment stack that
+# return a value. Statements compile either to such functions, or, if they can
+# end their statement list early (see control), to functions of the
+# environment stack and the current result that return a pair of the new
+# result and the result to end the statement list with (or None).
+
+from .execute import number, string, array, func, built_in_func, result, get_num
+
+# Return the nearest value assigned to the variable name (see execute.find).
+def find(envs, name):
+    for env in reversed(envs):
+        if name in env:
+            return env[name]
+    raise NameError('name "%s" is not defined.' % str(name))
+
+# Return the evaluation of the given function on its arguments (see
+# execute.call). The body of a function defined by the tree-walking executor is
+# compiled on its first call.
+def call(envs, fname, args):
+    f = find(envs, fname)
+    if type(f) == built_in_func:            # Built-in function
+        return f.value(*[arg.value for arg in args])
+    elif type(f) != func:
+        raise TypeError('value %s : %s is not a function.' % (fname, type(f)))
+    if len(f.args) != len(args):            # Function
+        raise SyntaxError('function "%s" expected %d arguments but got %s.' % (fname, len(f.args), len(args)))
+    if not f.code: f.code = compile_stms(f.body, True, False)
+    envs.append(dict(zip(f.args, args)))
+    res = f.code(envs)
+    envs.pop()
+    return res.res
+
+# Expressions
+
+# Return the closure of the given expression node.
+def compile_exp(exp):
+    exp = exp.children[0]
+    return compilers[exp.sym](exp)
+
+# Return the closure of a subexpression.
+def compile_sub(exp):
+    return compile_exp(exp)
+
+# Return the closure of a primitive. Number and string values are made once.
+def compile_prim(exp):
+    prim = exp.children[0]
+    if prim.sym == 'num' or prim.sym == 'str':
+        val = number(get_num(prim.value)) if prim.sym == 'num' else string(prim.value)
+        return lambda envs: val
+    name = prim.value
+    def run(envs):
+        for env in reversed(envs):
+            if name in env:
+                return env[name]
+        raise NameError('name "%s" is not defined.' % str(name))
+    return run
+
+# Return the closure of an assignment.
+def compile_assign(exp):
+    target, rhs = exp.children
+    rhs = compile_exp(rhs)
+    if target.sym == 'id':
+        var = target.value
+        def run(envs):
+            val = rhs(envs)
+            for env in reversed(envs):
+                if var in env:
+                    env[var] = val
+                    return val
+            envs[-1][var] = val
+            return val
+    else:
+        name, ind = target.children
+        name = name.value
+        ind = compile_exp(ind)
+        def run(envs):
+            arr = find(envs, name).value
+            i = ind(envs).value
+            val = rhs(envs)
+            arr[i] = val
+            return val
+    return run
+
+# Return the closure of an array access.
+def compile_arrAcc(exp):
+    name, ind = exp.children
+    name = name.value
+    ind = compile_exp(ind)
+    def run(envs):
+        arr = find(envs, name).value
+        if type(arr) != list:
+            raise TypeError('cannot index into %s : %s.' % (name, type(arr)))
+        i = ind(envs).value
+        if i < 0 or i >= len(arr):
+            raise IndexError('cannot access index %d of array "%s".' % (i, name))
+        return arr[i]
+    return run
+
+# Return the closure of a function call.
+def compile_funExp(exp):
+    fname, args = exp.children
+    fname = fname.value
+    args = [compile_exp(arg) for arg in args.children]
+    return lambda envs: call(envs, fname, [arg(envs) for arg in args])
+
+# Return the closure of an array expression.
+def compile_arrExp(exp):
+    exps = [compile_exp(e) for e in exp.children[0].children]
+    return lambda envs: array([e(envs) for e in exps])
+
+# Return the closure of a range expression.
+def compile_rngExp(exp):
+    lo, op, hi = exp.children
+    lo, hi = compile_exp(lo), compile_exp(hi)
+    op = op.value
+    extra = 1 if op == '..' else 0
+    def run(envs):
+        l = lo(envs)
+        h = hi(envs)
+        if type(l) == type(h) and type(l) == number:
+            return array([number(i) for i in range(l.value, h.value+extra)])
+        raise IndexError('cannot have range %s%s%s.' % (type(l), op, type(h)))
+    return run
+
+# Return the closure of an array comprehension.
+def compile_arrComp(exp):
+    terms = exp.children
+    ind = terms[0].value
+    arr_exp = compile_exp(terms[1])
+    cond = filter_exp = None
+    if terms[2].sym == ':':
+        cond = compile_exp(terms[3])
+        if len(terms) > 4: filter_exp = compile_exp(terms[5])
+    else:
+        filter_exp = compile_exp(terms[3])
+    def run(envs):
+        arr = arr_exp(envs).value
+        if type(arr) != list:
+            raise TypeError('cannot index into type %s.' % type(arr))
+        res_arr = []
+        env = {}
+        envs.append(env)
+        for val in arr:
+            env[ind] = val
+            if not cond or cond(envs).value:
+                if filter_exp:
+                    val = filter_exp(envs)
+                res_arr.append(val)
+        envs.pop()
+        return array(res_arr)
+    return run
+
+# Return the closure of an operator on the values of two operand closures that
+# checks that both values are numbers and applies the given function to them.
+def number_op(left, right, sym, f):
+    def run(envs):
+        l = left(envs)
+        r = right(envs)
+        if type(l) == number and type(r) == number:
+            return number(f(l.value, r.value))
+        raise TypeError('cannot perform operation %s %s %s' % (type(l), sym, type(r)))
+    return run
+
+# Return the closure of an addition of the values of two operand closures.
+def add_op(left, right):
+    def run(envs):
+        l = left(envs)
+        r = right(envs)
+        tl = type(l)
+        tr = type(r)
+        if tl == number and tr == number:
+            return number(l.value + r.value)
+        elif tl == string and tr == string:
+            return string(l.value + r.value)
+        elif string in (tl, tr) and number in (tl, tr):
+            return string(str(l.value) + str(r.value))
+        elif tl == array and tr == array:
+            return array(l.value + r.value)
+        raise TypeError('cannot perform operation %s + %s' % (tl, tr))
+    return run
+
+# Return the closure of a division of the values of two operand closures.
+def div_op(left, right):
+    def run(envs):
+        l = left(envs)
+        r = right(envs)
+        if type(l) == number and type(r) == number:
+            if r.value != 0:
+                return number(l.value / r.value)
+            raise ArithmeticError('cannot divide by 0.')
+        raise TypeError('cannot perform operation %s / %s' % (type(l), type(r)))
+    return run
+
+# Return the closure of an arithmetic expression.
+def compile_arithExp(exp):
+    left, op, right = exp.children
+    left, right = compile_exp(left), compile_exp(right)
+    if op.sym == '+': return add_op(left, right)
+    elif op.sym == '-': return number_op(left, right, '-', lambda l, r: l - r)
+    elif op.sym == '/': return div_op(left, right)
+    elif op.sym == '*': return number_op(left, right, '*', lambda l, r: l * r)
+    elif op.sym == '%': return number_op(left, right, '%', lambda l, r: l % r)
+    return number_op(left, right, '^', lambda l, r: l ** r)
+
+# Functions of the operands of the binary logical operators
+log_ops = {
+    '&&': lambda l, r: l.value and r.value,
+    '||': lambda l, r: l.value or r.value,
+    '==': lambda l, r: l.value == r.value,
+    '!=': lambda l, r: l.value != r.value,
+    '<=': lambda l, r: l.value <= r.value,
+    '>=': lambda l, r: l.value >= r.value,
+    '<': lambda l, r: l.value < r.value,
+    '>': lambda l, r: l.value > r.value
+}
+
+# Return the closure of a logical expression.
+def compile_logExp(exp):
+    terms = exp.children
+    if len(terms) == 3:                     # Binary expression
+        left, right = compile_exp(terms[0]), compile_exp(terms[2])
+        f = log_ops.get(terms[1].sym, log_ops['>'])
+        def run(envs):
+            l = left(envs)
+            r = right(envs)
+            return number(f(l, r))
+        return run
+    operand = compile_exp(terms[1])         # Unary expression (not)
+    return lambda envs: number(not operand(envs).value)
+
+# Expression compiler of each expression symbol
+compilers = {
+    'exp': compile_sub,
+    'prim': compile_prim,
+    'assign': compile_assign,
+    'arrAcc': compile_arrAcc,
+    'funExp': compile_funExp,
+    'arrExp': compile_arrExp,
+    'rngExp': compile_rngExp,
+    'arrComp': compile_arrComp,
+    'arithExp': compile_arithExp,
+    'logExp': compile_logExp
+}
+
+# Statements
+
+# Mark the given statement closure as one that can end its statement list.
+def control(f):
+    f.control = True
+    return f
+
+# Return the closure of a function declaration.
+def compile_funBlk(stm):
+    fname, args, body = stm.children
+    fname = fname.value
+    args = [t.value for t in args.children]
+    body = body.children
+    code = compile_stms(body, True, False)
+    def run(envs):
+        f = func(fname, args, body, code)
+        for env in reversed(envs):
+            if fname in env:
+                env[fname] = f
+                return
+        envs[-1][fname] = f
+        return f
+    return run
+
+# Return the closure of an if-else block.
+def compile_ifBlk(stm, incall, inloop):
+    cond, stms1, stms2 = stm.children
+    cond = compile_exp(cond)
+    stms1 = compile_stms(stms1.children, incall, inloop)
+    stms2 = compile_stms(stms2.children, incall, inloop)
+    def run(envs, res):
+        c = cond(envs).value
+        envs.append({})
+        if c:   r = stms1(envs)
+        else:   r = stms2(envs)
+        envs.pop()
+        if r.brk or r.ret: return (res, r)
+        return (r.res, None)
+    return control(run)
+
+# Return the closure of a while block.
+def compile_whileBlk(stm, incall, inloop):
+    cond, stms = stm.children
+    cond = compile_exp(cond)
+    stms = compile_stms(stms.children, incall, True)
+    def run(envs, res):
+        c = cond(envs).value
+        while c:
+            envs.append({})
+            res = stms(envs)
+            envs.pop()
+            if res.ret:
+                return (res, res)
+            elif res.brk:
+                res.brk = False
+                return (res, res)
+            c = cond(envs).value
+        return (res, None)
+    return control(run)
+
+# Return the closure of a for block.
+def compile_forBlk(stm, incall, inloop):
+    ind, arr_exp, stms = stm.children
+    ind = ind.value
+    arr_exp = compile_exp(arr_exp)
+    stms = compile_stms(stms.children, incall, True)
+    def run(envs, res):
+        arr = arr_exp(envs).value
+        for val in arr:
+            envs.append({ ind: val })
+            res = stms(envs)
+            envs.pop()
+            if res.ret:
+                return (res, res)
+            elif res.brk:
+                res.brk = False
+                return (res, res)
+            res = res.res
+        return (res, None)
+    return control(run)
+
+# Return the closure of a statement that raises the given error.
+def compile_error(err, msg):
+    def run(envs):
+        raise err(msg)
+    return run
+
+# Return the closure of the given statement (a line or a block), given
+# whether it is in a function body and in a loop.
+def compile_stm(stm, incall, inloop):
+    if stm.sym == 'line':                   # Line
+        stm = stm.children[0]
+        if stm.sym == 'break':              # Break
+            if not inloop: return compile_error(SyntaxError, 'cannot break outside of a loop.')
+            return control(lambda envs, res: (res, result.brk(number(0))))
+        elif stm.sym == 'retStm':           # Return
+            if not incall: return compile_error(SyntaxError, 'cannot return outside of a function call.')
+            if stm.children:
+                exp = compile_exp(stm.children[0])
+                return control(lambda envs, res: (res, result.ret(exp(envs))))
+            return control(lambda envs, res: (res, result.ret(number(0))))
+        return compile_exp(stm)             # Expression
+    stm = stm.children[0]                   # Block
+    if stm.sym == 'funBlk': return compile_funBlk(stm)
+    elif stm.sym == 'ifBlk': return compile_ifBlk(stm, incall, inloop)
+    elif stm.sym == 'whileBlk': return compile_whileBlk(stm, incall, inloop)
+    return compile_forBlk(stm, incall, inloop)
+
+# Return the closure of a list of statements, given whether it is a function
+# body and whether it is in a loop. The closure returns a result object (see
+# execute.execute_stms). An error raised by a statement is tagged with the
+# statement's start line, unless a nested statement already tagged it.
+def compile_stms(stms, incall, inloop):
+    steps = []
+    for stm in stms:
+        f = compile_stm(stm, incall, inloop)
+        steps.append((f, hasattr(f, 'control'), stm.children[0].start_line))
+    def run(envs):
+        res = result.res(number(0))
+        try:
+            for (f, ctl, line) in steps:
+                if ctl:
+                    res, out = f(envs, res)
+                    if out: return out
+                else:
+                    res = f(envs)
+        except Exception as err:
+            if not hasattr(err, 'line'): err.line = line
+            raise
+        return result.res(res)
+    return run
+
+# Execute the program.
+def execute(envs, stms):
+    return compile_stms(stms, False, False)(envs)
@@ -34,10 +34,11 @@ class array(object):
 
 class func(object):
 
-    def __init__(self, name, args, body):
+    def __init__(self, name, args, body, code=None):
         self.name = name
         self.args = args
         self.body = body
+        self.code = code                # Compiled body (see closures.compile_stms and bytecode.code)
 
     def __repr__(self):
         return 'func(%s)' % (str(self.name))
@@ -88,7 +89,8 @@ def call(envs, fname, args):
     fenv = { farg: arg for (farg, arg) in zip(f.args, args) }
     # print(fenv)
     envs.append(fenv)
-    res = execute_stms(envs, True, False, f.body)
+    if f.body == None: res = f.code(envs)   # Compiled function (see bytecode.code)
+    else: res = execute_stms(envs, True, False, f.body)
     envs.pop()
     return res.res
 
@@ -354,80 +356,85 @@ class result(object):
     def brk(res):
         return result(res, False, True)
 
-# Execute a list of statements.
+# Execute a list of statements. An error raised by a statement is tagged with
+# the statement's start line, unless a nested statement already tagged it.
 def execute_stms(envs, incall, inloop, stms):
     # print('execute: %s' % (stms))
     res = result.res(number(0))
-    for stm in stms:
-        if match(stm, 'line'):              # Line
-            stm = sub(stm)
-            if match(stm, 'break'):         # Break
-                # print('-> break')
-                if not inloop:          raise SyntaxError('cannot break outside of a loop.')
-                else:                   return result.brk(number(0))
-            terms = subs(stm)
-            if match(stm, 'retStm'):        # Return
-                # print('-> retStm')
-                if not incall:          raise SyntaxError('cannot return outside of a function call.')
-                elif len(terms) > 0:    return result.ret(evaluate(envs, terms[0]))
-                else:                   return result.ret(number(0))
-            elif match(stm, 'exp'):         # Expression
-                # print('-> exp')
-                res = evaluate(envs, stm)
-        else:                               # Block
-            stm = sub(stm)
-            if match(stm, 'funBlk'):        # Function declaration
-                # print('-> funBlk')
-                terms = subs(stm)
-                fname = terms[0].value
-                args = [t.value for t in subs(terms[1])]
-                body = subs(terms[2])
-                res = bind(envs, fname, func(fname, args, body))
-            elif match(stm, 'ifBlk'):       # If-else block
-                # print('-> ifBlk')
-                terms = subs(stm)
-                cond = unwrap(evaluate(envs, terms[0]))
-                stms1 = subs(terms[1])
-                stms2 = subs(terms[2])
-                envs.append({})
-                if cond:        res = execute_stms(envs, incall, inloop, stms1)
-                else:           res = execute_stms(envs, incall, inloop, stms2)
-                envs.pop()
-                if res.brk or res.ret:
-                    return res
-                else:
-                    res = res.res
-            elif match(stm, 'whileBlk'):    # While block
-                # print('-> whileBlk')
+    try:
+        for stm in stms:
+            if match(stm, 'line'):              # Line
+                stm = sub(stm)
+                if match(stm, 'break'):         # Break
+                    # print('-> break')
+                    if not inloop:          raise SyntaxError('cannot break outside of a loop.')
+                    else:                   return result.brk(number(0))
                 terms = subs(stm)
-                stms = subs(terms[1])
-                cond = unwrap(evaluate(envs, terms[0]))
-                while cond:
+                if match(stm, 'retStm'):        # Return
+                    # print('-> retStm')
+                    if not incall:          raise SyntaxError('cannot return outside of a function call.')
+                    elif len(terms) > 0:    return result.ret(evaluate(envs, terms[0]))
+                    else:                   return result.ret(number(0))
+                elif match(stm, 'exp'):         # Expression
+                    # print('-> exp')
+                    res = evaluate(envs, stm)
+            else:                               # Block
+                stm = sub(stm)
+                if match(stm, 'funBlk'):        # Function declaration
+                    # print('-> funBlk')
+                    terms = subs(stm)
+                    fname = terms[0].value
+                    args = [t.value for t in subs(terms[1])]
+                    body = subs(terms[2])
+                    res = bind(envs, fname, func(fname, args, body))
+                elif match(stm, 'ifBlk'):       # If-else block
+                    # print('-> ifBlk')
+                    terms = subs(stm)
+                    cond = unwrap(evaluate(envs, terms[0]))
+                    stms1 = subs(terms[1])
+                    stms2 = subs(terms[2])
                     envs.append({})
-                    res = execute_stms(envs, incall, True, stms)
+                    if cond:        res = execute_stms(envs, incall, inloop, stms1)
+                    else:           res = execute_stms(envs, incall, inloop, stms2)
                     envs.pop()
-                    if res.ret:
-                        return res
-                    elif res.brk:
-                        res.brk = False
+                    if res.brk or res.ret:
                         return res
+                    else:
+                        res = res.res
+                elif match(stm, 'whileBlk'):    # While block
+                    # print('-> whileBlk')
+                    terms = subs(stm)
+                    stms = subs(terms[1])
                     cond = unwrap(evaluate(envs, terms[0]))
-            else:                           # For block
-                # print('-> forBlk')
-                terms = subs(stm)
-                ind = terms[0].value
-                arr = unwrap(evaluate(envs, terms[1]))
-                stms = subs(terms[2])
-                for val in arr:
-                    envs.append({ ind: val })
-                    res = execute_stms(envs, incall, True, stms)
-                    envs.pop()
-                    if res.ret:
-                        return res
-                    elif res.brk:
-                        res.brk = False
-                        return res
-                    res = res.res
+                    while cond:
+                        envs.append({})
+                        res = execute_stms(envs, incall, True, stms)
+                        envs.pop()
+                        if res.ret:
+                            return res
+                        elif res.brk:
+                            res.brk = False
+                            return res
+                        cond = unwrap(evaluate(envs, terms[0]))
+                else:                           # For block
+                    # print('-> forBlk')
+                    terms = subs(stm)
+                    ind = terms[0].value
+                    arr = unwrap(evaluate(envs, terms[1]))
+                    stms = subs(terms[2])
+                    for val in arr:
+                        envs.append({ ind: val })
+                        res = execute_stms(envs, incall, True, stms)
+                        envs.pop()
+                        if res.ret:
+                            return res
+                        elif res.brk:
+                            res.brk = False
+                            return res
+                        res = res.res
+    except Exception as err:
+        if not hasattr(err, 'line'): err.line = stm.start_line
+        raise
     return result.res(res)
 
 # Execute the program.
@@ -1,4 +1,4 @@
 # Slang lexgen package.
 
 __version__ = '3.5'
-__all__ = ['tok', 'lexgen']
\ No newline at end of file
+__all__ = ['tok', 'lexgen', 'dfa', 'bench']
\ No newline at end of file
@@ -0,0 +1,178 @@
+# Lexer benchmarks
+# Measures the throughput and peak memory of the generated lexer (lex.py) on
+# synthetic Slang programs of increasing size, and writes the results as JSON.
+#
+# Programs are grown from the example programs in examples/ in several
+# flavors: the examples as they are, deeply nested blocks and parentheses, long
+# string literals, comment-heavy code, and many distinct identifiers. Each
+# program is lexed both through the token generator and into a token buffer.
+#
+# Run from the Slang directory as
+#
+#       python3 -m lexgen.bench [ -o path ] [ size ] *
+#
+# where "path" is a file to write the JSON to (defaults to stdout) and "size"
+# is a program size in characters (defaults to 64K, 256K and 1M).
+
+import json, sys, time, tracemalloc
+from os import listdir, path
+from . import lex
+
+# Configuration variables
+
+ex_path = path.join(path.dirname(__file__), '..', 'examples')
+sizes = [1 << 16, 1 << 18, 1 << 20]         # Default program sizes
+repeat = 3                                  # Timed runs per measurement (best is kept)
+depth = 64                                  # Nesting depth of nested programs
+str_len = 2048                              # Length of string literals
+
+# Return the example programs joined into one string.
+def seed():
+    fnames = sorted(f for f in listdir(ex_path) if f.endswith('.slang'))
+    return '\n'.join(open(path.join(ex_path, f), 'r').read() for f in fnames)
+
+# Return the string repeated with the given function of the repetition number
+# until it is at least size characters long.
+def grow(size, part):
+    res = []
+    total = 0
+    k = 0
+    while total < size:
+        s = part(k)
+        res.append(s)
+        total += len(s)
+        k += 1
+    return '\n'.join(res)
+
+# Program generators. Each takes the seed program and a size.
+
+# Return the examples repeated.
+def gen_examples(src, size):
+    return grow(size, lambda k: src)
+
+# Return the examples nested inside loops and a deeply parenthesized
+# expression.
+def gen_nesting(src, size):
+    parens = 'x = %s1%s;\n' % ('('*depth, ')'*depth)
+    part = 'while (0) {\n'*depth + parens + src + '\n}'*depth
+    return grow(size, lambda k: part)
+
+# Return the examples with a long string literal after every line.
+def gen_strings(src, size):
+    text = src.replace('"', '')
+    text = (text * (str_len//max(len(text), 1) + 1))[:str_len]
+    lit = 's = "%s";' % text
+    lines = src.split('\n')
+    return grow(size, lambda k: lines[k % len(lines)] + '\n' + lit)
+
+# Return the examples with every line followed by commented out copies.
+def gen_comments(src, size):
+    lines = src.split('\n')
+    return grow(size, lambda k: '%s\n# %s\n#%s' % ((lines[k % len(lines)],)*3))
+
+# Return the examples with every identifier renamed uniquely in each
+# repetition.
+def gen_identifiers(src, size):
+    l = lex.lexer()
+    l.set_str(src)
+    buf = l.buffer()
+    spans = [(buf.start(i), buf.end(i)) for i in range(len(buf)) if buf.label(i) == 'id']
+    def part(k):
+        res = []
+        pos = 0
+        for (start, end) in spans:
+            res.append(src[pos:end])
+            res.append('_%d' % k)
+            pos = end
+        res.append(src[pos:])
+        return ''.join(res)
+    return grow(size, part)
+
+generators = [
+    ('examples', gen_examples),
+    ('nesting', gen_nesting),
+    ('strings', gen_strings),
+    ('comments', gen_comments),
+    ('identifiers', gen_identifiers)
+]
+
+# Return the number of tokens lexed from the program string in the given mode,
+# either "tokens" (token generator) or "buffer" (token buffer).
+def run(l, src, mode):
+    l.set_str(src)
+    if mode == 'buffer': return len(l.buffer())
+    l.reset()
+    return sum(1 for _ in l.tokens)
+
+# Return the measurements for lexing the program string in the given mode.
+def measure(src, mode):
+    l = lex.lexer()
+    best = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        count = run(l, src, mode)
+        t = time.perf_counter() - t
+        best = t if best == None else min(best, t)
+
+    # Measure peak memory separately, since tracing slows lexing down
+    tracemalloc.start()
+    run(l, src, mode)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'mode': mode,
+        'bytes': len(src.encode('utf-8')),
+        'chars': len(src),
+        'tokens': count,
+        'seconds': best,
+        'tokens_per_sec': count/best if best else None,
+        'bytes_per_sec': len(src.encode('utf-8'))/best if best else None,
+        'peak_bytes': peak
+    }
+
+# Return the benchmark report for the given program sizes. The scaling entry
+# of each program flavor and mode is the ratio of the byte throughput on the
+# largest program to that on the smallest, which stays near 1 if lexing is
+# linear.
+def bench(sizes=sizes):
+    src = seed()
+    results = []
+    scaling = dict()
+    for (kind, gen) in generators:
+        for mode in ('tokens', 'buffer'):
+            rates = []
+            for size in sorted(sizes):
+                res = measure(gen(src, size), mode)
+                res['program'] = kind
+                res['size'] = size
+                results.append(res)
+                rates.append(res['bytes_per_sec'])
+            if rates[0] and rates[-1]:
+                scaling['%s/%s' % (kind, mode)] = rates[-1]/rates[0]
+    return {
+        'backend': lex.backend,
+        'python': sys.version.split()[0],
+        'repeat': repeat,
+        'results': results,
+        'scaling': scaling
+    }
+
+# When executed, write the benchmark report for the given sizes to stdout or to
+# the file given with "-o".
+if __name__ == "__main__":
+    from sys import argv
+    args = argv[1:]
+    out = None
+    if args[:1] == ['-o']:
+        out = args[1] if len(args) > 1 and args[1][:1] != '-' else ''  # Path, or '' if none
+        args = args[2:]
+    if out == '' or not all(arg.isdigit() and int(arg) for arg in args):
+        raise ValueError('expected arguments [-o path] size*.')
+    report = bench([int(arg) for arg in args] or sizes)
+    if out:
+        f = open(out, 'w')
+        json.dump(report, f, indent=2)
+        f.close()
+    else:
+        print(json.dumps(report, indent=2))
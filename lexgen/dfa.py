@@ -0,0 +1,420 @@
+# DFA
+# Compiles a token spec (the triples returned by lexgen.parse_spec) into a
+# single minimized DFA with longest-match semantics. Ties between rules that
+# match the same longest prefix go to the rule listed first in the triples, so
+# literals still beat patterns (e.g. "for" is a keyword but "format" is an id).
+#
+# Patterns are parsed as a subset of the Python re syntax: literal and escaped
+# characters, ".", character classes (with ranges, negation, and the \d, \s, \w
+# escapes and their negations), groups (plain, "(?:...)" and "(?P<name>...)"),
+# alternation and the greedy quantifiers *, +, ? and {m,n}. Anchors,
+# lookarounds, backreferences and lazy quantifiers raise a SyntaxError since a
+# DFA cannot express them. As with the regex lexer, "." also matches newlines.
+#
+# Characters are grouped into classes of code points that no pattern tells
+# apart. A DFA row has one column per ASCII code point followed by one column
+# per class, so the lexer can index ASCII characters directly and only needs to
+# bisect the class boundaries for other characters.
+
+import re
+from bisect import bisect_right
+
+max_char = 0x10FFFF                         # Largest code point
+ascii_size = 128                            # Number of directly indexed columns
+
+# Character sets
+
+# A character set is a tuple of sorted, disjoint, non-adjacent (lo, hi) code
+# point intervals, both ends inclusive.
+
+# Return the normalized character set for the given intervals.
+def charset(intervals):
+    res = []
+    for (lo, hi) in sorted(intervals):
+        if res and lo <= res[-1][1]+1:
+            res[-1] = (res[-1][0], max(hi, res[-1][1]))
+        else:
+            res.append((lo, hi))
+    return tuple(res)
+
+# Return the complement of the character set.
+def negate(cs):
+    res = []
+    lo = 0
+    for (a, b) in cs:
+        if a > lo: res.append((lo, a-1))
+        lo = b+1
+    if lo <= max_char: res.append((lo, max_char))
+    return tuple(res)
+
+all_chars = ((0, max_char),)
+class_cache = dict()
+
+# Return the character set matched by the given re character class escape (one
+# of \d, \s, \w), computed from the re module so the DFA agrees with it.
+def char_class(esc):
+    if esc not in class_cache:
+        chars = ''.join(chr(c) for c in range(max_char+1))
+        class_cache[esc] = charset((m.start(), m.end()-1)
+                                   for m in re.finditer(esc+'+', chars))
+    return class_cache[esc]
+
+# Regex parsing
+
+# Patterns are parsed into a small syntax tree of tuples:
+#
+#       ('set', cs)                 a single character from character set cs
+#       ('cat', [node, ...])        concatenation (empty for the empty string)
+#       ('alt', [node, ...])        alternation
+#       ('rep', node, lo, hi)       lo to hi repetitions (hi None if unbounded)
+
+simple_escapes = { 'n': '\n', 't': '\t', 'r': '\r', 'f': '\f', 'v': '\v',
+                   'a': '\a', '0': '\0' }
+quant = re.compile(r'\{(\d*)(,(\d*))?\}')
+
+# A recursive descent parser for a single pattern.
+class regex_parser(object):
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.pos = 0
+
+    # Raise a SyntaxError for the pattern.
+    def error(self, msg):
+        raise SyntaxError('pattern "%s", offset %d: %s.' % (self.pattern, self.pos, msg))
+
+    # Return the next character without consuming it, or None at the end.
+    def peek(self):
+        if self.pos < len(self.pattern): return self.pattern[self.pos]
+        return None
+
+    # Consume and return the next character.
+    def take(self):
+        if self.pos >= len(self.pattern): self.error('unexpected end of pattern')
+        c = self.pattern[self.pos]
+        self.pos += 1
+        return c
+
+    # Return the syntax tree of the whole pattern.
+    def parse(self):
+        node = self.alt()
+        if self.pos != len(self.pattern): self.error('unbalanced parenthesis')
+        return node
+
+    # alt := seq ( "|" seq )*
+    def alt(self):
+        alts = [self.seq()]
+        while self.peek() == '|':
+            self.pos += 1
+            alts.append(self.seq())
+        return alts[0] if len(alts) == 1 else ('alt', alts)
+
+    # seq := ( atom quantifier? )*
+    def seq(self):
+        items = []
+        while self.peek() not in (None, '|', ')'):
+            atom = self.atom()
+            items.append(self.quantified(atom))
+        return items[0] if len(items) == 1 else ('cat', items)
+
+    # Return the atom wrapped in any quantifier that follows it.
+    def quantified(self, atom):
+        while True:
+            c = self.peek()
+            if c == '*':   lo, hi = 0, None
+            elif c == '+': lo, hi = 1, None
+            elif c == '?': lo, hi = 0, 1
+            elif c == '{':
+                m = quant.match(self.pattern, self.pos)
+                if not m or m.group(0) == '{}' or m.group(0) == '{,}': return atom
+                lo = int(m.group(1)) if m.group(1) else 0
+                if not m.group(2):    hi = lo
+                elif m.group(3):      hi = int(m.group(3))
+                else:                 hi = None
+                if hi != None and hi < lo: self.error('bad repetition range')
+                self.pos = m.end() - 1
+            else:
+                return atom
+            self.pos += 1
+            if self.peek() in ('?', '+'): self.error('lazy and possessive quantifiers are not supported')
+            atom = ('rep', atom, lo, hi)
+
+    # atom := "(" alt ")" | "[" class "]" | "." | escape | character
+    def atom(self):
+        c = self.take()
+        if c == '(':
+            if self.peek() == '?':
+                if self.pattern.startswith('?:', self.pos):
+                    self.pos += 2
+                elif self.pattern.startswith('?P<', self.pos):
+                    end = self.pattern.find('>', self.pos)
+                    if end < 0: self.error('unterminated group name')
+                    self.pos = end+1
+                else:
+                    self.error('unsupported group extension')
+            node = self.alt()
+            if self.take() != ')': self.error('missing ")"')
+            return node
+        elif c == '[':
+            return ('set', self.char_set())
+        elif c == '.':
+            return ('set', all_chars)
+        elif c == '\\':
+            return ('set', self.escape())
+        elif c in '*+?':
+            self.error('nothing to repeat')
+        elif c in '^$':
+            self.error('anchors are not supported')
+        return ('set', ((ord(c), ord(c)),))
+
+    # Return the character set for the escape after a backslash.
+    def escape(self):
+        c = self.take()
+        if c in 'dsw':
+            return char_class('\\' + c)
+        elif c in 'DSW':
+            return negate(char_class('\\' + c.lower()))
+        elif c in simple_escapes:
+            o = ord(simple_escapes[c])
+        elif c in 'xuU':
+            width = { 'x': 2, 'u': 4, 'U': 8 }[c]
+            digits = self.pattern[self.pos:self.pos+width]
+            if len(digits) != width or not re.match('[0-9A-Fa-f]+$', digits):
+                self.error('bad escape \\%s' % c)
+            self.pos += width
+            o = int(digits, 16)
+        elif c.isalnum():
+            self.error('unsupported escape \\%s' % c)
+        else:
+            o = ord(c)
+        return ((o, o),)
+
+    # Return the character set for a class body up to and including the "]".
+    def char_set(self):
+        negated = self.peek() == '^'
+        if negated: self.pos += 1
+        intervals = []
+        first = True
+        while True:
+            c = self.take()
+            if c == ']' and not first: break
+            first = False
+            if c == '\\':
+                cs = self.escape()
+                if len(cs) != 1 or cs[0][0] != cs[0][1]:   # Class escape
+                    intervals.extend(cs)
+                    continue
+                lo = cs[0][0]
+            else:
+                lo = ord(c)
+            hi = lo
+            if self.peek() == '-' and self.pattern[self.pos+1:self.pos+2] not in ('', ']'):
+                self.pos += 1
+                c = self.take()
+                if c == '\\':
+                    cs = self.escape()
+                    if len(cs) != 1 or cs[0][0] != cs[0][1]: self.error('bad character range')
+                    hi = cs[0][0]
+                else:
+                    hi = ord(c)
+                if hi < lo: self.error('bad character range')
+            intervals.append((lo, hi))
+        cs = charset(intervals)
+        return negate(cs) if negated else cs
+
+# Return the syntax tree for a literal string.
+def literal_tree(string):
+    return ('cat', [('set', ((ord(c), ord(c)),)) for c in string])
+
+# NFA construction
+
+# A Thompson NFA. Each state has a list of epsilon targets and a list of
+# (character set, target) edges.
+class nfa(object):
+
+    def __init__(self):
+        self.eps = []                       # Epsilon edges per state
+        self.edges = []                     # Character set edges per state
+        self.accept = dict()                # Accepting state -> rule index
+
+    # Return a new state.
+    def state(self):
+        self.eps.append([])
+        self.edges.append([])
+        return len(self.eps)-1
+
+    # Return the (start, end) states of a fragment for the syntax tree.
+    def fragment(self, node):
+        s = self.state()
+        if node[0] == 'set':
+            e = self.state()
+            self.edges[s].append((node[1], e))
+        elif node[0] == 'cat':
+            e = s
+            for child in node[1]:
+                cs, ce = self.fragment(child)
+                self.eps[e].append(cs)
+                e = ce
+        elif node[0] == 'alt':
+            e = self.state()
+            for child in node[1]:
+                cs, ce = self.fragment(child)
+                self.eps[s].append(cs)
+                self.eps[ce].append(e)
+        else:                               # Repetition
+            _, child, lo, hi = node
+            e = s
+            for _ in range(lo):             # Required copies
+                cs, ce = self.fragment(child)
+                self.eps[e].append(cs)
+                e = ce
+            if hi == None:                  # Kleene star
+                cs, ce = self.fragment(child)
+                self.eps[e].append(cs)
+                self.eps[ce].append(e)
+            else:                           # Optional copies
+                end = self.state()
+                self.eps[e].append(end)
+                for _ in range(hi - lo):
+                    cs, ce = self.fragment(child)
+                    self.eps[e].append(cs)
+                    self.eps[ce].append(end)
+                    e = ce
+                e = end
+        return (s, e)
+
+    # Return the epsilon closure of the set of states.
+    def closure(self, states):
+        res = set(states)
+        stack = list(states)
+        while stack:
+            for t in self.eps[stack.pop()]:
+                if t not in res:
+                    res.add(t)
+                    stack.append(t)
+        return frozenset(res)
+
+# Return the NFA and its start state for the given triples.
+def build_nfa(triples):
+    n = nfa()
+    start = n.state()
+    for (i, (label, typ, value)) in enumerate(triples):
+        if typ == '=': tree = literal_tree(value)
+        else:          tree = regex_parser(value).parse()
+        s, e = n.fragment(tree)
+        n.eps[start].append(s)
+        n.accept[e] = i
+    return (n, start)
+
+# Alphabet partition
+
+# Return the class boundaries (sorted interval starts, beginning at 0) and the
+# class id of each interval, given the character sets used by the NFA. Two
+# intervals share a class if every character set contains both or neither.
+def partition(sets):
+    points = set([0])
+    for cs in sets:
+        for (lo, hi) in cs:
+            points.add(lo)
+            if hi < max_char: points.add(hi+1)
+    bounds = sorted(points)
+    sigs = [[] for _ in bounds]
+    for (k, cs) in enumerate(sets):
+        for (lo, hi) in cs:
+            for j in range(bisect_right(bounds, lo)-1, bisect_right(bounds, hi)):
+                sigs[j].append(k)
+    ids = dict()
+    classes = [ids.setdefault(tuple(sig), len(ids)) for sig in sigs]
+    return (bounds, classes, len(ids))
+
+# DFA construction
+
+# Return the transition table (list of dicts class -> state) and the accepting
+# rule of each state (or -1) of the DFA for the NFA, by subset construction.
+# State 0 is the start state.
+def subset(n, start, set_classes):
+    first = n.closure([start])
+    index = { first: 0 }
+    sets = [first]
+    trans = []
+    accept = []
+    i = 0
+    while i < len(sets):
+        cur = sets[i]
+        rules = [n.accept[s] for s in cur if s in n.accept]
+        accept.append(min(rules) if rules else -1)
+        moves = dict()
+        for s in cur:
+            for (cs, t) in n.edges[s]:
+                for c in set_classes[cs]:
+                    moves.setdefault(c, set()).add(t)
+        row = dict()
+        for (c, targets) in moves.items():
+            nxt = n.closure(targets)
+            if nxt not in index:
+                index[nxt] = len(sets)
+                sets.append(nxt)
+            row[c] = index[nxt]
+        trans.append(row)
+        i += 1
+    return (trans, accept)
+
+# Return the minimized transition table and accepting rules, by Moore's
+# partition refinement. The start state stays state 0.
+def minimize(trans, accept, nclasses):
+    block = list(accept)
+    count = len(set(block))
+    while True:
+        keys = [(block[s],) + tuple(block[row[c]] if c in row else None
+                                    for c in range(nclasses))
+                for (s, row) in enumerate(trans)]
+        ids = dict()
+        new = [ids.setdefault(key, len(ids)) for key in keys]
+        block = new
+        if len(ids) == count: break
+        count = len(ids)
+
+    # Renumber so that the start state is 0
+    order = { block[0]: 0 }
+    for b in block: order.setdefault(b, len(order))
+    new_trans = [None]*len(order)
+    new_accept = [None]*len(order)
+    for (s, row) in enumerate(trans):
+        b = order[block[s]]
+        new_trans[b] = dict((c, order[block[t]]) for (c, t) in row.items())
+        new_accept[b] = accept[s]
+    return (new_trans, new_accept)
+
+# Return the lexer tables (rows, accept, bounds, classes) for the triples.
+# Row entries are the next state or -1 (dead). The bounds and classes only
+# cover code points from ascii_size up, so a non-ASCII code point o maps to
+# column ascii_size + classes[bisect_right(bounds, o)-1].
+def build(triples):
+    n, start = build_nfa(triples)
+    sets = sorted(set(cs for edges in n.edges for (cs, t) in edges))
+    bounds, classes, nclasses = partition(sets)
+
+    # Find the classes contained in each character set
+    set_classes = dict()
+    for cs in sets:
+        cls = set()
+        for (lo, hi) in cs:
+            for j in range(bisect_right(bounds, lo)-1, bisect_right(bounds, hi)):
+                cls.add(classes[j])
+        set_classes[cs] = sorted(cls)
+
+    trans, accept = subset(n, start, set_classes)
+    trans, accept = minimize(trans, accept, nclasses)
+
+    # Lay out rows with ASCII columns first
+    ascii_cls = [classes[bisect_right(bounds, o)-1] for o in range(ascii_size)]
+    rows = []
+    for row in trans:
+        cols = [row.get(c, -1) for c in ascii_cls]
+        cols.extend(row.get(c, -1) for c in range(nclasses))
+        rows.append(cols)
+
+    j = bisect_right(bounds, ascii_size)-1
+    hi_bounds = [ascii_size] + bounds[j+1:]
+    hi_classes = classes[j:]
+    return (rows, accept, hi_bounds, hi_classes)
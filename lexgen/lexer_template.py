@@ -2,15 +2,104 @@
 # Do not edit.
 
 import re
+from array import array
+from bisect import bisect_right
+from sys import intern
 from . import tok
 
 ws = re.compile('\s+')
-triples = [{0}]
+newline = re.compile('\n')
+backend = '{0}'
+rules = [{1}]
+master = {2}
+dfa_rows = {3}
+dfa_accept = {4}
+dfa_bounds = {5}
+dfa_classes = {6}
+spec_hash = '{7}'                           # Hash of the spec (see lexgen.spec_hash)
 
+# The rule index for each group index of the master pattern. Only the outer
+# "t<i>" groups are filled in.
+if master:
+    groups = [None]*(master.groups+1)
+    for (name, i) in master.groupindex.items():
+        if name[0] == 't': groups[i] = int(name[1:])
 
-# Return the number of newlines in the match object.
-def countlines(match):
-    return match.group(0).count('\n')
+# Return the (rule index, end, live) triple of the token at pos in the string,
+# using the master pattern (the first rule that matches wins), or None if no
+# rule matches. If stream is set, live tells whether the token may continue
+# past the end of the string (see dfa_live), and is False otherwise.
+def regex_scan(text, pos, stream=False):
+    m = master.match(text, pos)
+    if not m or m.end() == pos: return None
+    end = m.end()
+    live = stream and (end == len(text) or dfa_rows != None and dfa_live(text, pos))
+    return (groups[m.lastindex], end, live)
+
+# Return the DFA state after the character o (a code point) in the given state.
+def dfa_step(state, o):
+    if o >= 128: o = 128 + dfa_classes[bisect_right(dfa_bounds, o)-1]
+    return dfa_rows[state][o]
+
+# Return whether the DFA is still live at the end of the string when scanning
+# from pos, i.e., whether more text could extend some token starting at pos.
+def dfa_live(text, pos):
+    state = 0
+    for i in range(pos, len(text)):
+        state = dfa_step(state, ord(text[i]))
+        if state < 0: return False
+    return True
+
+# Return the (rule index, end, live) triple of the token at pos in the string,
+# using the DFA (the longest match wins, then the first rule), or None if no
+# rule matches. live tells whether the DFA was still live at the end of the
+# string, so that a longer token may be found once more text is read.
+def dfa_scan(text, pos, stream=False):
+    rows = dfa_rows
+    accept = dfa_accept
+    size = len(text)
+    state = 0
+    rule = -1
+    end = i = pos
+    while i < size:
+        o = ord(text[i])
+        if o >= 128: o = 128 + dfa_classes[bisect_right(dfa_bounds, o)-1]
+        state = rows[state][o]
+        if state < 0: break
+        i += 1
+        if accept[state] >= 0:
+            rule = accept[state]
+            end = i
+    if rule < 0: return None
+    return (rule, end, state >= 0)
+
+scan = dfa_scan if backend == 'dfa' else regex_scan
+
+# Token buffer columns are indexed by rule, so the label id of a token is the
+# index of the rule that matched it. Token values other than those taken from a
+# val group (such as identifiers) are interned, so that looking them up as
+# names is an identity check.
+labels = [intern(label) for (label, typ, val) in rules]
+vals = [val for (label, typ, val) in rules]
+skipped = [typ == '<' for (label, typ, val) in rules]
+
+# Return an (offset, length, text) edit that turns the old string into the new
+# one, keeping their longest common prefix and suffix.
+def diff(old, new):
+    lo, hi = 0, min(len(old), len(new))
+    while lo < hi:                          # Common prefix length
+        mid = (lo+hi+1)//2
+        if old[:mid] == new[:mid]: lo = mid
+        else: hi = mid-1
+    pre = lo
+    lo, hi = 0, min(len(old), len(new)) - pre
+    while lo < hi:                          # Common suffix length
+        mid = (lo+hi+1)//2
+        if old[len(old)-mid:] == new[len(new)-mid:]: lo = mid
+        else: hi = mid-1
+    return (pre, len(old)-pre-lo, new[pre:len(new)-lo])
+
+chunk_size = 1 << 16                        # Characters read per chunk when streaming
 
 # A lexer object.
 class lexer(object):
@@ -18,83 +107,253 @@ class lexer(object):
     def __init__(self, prog_file=None):
         self.prog_file = prog_file      # The program file
         self.prog_str = self.prog_file.read() if self.prog_file else None
+        self.streaming = False          # Whether the file is read in chunks
+        self.chunk_size = chunk_size    # Characters per chunk when streaming
+        self.window = self.prog_str     # The buffered section of the program
+        self.window_line = 1            # Line number of the window start
+        self.line_starts = None         # Start offsets of the window's lines
         self.tokens = None
 
     # Set the program file.
     def set_file(self, prog_file):
         self.prog_file = prog_file
         self.prog_str = self.prog_file.read()
+        self.streaming = False
+        self.set_window(self.prog_str, 1)
+
+    # Set the program file to be read in chunks as tokens are consumed, so
+    # only a bounded window of the program is held in memory at once.
+    def set_stream(self, prog_file, size=None):
+        self.prog_file = prog_file
+        self.prog_str = None
+        self.streaming = True
+        self.chunk_size = size or chunk_size
+        self.set_window('', 1)
 
     # Set the program string.
     def set_str(self, prog_str):
         self.prog_file = None
         self.prog_str = prog_str
+        self.streaming = False
+        self.set_window(prog_str, 1)
+
+    # Set the buffered window of the program and the line number it starts on.
+    def set_window(self, window, line):
+        self.window = window
+        self.window_line = line
+        self.line_starts = None
+
+    # Return the array of start offsets of the lines in the window, building it
+    # the first time it is needed.
+    def line_index(self):
+        if self.line_starts == None:
+            self.line_starts = array('q', [0])
+            self.line_starts.extend(m.end() for m in newline.finditer(self.window))
+        return self.line_starts
+
+    # Return the line number of the offset into the window.
+    def line(self, offset):
+        return bisect_right(self.line_index(), offset) - 1 + self.window_line
+
+    # Return the (line, column) position of the offset into the window, where
+    # columns count from 1.
+    def position(self, offset):
+        starts = self.line_index()
+        i = bisect_right(starts, offset) - 1
+        return (i + self.window_line, offset - starts[i] + 1)
+
+    # Return line n of the program without its newline, or None if the line
+    # is not in the window.
+    def line_str(self, n):
+        starts = self.line_index()
+        i = n - self.window_line
+        if i < 0 or i >= len(starts): return None
+        end = starts[i+1]-1 if i+1 < len(starts) else len(self.window)
+        return self.window[starts[i]:end]
+
+    # Return a new token generator for the set program.
+    def start(self):
+        if self.streaming: return self.lex('', self.prog_file)
+        return self.lex(self.prog_str)
 
     # Return the next token. Raises an exception if there is no set
     # program file or program string.
     def next(self):
         if not self.prog_file and self.prog_str == None: raise Exception('no program set.')
-        if not self.tokens: self.tokens = self.lex(self.prog_str)
+        if not self.tokens: self.tokens = self.start()
         return next(self.tokens)
 
     # Reset the token generator. Raises an exception if there is no set
-    # program file or program string.
+    # program file or program string. A streamed file is rewound if possible.
     def reset(self):
         if not self.prog_file and self.prog_str == None: raise Exception('no program set.')
-        self.tokens = self.lex(self.prog_str)
+        if self.streaming and self.prog_file.seekable(): self.prog_file.seek(0)
+        self.tokens = self.start()
+
+    # Return a compact token buffer (see tok.buffer) for the set program
+    # string. Raises an exception if the program is being streamed.
+    def buffer(self):
+        if self.prog_str == None: raise Exception('no program string set.')
+        prog_str = self.prog_str
+        buf = tok.buffer(prog_str, labels, vals)
+        ids, starts, ends, lines = buf.ids, buf.starts, buf.ends, buf.lines
+        linecount = 1
+        pos = 0
+        size = len(prog_str)
+
+        while pos < size:
+            res = scan(prog_str, pos)
+            if not res: self.error(prog_str, pos, linecount)
+            rule, end = res[:2]
+            if not skipped[rule]:
+                ids.append(rule)
+                starts.append(pos)
+                ends.append(end)
+                lines.append(linecount)
+            linecount += prog_str.count('\n', pos, end)
+            pos = end
+
+        return buf
+
+    # Update the token buffer for an edit that replaces the length characters
+    # at offset in its program string with text, and set the edited program
+    # string. Scanning restarts at the token before the edit, in case that
+    # token's match depended on what followed it, and stops as soon as a token
+    # would start where an old token after the edit started, since the rest of
+    # the stream is then the same apart from its offsets and lines. If the
+    # edited region doesn't lex, raises a syntax error and leaves the buffer
+    # unchanged.
+    def relex(self, buf, offset, length, text):
+        prog_str = buf.source[:offset] + text + buf.source[offset+length:]
+        delta = len(text) - length
+        n = len(buf)
+        self.set_str(prog_str)
+
+        # Find the old token to restart from
+        i = buf.find(offset)
+        if i > 0:
+            i -= 1
+            pos, linecount = buf.start(i), buf.line(i)
+        else:
+            pos, linecount = 0, 1
+
+        # Find the first old token after the edit
+        j = buf.find(offset+length)
+        while j < n and buf.start(j) < offset+length: j += 1
+
+        new = tok.buffer(prog_str, labels, vals)
+        size = len(prog_str)
+
+        while pos < size:
+
+            # Stop once back in step with the old tokens
+            while j < n and buf.start(j)+delta < pos: j += 1
+            if j < n and buf.start(j)+delta == pos: break
+
+            res = scan(prog_str, pos)
+            if not res: self.error(prog_str, pos, linecount)
+            rule, end = res[:2]
+            if not skipped[rule]: new.append(rule, pos, end, linecount)
+            linecount += prog_str.count('\n', pos, end)
+            pos = end
+
+        else:
+            j = n
+
+        line_delta = linecount - buf.line(j) if j < n else 0
+        buf.source = prog_str
+        buf.splice(i, j, new, delta, line_delta)
+        return buf
+
+    # Update the token buffer for a new version of its program string and set
+    # the new program string, re-lexing only the part that changed.
+    def update(self, buf, prog_str):
+        offset, length, text = diff(buf.source, prog_str)
+        return self.relex(buf, offset, length, text)
+
+    # Raise a syntax error for the unmatched sequence at pos in the program
+    # string, which is on the given line.
+    def error(self, prog_str, pos, linecount):
+        linefrag = prog_str[pos:]
+        nl = prog_str.find('\n', pos)
+        if nl >= 0: linefrag = prog_str[pos:nl]
+        raise SyntaxError('line %d: unexpected sequence "%s".\n%s'\
+            % (linecount, linefrag, self.excerpt(linecount, 3)))
 
     # Return a string containing the section of up to k lines surrounding and
-    # including line n, given a program string.
-    def excerpt(self, n, k, string):
-        n = n-1                     # Switch back to zero-indexing
-        lines = string.split('\n')
+    # including line n, given a program string whose first line is line number
+    # first. Defaults to the buffered window of the program, which is the whole
+    # program unless it is being streamed, using the line index. Lines outside
+    # the window are left out.
+    def excerpt(self, n, k, string=None, first=1):
+        if string == None:
+            starts = self.line_index()
+            first = self.window_line
+            count = len(starts)
+            line_str = self.line_str
+        else:
+            lines = string.split('\n')
+            count = len(lines)
+            line_str = lambda n: lines[n-first]
+        n = n-first                 # Switch back to zero-indexing
         lo = max(n - k//2, 0)
-        hi = min(n + k//2, len(lines)-1)
+        hi = min(n + k//2, count-1)
         # print(lo)
         # print(hi)
-        width = len(str(hi))
+        width = len(str(hi+first))
         res = []
-        for (i, line) in enumerate(lines[lo:hi+1]):
-            num = str(i+1+lo).rjust(width, ' ')
-            res.append(num + ': ' + line)
+        for i in range(lo, hi+1):
+            num = str(i+first).rjust(width, ' ')
+            res.append(num + ': ' + line_str(i+first))
         return '\n'.join(res)
 
-    # Generate tokens given a program string.
-    def lex(self, prog_str):
+    # Generate tokens given a program string, followed by the rest of the
+    # program file if one is given. The file is read chunk_size characters at a
+    # time, keeping at least a chunk of lookahead buffered past the current
+    # token. A token that the scan could still extend at the end of the buffer
+    # (see dfa_scan) is re-scanned once more of the file has been read, so
+    # tokens may straddle chunks.
+    def lex(self, prog_str, prog_file=None):
         linecount = 1
+        pos = 0
+        eof = not prog_file
+
+        while True:
 
-        while len(prog_str):
+            # Refill the buffer, dropping the consumed lines (keeping up to a
+            # chunk of the current line for excerpts)
+            if not eof and len(prog_str) - pos < self.chunk_size:
+                chunk = prog_file.read(self.chunk_size)
+                eof = not chunk
+                cut = prog_str.rfind('\n', 0, pos) + 1
+                if pos - cut > self.chunk_size: cut = pos
+                prog_str = prog_str[cut:] + chunk
+                pos -= cut
+                self.set_window(prog_str, linecount)
 
-            match = None
+            if pos >= len(prog_str): break
 
             # Match token patterns
-            for (label, typ, pattern) in triples:
-
-                match = re.match(pattern, prog_str)
-
-                if match:
-
-                    if typ == '<': pass
-                    elif match.groups('val'):
-                        val = match.group('val')
-                        end = val.count('\n')
-                        yield tok.token(label, val, linecount, linecount+end)
-                    else:
-                        val = prog_str[:match.end(0)]
-                        end = val.count('\n')
-                        yield tok.token(label, val, linecount, linecount+end)
-                    linecount += countlines(match)
-                    prog_str = prog_str[match.end(0):]
-                    # print('linecount: %s' % linecount)
-                    break
+            res = scan(prog_str, pos, not eof)
+
+            # The token may continue past the end of the buffer (even if a
+            # shorter token was accepted before it)
+            if not eof and (not res or res[2]):
+                chunk = prog_file.read(self.chunk_size)
+                eof = not chunk
+                prog_str += chunk
+                self.set_window(prog_str, self.window_line)
+                continue
 
             # No token patterns matched
-            if not match:
-                linefrag = ''
-                try:
-                    linefrag = prog_str[:prog_str.index('\n')]
-                except ValueError:
-                    linefrag = prog_str
-                # print(orig_str)
-                raise SyntaxError('line %d: unexpected sequence "%s".\n%s'\
-                    % (linecount, linefrag, self.excerpt(linecount, 3, self.prog_str)))
\ No newline at end of file
+            if not res: self.error(prog_str, pos, linecount)
+
+            rule, end = res[:2]
+            label, typ, val = rules[rule]
+
+            if typ != '<':
+                value = val.match(prog_str, pos, end).group('val') if val else intern(prog_str[pos:end])
+                yield tok.token(labels[rule], value, linecount, linecount+value.count('\n'))
+
+            linecount += prog_str.count('\n', pos, end)
+            pos = end
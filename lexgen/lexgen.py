@@ -4,7 +4,10 @@
 # A lexer generator.
 # Takes a token spec in the .tok format and returns a lexer that follows the
 # spec. The lexer takes a program string and returns a list of pairs in the
-# format (label, value), where label and value are both strings.
+# format (label, value), where label and value are both strings. All token
+# patterns are combined into a single master regex, which the lexer matches at
+# an advancing offset into the program string, or alternatively compiled into a
+# table-driven DFA (see dfa.py).
 # 
 # The .tok format:
 # Each line specifies a token, whose label is on the left and whose value is on
@@ -28,10 +31,15 @@
 # where "pattern" is the pattern to match and use, and "..." is a (possibly
 # empty) pattern to match and discard.
 
-import re
+import hashlib, io, re
+if __package__:
+    from . import dfa
+else:
+    import dfa
 
 # Configuration variables
 
+version = 1                                 # Generator version (bump when generated lexers change)
 template_path = 'lexer_template.py'         # Filepath of the template lexer
 lexer_suffix = '.py'                        # File suffix for lexer
 
@@ -66,27 +74,82 @@ def parse_spec(spec):
 
     return triples
 
-# Create a lexer Python program file at the given path, given a spec file.
-def lexer_file(path, spec):
-    triples = parse_spec(spec)
-    triple_strs = []
-
-    for (label, typ, value) in triples:
+# Return the master pattern string for the given triples. Each triple becomes a
+# named group "t<i>" in a single alternation (in triple order, so literals are
+# still tried before patterns) and any "val" group is renamed to "v<i>" so that
+# group names stay unique.
+def master_pattern(triples):
+    alts = []
+    for (i, (label, typ, value)) in enumerate(triples):
         if typ == '=':
-            triple_strs.append('(\'%s\', \'%s\', re.compile(re.escape(\'%s\')))' % (label, typ, value))
+            pattern = re.escape(value)
         else:
-            triple_strs.append('(\'%s\', \'%s\', re.compile(\'%s\', re.DOTALL|re.MULTILINE))' % (label, typ, value))
+            pattern = value.replace('(?P<val>', '(?P<v%d>' % i)
+        alts.append('(?P<t%d>%s)' % (i, pattern))
+    return '|'.join(alts)
+
+# Return the Python source for a list of table rows, one row per line.
+def rows_str(rows):
+    return '[\n    ' + ',\n    '.join(repr(row) for row in rows) + ']'
+
+# Create a lexer Python program file at the given path, given a spec file. The
+# backend is either "regex", which matches a master regex and takes the first
+# matching rule, or "dfa", which steps through a minimized DFA table and takes
+# the longest match (see dfa.py).
+def lexer_file(path, spec, backend='regex'):
+    spec = spec.read()
+    triples = parse_spec(io.StringIO(spec))
+    rule_strs = []
+
+    for (label, typ, value) in triples:
+        val = None
+        if typ != '=' and '(?P<val>' in value:
+            val = 're.compile(%s, re.DOTALL|re.MULTILINE)' % repr(value)
+        rule_strs.append('(%s, %s, %s)' % (repr(label), repr(typ), val))
+
+    if backend == 'regex':
+        # Validate the combined pattern before writing it out
+        master = master_pattern(triples)
+        re.compile(master, re.DOTALL|re.MULTILINE)
+        # The DFA, if the spec has one, tells when a streamed token may continue
+        # past the end of the buffer (see dfa_live in the template)
+        try:
+            rows, accept, bounds, classes = dfa.build(triples)
+            rows = rows_str(rows)
+        except SyntaxError:
+            rows = accept = bounds = classes = None
+        tables = ('re.compile(%s, re.DOTALL|re.MULTILINE)' % repr(master),
+                  rows, accept, bounds, classes)
+    elif backend == 'dfa':
+        rows, accept, bounds, classes = dfa.build(triples)
+        tables = (None, rows_str(rows), accept, bounds, classes)
+    else:
+        raise ValueError('unknown lexer backend "%s".' % backend)
 
     # Write file
     temp_str = open(template_path, 'r').read()
     f = open(path+lexer_suffix, 'w')
-    f.write(temp_str.format(','.join(triple_strs)))
+    f.write(temp_str.format(backend, ','.join(rule_strs), *tables, spec_hash(spec, backend)))
     f.close()
 
+# Return the hash of a spec string and the generator version and backend, which
+# identifies the lexer generated from them.
+def spec_hash(spec, backend='regex'):
+    key = '%d\n%s\n%s' % (version, backend, spec)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
 # When executed, take filepath fpath and spec filepath sfpath arguments and
-# write a lexer program to fpath given the spec at sfpath.
+# write a lexer program to fpath given the spec at sfpath. An optional first
+# argument "-dfa" generates a DFA lexer instead of a regex lexer.
 if __name__ == "__main__":
     from sys import argv
-    fpath = argv[1]
-    spec = open(argv[2], 'r')
-    lexer_file(fpath, spec)
\ No newline at end of file
+    if len(argv) == 3:                      # Regex lexer
+        fpath = argv[1]
+        spec = open(argv[2], 'r')
+        lexer_file(fpath, spec)
+    elif len(argv) == 4 and argv[1] == '-dfa':  # DFA lexer
+        fpath = argv[2]
+        spec = open(argv[3], 'r')
+        lexer_file(fpath, spec, 'dfa')
+    else:
+        raise ValueError('expected arguments [-dfa] fpath sfpath.')
@@ -1,3 +1,7 @@
+from array import array
+from bisect import bisect_left
+from sys import intern
+
 # A token object.
 
 class token(object):
@@ -9,4 +13,107 @@ class token(object):
         self.end_line = end_line
 
     def __repr__(self):
-        return 'token(\'{0}\', \'{1}\', {2}-{3})'.format(self.label, self.value, self.start_line, self.end_line)
\ No newline at end of file
+        return 'token(\'{0}\', \'{1}\', {2}-{3})'.format(self.label, self.value, self.start_line, self.end_line)
+
+# A compact token buffer. Tokens are stored as parallel array columns of label
+# ids, start and end offsets into the program string, and start line numbers.
+# Values are sliced out of the program string only when asked for, and are
+# interned like the values of token objects.
+#
+# After an edit (see lexer.relex), the offsets and lines of the tokens from
+# index gap onwards are stored without the shift the edit applied to them, and
+# the accessor methods add it back. Moving the gap only rewrites the tokens
+# between its old and new index, so a series of nearby edits stays cheap.
+
+class buffer(object):
+
+    def __init__(self, source, labels, vals):
+        self.source = source            # The program string
+        self.labels = labels            # Label string for each label id
+        self.vals = vals                # Value pattern (or None) for each label id
+        self.ids = array('H')           # Label id column
+        self.starts = array('q')        # Start offset column
+        self.ends = array('q')          # End offset column
+        self.lines = array('l')         # Start line column
+        self.gap = 0                    # First token whose columns are shifted
+        self.shift = 0                  # Offset shift of tokens from the gap
+        self.line_shift = 0             # Line shift of tokens from the gap
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return (self.token(i) for i in range(len(self.ids)))
+
+    def __repr__(self):
+        return 'buffer(%d tokens)' % len(self.ids)
+
+    # Add a token (appended tokens are always past the gap).
+    def append(self, label_id, start, end, line):
+        self.ids.append(label_id)
+        self.starts.append(start - self.shift)
+        self.ends.append(end - self.shift)
+        self.lines.append(line - self.line_shift)
+
+    # Return the label of token i.
+    def label(self, i):
+        return self.labels[self.ids[i]]
+
+    # Return the start offset of token i.
+    def start(self, i):
+        return self.starts[i] + (self.shift if i >= self.gap else 0)
+
+    # Return the end offset of token i.
+    def end(self, i):
+        return self.ends[i] + (self.shift if i >= self.gap else 0)
+
+    # Return the start line of token i.
+    def line(self, i):
+        return self.lines[i] + (self.line_shift if i >= self.gap else 0)
+
+    # Return the value of token i.
+    def value(self, i):
+        val = self.vals[self.ids[i]]
+        if val: return val.match(self.source, self.start(i), self.end(i)).group('val')
+        return intern(self.source[self.start(i):self.end(i)])
+
+    # Return token i as a token object.
+    def token(self, i):
+        value = self.value(i)
+        line = self.line(i)
+        return token(self.labels[self.ids[i]], value, line, line+value.count('\n'))
+
+    # Return the index of the first token that ends at or after the offset.
+    def find(self, offset):
+        if self.gap and self.ends[self.gap-1] >= offset:
+            return bisect_left(self.ends, offset, 0, self.gap)
+        return bisect_left(self.ends, offset-self.shift, self.gap, len(self.ids))
+
+    # Move the gap to index k, storing the tokens between the old and new gap
+    # with or without the shift as needed.
+    def move_gap(self, k):
+        shift, line_shift = self.shift, self.line_shift
+        if k < self.gap:                    # Tokens entering the shifted part
+            lo, hi = k, self.gap
+            shift, line_shift = -shift, -line_shift
+        else:                               # Tokens leaving the shifted part
+            lo, hi = self.gap, k
+        if shift:
+            self.starts[lo:hi] = array('q', [x+shift for x in self.starts[lo:hi]])
+            self.ends[lo:hi] = array('q', [x+shift for x in self.ends[lo:hi]])
+        if line_shift:
+            self.lines[lo:hi] = array('l', [x+line_shift for x in self.lines[lo:hi]])
+        self.gap = k
+
+    # Replace tokens i to j (exclusive) with the tokens in the given buffer,
+    # whose offsets and lines are absolute, and shift the tokens after them by
+    # the given offset and line deltas.
+    def splice(self, i, j, new, delta, line_delta):
+        self.move_gap(j)
+        self.shift += delta
+        self.line_shift += line_delta
+        self.ids[i:j] = new.ids
+        self.starts[i:j] = new.starts
+        self.ends[i:j] = new.ends
+        self.lines[i:j] = new.lines
+        self.gap = i + len(new.ids)
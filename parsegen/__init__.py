@@ -1,4 +1,4 @@
 # Slang parsegen package.
 
 __version__ = '3.5'
-__all__ = ['action','node','parsegen']
\ No newline at end of file
+__all__ = ['action','node','parsegen','cache']
\ No newline at end of file
@@ -33,11 +33,12 @@ class SHIFT(action):
 # A reduce action.
 class REDUCE(action):
     
-    def __init__(self, sym, nt, prod):
+    def __init__(self, sym, nt, prod, nt_id=None):
         self.sym = sym
         self.nt = nt
         self.prod = prod
         self.pop_num = len(prod)
+        self.nt_id = nt_id          # Symbol id of nt in a loaded parse table
 
     def __repr__(self):
         return 'REDUCE %d\t[ %s -> %s ]' % (self.pop_num, self.nt, ' '.join(self.prod))
\ No newline at end of file
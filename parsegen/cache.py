@@ -0,0 +1,62 @@
+# Parser cache
+# Loads the generated parser for a grammar spec, making sure it is up to date.
+#
+# The parser shipped in parse.py is used if it was generated from the spec as it
+# is now (see parsegen.spec_hash). Otherwise the parser is loaded from the cache
+# directory, where parsers are stored under the hash of their spec and options,
+# and generated there first if no parser for the spec has been cached yet. So a
+# spec that has not changed never triggers a rebuild, and a stale parser is
+# never used. The cache directory is in the user's cache directory; if it cannot
+# be written to, the parser is generated in a temporary directory that is
+# removed once the parser is loaded.
+
+import os, sys, tempfile
+from importlib import import_module, util
+from os import path
+from . import parsegen
+
+# Configuration variables
+
+spec_path = path.join(path.dirname(__file__), 'slang.syn')  # Filepath of the Slang spec
+cache_root = path.join(os.environ.get('XDG_CACHE_HOME') or
+                       path.join(path.expanduser('~'), '.cache'), 'slang')  # User cache directory of Slang
+cache_path = path.join(cache_root, 'parsers')  # Directory of cached parsers
+mode = 'lalr'                               # Table mode of the Slang parser
+code = True                                 # Whether the Slang parser is direct-dispatch
+prec = True                                 # Whether the Slang parser has operator layers
+
+# Return the parser module for the spec at the given path, generated with the
+# given table mode, code and prec options (see parsegen.parser_file).
+def load(fpath=spec_path, mode=mode, code=code, prec=prec):
+    spec = open(fpath, 'r').read()
+    key = parsegen.spec_hash(spec, mode, code, prec)
+
+    # Use the shipped parser if it is up to date
+    try:
+        parse = import_module(__package__+'.parse')
+        if getattr(parse, 'spec_hash', None) == key: return parse
+    except (ImportError, SyntaxError, ValueError):
+        pass
+
+    # Otherwise use (or generate) the cached parser
+    name = '%s.p%s' % (__package__, key)
+    if name in sys.modules: return sys.modules[name]
+    try:
+        cached = parsegen.cached_parser_file(cache_path, spec, mode, code, prec)
+    except OSError:
+        with tempfile.TemporaryDirectory() as tmp_path:
+            return load_module(name, parsegen.cached_parser_file(tmp_path, spec, mode, code, prec))
+    return load_module(name, cached)
+
+# Return the parser module with the given name from the parser file at the given
+# path (without suffix).
+def load_module(name, fpath):
+    spec = util.spec_from_file_location(name, fpath+parsegen.parser_suffix)
+    module = util.module_from_spec(spec)
+    sys.modules[name] = module
+    try:
+        spec.loader.exec_module(module)
+    except:
+        del sys.modules[name]
+        raise
+    return module
@@ -1,8 +1,13 @@
 # Syntax tree terminal and nonterminal nodes.
 
+from array import array
+from sys import intern
+
 # A terminal node.
 class terminal(object):
 
+    __slots__ = ('sym', 'value', 'start_line', 'end_line')
+
     def __init__(self, sym, value, start_line, end_line):
         self.sym = sym
         self.value = value
@@ -14,7 +19,9 @@ class terminal(object):
 
 # A nonterminal node.
 class nonterminal(object):
-    
+
+    __slots__ = ('sym', 'children', 'start_line', 'end_line')
+
     def __init__(self, sym, children, start_line, end_line):
         self.sym = sym
         self.children = children
@@ -25,10 +32,160 @@ class nonterminal(object):
         children = ', '.join(str(child) for child in self.children)
         return '{0} : [ {1} ]({2}-{3})'.format(self.sym, children, self.start_line, self.end_line)
 
+# A compact syntax tree. The nodes are numbered in preorder and stored in
+# parallel array columns instead of as objects, and are read through views
+# (see view). Symbols and values are stored once in tables and referred to by
+# index. A line number of 0 stands for None.
+
+class tree(object):
+
+    __slots__ = ('syms', 'sym_ids', 'values', 'value_ids', 'kinds', 'firsts', 'siblings',
+                 'vals', 'starts', 'ends')
+
+    def __init__(self):
+        self.syms = []                  # Symbol string for each symbol id
+        self.sym_ids = dict()           # Symbol id of each symbol string
+        self.values = []                # Value string for each value id
+        self.value_ids = dict()         # Value id of each value string
+        self.kinds = array('H')         # Symbol id column
+        self.firsts = array('i')        # First child column (-1 if none)
+        self.siblings = array('i')      # Next sibling column (-1 if none)
+        self.vals = array('i')          # Value id column (-1 for nonterminals)
+        self.starts = array('i')        # Start line column
+        self.ends = array('i')          # End line column
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __repr__(self):
+        return 'tree(%d nodes)' % len(self.kinds)
+
+    # Intern the symbol and value strings (e.g., after unpickling the tree).
+    def intern(self):
+        self.syms = [intern(sym) for sym in self.syms]
+        self.values = [intern(val) for val in self.values]
+
+# A view of node i of a compact tree. It has the attributes of the node it
+# stands for, read from the tree columns, so the interpreter walks views like
+# nodes. Views are made as they are asked for and hold no tree data themselves.
+
+class view(object):
+
+    __slots__ = ('tree', 'i')
+
+    def __init__(self, tree, i):
+        self.tree = tree
+        self.i = i
+
+    def __repr__(self):
+        if self.terminal():
+            return '{0} = {1} ({2}-{3})'.format(self.sym, self.value, self.start_line, self.end_line)
+        children = ', '.join(str(child) for child in self.children)
+        return '{0} : [ {1} ]({2}-{3})'.format(self.sym, children, self.start_line, self.end_line)
+
+    # Return whether the node is a terminal.
+    def terminal(self):
+        return self.tree.vals[self.i] >= 0
+
+    @property
+    def sym(self):
+        return self.tree.syms[self.tree.kinds[self.i]]
+
+    @property
+    def value(self):
+        return self.tree.values[self.tree.vals[self.i]]
+
+    @property
+    def children(self):
+        t = self.tree
+        res = []
+        k = t.firsts[self.i]
+        while k >= 0:
+            res.append(view(t, k))
+            k = t.siblings[k]
+        return res
+
+    @property
+    def start_line(self):
+        return self.tree.starts[self.i] or None
+
+    @property
+    def end_line(self):
+        return self.tree.ends[self.i] or None
+
+# Return the view of the root of the compact tree (see tree) of the given
+# syntax tree, or a list of views for a list of trees (a top-level
+# contraction). The tree is walked without recursion, so it may be any depth.
+# The columns are built as lists and converted to arrays at the end.
+def flatten(root):
+    t = tree()
+    syms, sym_ids, values, value_ids = t.syms, t.sym_ids, t.values, t.value_ids
+    kinds, firsts, siblings, vals, starts, ends = [], [], [], [], [], []
+    last = []                           # Last child added to each node
+    res = []
+    roots = root if type(root) == list else [root]
+    stack = [(n, -1) for n in reversed(roots)]
+    while stack:
+        n, parent = stack.pop()
+        i = len(kinds)
+        sym = sym_ids.get(n.sym)
+        if sym == None:
+            sym = sym_ids[n.sym] = len(syms)
+            syms.append(n.sym)
+        if type(n) == nonterminal:
+            val = -1
+            stack.extend((child, i) for child in reversed(n.children))
+        else:
+            val = value_ids.get(n.value)
+            if val == None:
+                val = value_ids[n.value] = len(values)
+                values.append(n.value)
+        kinds.append(sym)
+        firsts.append(-1)
+        siblings.append(-1)
+        vals.append(val)
+        starts.append(n.start_line or 0)
+        ends.append(n.end_line or 0)
+        last.append(-1)
+        if parent < 0:
+            res.append(i)
+        else:
+            if last[parent] >= 0: siblings[last[parent]] = i
+            else: firsts[parent] = i
+            last[parent] = i
+    t.kinds = array('H', kinds)
+    t.firsts, t.siblings = array('i', firsts), array('i', siblings)
+    t.vals, t.starts, t.ends = array('i', vals), array('i', starts), array('i', ends)
+    views = [view(t, i) for i in res]
+    return views if type(root) == list else views[0]
+
+# Return the syntax tree of the given view of a compact tree (see flatten), or a
+# list of trees for a list of views. Nodes are built from the last to the first,
+# so the children of each node are built before it.
+def unflatten(root):
+    views = root if type(root) == list else [root]
+    if not views: return []
+    t = views[0].tree
+    syms, values, kinds, firsts, siblings, vals, starts, ends =\
+        t.syms, t.values, t.kinds, t.firsts, t.siblings, t.vals, t.starts, t.ends
+    nodes = [None]*len(t)
+    for i in range(len(t)-1, -1, -1):
+        if vals[i] >= 0:
+            nodes[i] = terminal(syms[kinds[i]], values[vals[i]], starts[i] or None, ends[i] or None)
+        else:
+            children = []
+            k = firsts[i]
+            while k >= 0:
+                children.append(nodes[k])
+                k = siblings[k]
+            nodes[i] = nonterminal(syms[kinds[i]], children, starts[i] or None, ends[i] or None)
+    res = [nodes[v.i] for v in views]
+    return res if type(root) == list else res[0]
+
 # Pretty print the tree.
 def print_tree(tree):
     def rec(tree, level):
-        if type(tree) == terminal:
+        if type(tree) == terminal or type(tree) == view and tree.terminal():
             print('%s%s : %s (%s-%s)' % ('| '*level, tree.sym, tree.value,\
                 tree.start_line, tree.end_line))
         else:
@@ -36,4 +193,4 @@ def print_tree(tree):
                 tree.end_line))
             for child in tree.children:
                 rec(child, level+1)
-    rec(tree, 0)
\ No newline at end of file
+    rec(tree, 0)
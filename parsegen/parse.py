@@ -1,59 +1,759 @@
-# An LR(1) parser generated by parsegen.py. This file is automatically
-# generated. Do not edit.
-
-import pickle
-from os import path
-from collections import defaultdict
-from . import node, action
-
-# Return a parse table usable in a parser given a table object loaded from a
-# parse table dump.
-def usable(dump_table):
-    table = [defaultdict(lambda: None) for state in dump_table]
-
-    for (i, state) in enumerate(dump_table):
-
-        for (sym, act_tup) in state:
-            act = None
-            if act_tup[0] == 'SHIFT':
-                act = action.SHIFT(*act_tup[1:])
-            elif act_tup[0] == 'GOTO':
-                act = action.GOTO(*act_tup[1:])
-            elif act_tup[0] == 'REDUCE':
-                act = action.REDUCE(*act_tup[1:])
-            else:
-                act = action.ACCEPT()
-            table[i][sym] = act
+# A direct-dispatch LR(1) parser generated by parsegen.py. This file is
+# automatically generated. Do not edit.
+#
+# Each parser state is compiled into a state function (see parsegen.parser_code)
+# that branches on the lookahead symbol id and performs reduces inline, building
+# the abstract syntax tree as it goes.
+
+from sys import intern
+from . import node
 
-    return table
+nonterminal = node.nonterminal
 
-end_sym = 'END_SYM'
+# Symbol names are interned, so comparing them to other interned strings (such
+# as string literals in the interpreter) is an identity check.
+end_sym = intern('END_SYM')
 tlist = ['num', 'str', 'id', '..', '...', ':', '->', '+', '-', '*', '/', '%', '^', '!', '&&', '||', '==', '!=', '<=', '>=', '<', '>', 'break']
 clist = ['stm*', 'stm', 'id*', 'exp*']
-table = usable(pickle.load(open(path.dirname(__file__)+'/parse_table.dump', 'rb')))
+symbols = [intern(sym) for sym in ['END_SYM', ';', 'break', 'return', 'def', 'id', '(', ')', '{', '}', 'if', 'else', 'while', 'for', 'in', ',', 'exp@op', '=', '!', 'num', 'str', ':', '->', '[', ']', 'prog', 'stmLst', 'stm*', 'stm', 'line', 'retStm', 'block', 'funBlk', 'ifBlk', 'whileBlk', 'forBlk', 'idLst', 'id*', 'exp', 'exp@', 'exp@ops', 'exp@pre', 'prim', 'arrExp', 'arrComp', 'expLst', 'exp*', 'arrAcc', 'funExp', 'START_SYM']]
+sym_ids = dict((sym, i) for (i, sym) in enumerate(symbols))
+end_id = sym_ids[end_sym]
+unknown_id = len(symbols)                   # Id of labels not in the grammar
+spec_hash = '479bc6ca6e990c12a74f3437230d44dea75cde2ed2ff86c4dcfe2a59fbdcc67e'                           # Hash of the spec (see parsegen.spec_hash)
+
+# Operator layers (see parsegen.operator_layer)
+op_prec = {'..': (7, None), '...': (7, None), '+': (4, 'left'), '-': (4, 'left'), '*': (3, 'left'), '/': (3, 'left'), '%': (3, 'left'), '^': (1, 'right'), '&&': (5, 'left'), '||': (6, 'left'), '==': (7, None), '!=': (7, None), '<=': (7, None), '>=': (7, None), '>': (7, None), '<': (7, None)}
+op_wrap = {'exp': {'..': 'rngExp', '...': 'rngExp', '+': 'arithExp', '-': 'arithExp', '*': 'arithExp', '/': 'arithExp', '%': 'arithExp', '^': 'arithExp', '&&': 'logExp', '||': 'logExp', '==': 'logExp', '!=': 'logExp', '<=': 'logExp', '>=': 'logExp', '>': 'logExp', '<': 'logExp'}}
+op_shared = {'..': 'exp@op', '...': 'exp@op', '+': 'exp@op', '-': 'exp@op', '*': 'exp@op', '/': 'exp@op', '%': 'exp@op', '^': 'exp@op', '&&': 'exp@op', '||': 'exp@op', '==': 'exp@op', '!=': 'exp@op', '<=': 'exp@op', '>=': 'exp@op', '>': 'exp@op', '<': 'exp@op'}
+op_prods = {31: ('pass', 'exp'), 32: ('end', 'exp'), 33: ('start_prefix', 'exp'), 34: ('start_binary', 'exp'), 35: ('add_prefix', 'exp'), 36: ('add_binary', 'exp'), 37: ('prefix', 'exp', 8, 'assign'), 38: ('prefix', 'exp', 8, 'assign'), 39: ('prefix', 'exp', 2, 'logExp')}
+sym_ids.update((op, sym_ids[sym]) for (op, sym) in op_shared.items())
 
-# Return the abstract syntax tree given a concrete syntax tree. If the root of
-# the concrete syntax tree is contracted, then the resulting abstract syntax
+# Return the abstract syntax tree given the stack item of the root (see
+# parsegen.symbol_kind). If the root is contracted, then the abstract syntax
 # tree will be a list of trees.
-def ast(cst):
-    def rec(cst):
-        if type(cst) == node.nonterminal:       # Nonterminal
-            children = []
-            for child in cst.children:
-                children.extend(rec(child))
-            if cst.sym in clist:                # Contract nonterminal
-                return children
-            else:                               # Keep nonterminal
-                cst.children = children
-                return [cst]
-        elif cst.sym in tlist:                  # Keep terminal
-            return [cst]
-        else:                                   # Discard terminal
-            return []
-
-    res = rec(cst)
-    if len(res) > 1: return res                 # top-level contraction
-    return res[0]
+def tree(item):
+    if type(item) != tuple: return item
+    if len(item[2]) > 1: return item[2]         # top-level contraction
+    return item[2][0]
+
+# Raise a syntax error for the unexpected token value on the given line.
+def error(lexer, line, val):
+    frag = lexer.excerpt(line, 3)
+    raise SyntaxError('line %d: unexpected token "%s".\n%s'\
+        % (line, val, frag))
+
+# An error at an operator terminal that is not associative but follows an
+# operator of the same precedence.
+class operator_error(Exception):
+
+    def __init__(self, op):
+        self.op = op
+
+# Apply the operator on top of the given operator stack to the operands on top
+# of the given operand stack, given the operator nonterminal.
+def apply_operator(operators, operands, nt):
+    top = operators.pop()
+    if len(top) == 4:                       # Prefix operator
+        operand = operands.pop()
+        children = top[2]
+        children.append(operand)
+        start = top[3]
+        if top[1]: children = [node.nonterminal(top[1], children, start, operand.end_line)]
+        operands.append(node.nonterminal(nt, children, start, operand.end_line))
+    else:                                   # Binary operator
+        rhs = operands.pop()
+        lhs = operands.pop()
+        children = [lhs, top[1], rhs]
+        wrapper = op_wrap[nt][top[1].sym]
+        if wrapper: children = [node.nonterminal(wrapper, children, lhs.start_line, rhs.end_line)]
+        operands.append(node.nonterminal(nt, children, lhs.start_line, rhs.end_line))
+
+# Push the given binary operator terminal onto the given operator sequence of
+# operator nonterminal nt (see parsegen.operator_layer), a pair of an operand
+# stack and a stack of operators: (precedence, terminal) pairs and prefix
+# operators (precedence, wrapper, children, start line). The operators on the stack are
+# applied first if the LR table would reduce their productions before shifting
+# the operator, so the tree and any error are the same.
+def push_operator(seq, op, nt):
+    operands, operators = seq
+    prec, assoc = op_prec[op.sym]
+    while operators and operators[-1][0] <= prec:
+        if operators[-1][0] == prec:
+            if assoc == 'right': break
+            if assoc != 'left': raise operator_error(op)
+        apply_operator(operators, operands, nt)
+    operators.append((prec, op))
+
+# Return the node of operator nonterminal nt for the given operator sequence
+# (see push_operator) ended by the given operand.
+def end_operators(seq, operand, nt):
+    operands, operators = seq
+    operands.append(operand)
+    while operators:
+        apply_operator(operators, operands, nt)
+    return operands[0]
+
+# State functions
+
+sym_kind = [0, 0, 1, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 0, 1, 1, 1, 1, 1, 0, 0, 1, 1, 2, 2, 1, 1, 1, 1, 1, 1, 1, 1, 2, 1, 1, 1, 1, 1, 1, 1, 1, 2, 1, 1, 1]
+shift0 = {2: 7, 3: 25, 4: 8, 5: 17, 6: 2, 8: 31, 10: 18, 12: 29, 13: 13, 18: 1, 19: 21, 20: 28}
+shift2 = {5: 17, 6: 2, 8: 31, 18: 1, 19: 21, 20: 28}
+shift17 = {6: 39, 17: 40, 23: 41}
+shift31 = {5: 51, 6: 2, 8: 31, 18: 1, 19: 21, 20: 28}
+shift51 = {6: 39, 14: 62, 17: 40, 23: 41}
+
+def s0(sym, stack, states):
+    state = shift0.get(sym)
+    if state != None: return state
+    stack.append((None, None, []))
+    states.append(27)
+    return -1
+
+def s1(sym, stack, states):
+    c = stack[-1]
+    states.pop()
+    stack[-1] = (2, 'logExp', [c], c.start_line)
+    states.append(goto41[states[-1]])
+    return -1
+
+def s2(sym, stack, states):
+    state = shift2.get(sym)
+    if state != None: return state
+    return -3
+
+def s3(sym, stack, states):
+    if sym == 17: return 33
+    c = stack[-1]
+    states.pop()
+    stack[-1] = nonterminal('exp', [c], c.start_line, c.end_line)
+    states.append(goto38[states[-1]])
+    return -1
+
+def s4(sym, stack, states):
+    c = stack[-1]
+    states.pop()
+    stack[-1] = nonterminal('exp', [c], c.start_line, c.end_line)
+    states.append(goto38[states[-1]])
+    return -1
+
+def s5(sym, stack, states):
+    c = stack[-1]
+    states.pop()
+    stack[-1] = nonterminal('exp', [c], c.start_line, c.end_line)
+    states.append(goto38[states[-1]])
+    return -1
+
+def s6(sym, stack, states):
+    c = stack[-1]
+    states.pop()
+    stack[-1] = (c.start_line, c.end_line, [c])
+    states.append(26)
+    return -1
+
+def s7(sym, stack, states):
+    c = stack[-1]
+    states.pop()
+    stack[-1] = nonterminal('line', [c], c.start_line, c.end_line)
+    states.append(20)
+    return -1
+
+def s8(sym, stack, states):
+    if sym == 5: return 34
+    return -3
+
+def s9(sym, stack, states):
+    if sym == 16: return 35
+    states.pop()
+    states.append(goto39[states[-1]])
+    return -1
+
+def s10(sym, stack, states):
+    c = stack[-1]
+    states.pop()
+    stack[-1] = nonterminal('line', [c], c.start_line, c.end_line)
+    states.append(20)
+    return -1
+
+def s11(sym, stack, states):
+    state = shift2.get(sym)
+    if state != None: return state
+    return -3
+
+def s12(sym, stack, states):
+    stack[-1] = ([], [stack[-1]])
+    states.pop()
+    states.append(11)
+    return -1
+
+def s13(sym, stack, states):
+    if sym == 6: return 38
+    return -3
+
+def s14(sym, stack, states):
+    c = stack[-1]
+    states.pop()
+    stack[-1] = nonterminal('block', [c], c.start_line, c.end_line)
+    states.append(6)
+    return -1
+
+def s15(sym, stack, states):
+    c = stack[-1]
+    states.pop()
+    stack[-1] = nonterminal('block', [c], c.start_line, c.end_line)
+    states.append(6)
+    return -1
+
+def s16(sym, stack, states):
+    c = stack[-1]
+    states.pop()
+    stack[-1] = nonterminal('exp', [c], c.start_line, c.end_line)
+    states.append(goto38[states[-1]])
+    return -1
+
+def s17(sym, stack, states):
+    state = shift17.get(sym)
+    if state != None: return state
+    c = stack[-1]
+    states.pop()
+    stack[-1] = nonterminal('prim', [c], c.start_line, c.end_line)
+    states.append(22)
+    return -1
+
+def s18(sym, stack, states):
+    if sym == 6: return 42
+    return -3
+
+def s19(sym, stack, states):
+    c = stack[-1]
+    states.pop()
+    stack[-1] = nonterminal('block', [c], c.start_line, c.end_line)
+    states.append(6)
+    return -1
+
+def s20(sym, stack, states):
+    if sym == 1: return 43
+    return -3
+
+def s21(sym, stack, states):
+    c = stack[-1]
+    states.pop()
+    stack[-1] = nonterminal('prim', [c], c.start_line, c.end_line)
+    states.append(22)
+    return -1
+
+def s22(sym, stack, states):
+    c = stack[-1]
+    states.pop()
+    stack[-1] = nonterminal('exp', [c], c.start_line, c.end_line)
+    states.append(goto38[states[-1]])
+    return -1
+
+def s23(sym, stack, states):
+    if sym == 0: return -2
+    return -3
+
+def s24(sym, stack, states):
+    c = stack[-1]
+    states.pop()
+    stack[-1] = nonterminal('line', [c], c.start_line, c.end_line)
+    states.append(20)
+    return -1
+
+def s25(sym, stack, states):
+    state = shift2.get(sym)
+    if state != None: return state
+    c = stack[-1]
+    states.pop()
+    stack[-1] = nonterminal('retStm', [], c[0], c[1])
+    states.append(24)
+    return -1
+
+def s26(sym, stack, states):
+    state = shift0.get(sym)
+    if state != None: return state
+    states.pop()
+    states.append(goto27[states[-1]])
+    return -1
+
+def s27(sym, stack, states):
+    c = stack[-1]
+    states.pop()
+    stack[-1] = nonterminal('prog', c[2], c[0], c[1])
+    states.append(23)
+    return -1
+
+def s28(sym, stack, states):
+    c = stack[-1]
+    states.pop()
+    stack[-1] = nonterminal('prim', [c], c.start_line, c.end_line)
+    states.append(22)
+    return -1
+
+def s29(sym, stack, states):
+    if sym == 6: return 47
+    return -3
+
+def s30(sym, stack, states):
+    c = stack[-1]
+    states.pop()
+    stack[-1] = nonterminal('block', [c], c.start_line, c.end_line)
+    states.append(6)
+    return -1
+
+def s31(sym, stack, states):
+    state = shift31.get(sym)
+    if state != None: return state
+    stack.append((None, None, []))
+    states.append(48)
+    return -1
+
+def s32(sym, stack, states):
+    if sym == 7: return 52
+    return -3
+
+def s33(sym, stack, states):
+    c = stack[-2:]
+    del stack[-2:]
+    del states[-2:]
+    stack.append((8, 'assign', [c[0]], c[0].start_line))
+    states.append(goto41[states[-1]])
+    return -1
+
+def s34(sym, stack, states):
+    if sym == 6: return 53
+    return -3
+
+def s35(sym, stack, states):
+    op = stack.pop()
+    stack[-1] = ([stack[-1]], [])
+    push_operator(stack[-1], op, 'exp')
+    del states[-2:]
+    states.append(11)
+    return -1
+
+def s36(sym, stack, states):
+    if sym == 16: return 54
+    operand = stack.pop()
+    stack[-1] = end_operators(stack[-1], operand, 'exp')
+    del states[-2:]
+    states.append(goto39[states[-1]])
+    return -1
+
+def s37(sym, stack, states):
+    pre = stack.pop()
+    stack[-1][1].append(pre)
+    del states[-2:]
+    states.append(11)
+    return -1
+
+def s38(sym, stack, states):
+    if sym == 5: return 55
+    return -3
+
+def s39(sym, stack, states):
+    state = shift2.get(sym)
+    if state != None: return state
+    stack.append((None, None, []))
+    states.append(48)
+    return -1
+
+def s40(sym, stack, states):
+    c = stack[-2:]
+    del stack[-2:]
+    del states[-2:]
+    stack.append((8, 'assign', [c[0]], c[0].start_line))
+    states.append(goto41[states[-1]])
+    return -1
+
+def s41(sym, stack, states):
+    state = shift2.get(sym)
+    if state != None: return state
+    return -3
+
+def s42(sym, stack, states):
+    state = shift2.get(sym)
+    if state != None: return state
+    return -3
+
+def s43(sym, stack, states):
+    c = stack[-2:]
+    del stack[-2:]
+    del states[-2:]
+    stack.append((c[0].start_line, c[1][1], [c[0]]))
+    states.append(26)
+    return -1
+
+def s44(sym, stack, states):
+    return -3
+
+def s45(sym, stack, states):
+    c = stack[-2:]
+    del stack[-2:]
+    del states[-2:]
+    stack.append(nonterminal('retStm', [c[1]], c[0][0], c[1].end_line))
+    states.append(24)
+    return -1
+
+def s46(sym, stack, states):
+    c = stack[-2:]
+    del stack[-2:]
+    del states[-2:]
+    end = c[1][1]
+    if end == None: end = c[0][1]
+    stack.append((c[0][0], end, [*c[0][2], *c[1][2]]))
+    states.append(goto27[states[-1]])
+    return -1
+
+def s47(sym, stack, states):
+    state = shift2.get(sym)
+    if state != None: return state
+    return -3
+
+def s48(sym, stack, states):
+    c = stack[-1]
+    states.pop()
+    stack[-1] = nonterminal('expLst', c[2], c[0], c[1])
+    states.append(goto45[states[-1]])
+    return -1
+
+def s49(sym, stack, states):
+    if sym == 15: return 60
+    c = stack[-1]
+    states.pop()
+    stack[-1] = (c.start_line, c.end_line, [c])
+    states.append(goto46[states[-1]])
+    return -1
+
+def s50(sym, stack, states):
+    if sym == 9: return 61
+    return -3
+
+def s51(sym, stack, states):
+    state = shift51.get(sym)
+    if state != None: return state
+    c = stack[-1]
+    states.pop()
+    stack[-1] = nonterminal('prim', [c], c.start_line, c.end_line)
+    states.append(22)
+    return -1
+
+def s52(sym, stack, states):
+    c = stack[-3:]
+    del stack[-3:]
+    del states[-3:]
+    stack.append(nonterminal('exp', [c[1]], c[0][0], c[2][1]))
+    states.append(goto38[states[-1]])
+    return -1
+
+def s53(sym, stack, states):
+    if sym == 5: return 63
+    stack.append((None, None, []))
+    states.append(64)
+    return -1
+
+def s54(sym, stack, states):
+    op = stack.pop()
+    operand = stack.pop()
+    stack[-1][0].append(operand)
+    push_operator(stack[-1], op, 'exp')
+    del states[-3:]
+    states.append(11)
+    return -1
+
+def s55(sym, stack, states):
+    if sym == 14: return 66
+    return -3
+
+def s56(sym, stack, states):
+    if sym == 7: return 67
+    return -3
+
+def s57(sym, stack, states):
+    if sym == 24: return 68
+    return -3
+
+def s58(sym, stack, states):
+    if sym == 7: return 69
+    return -3
+
+def s59(sym, stack, states):
+    if sym == 7: return 70
+    return -3
+
+def s60(sym, stack, states):
+    state = shift2.get(sym)
+    if state != None: return state
+    stack.append((None, None, []))
+    states.append(71)
+    return -1
+
+def s61(sym, stack, states):
+    c = stack[-3:]
+    del stack[-3:]
+    del states[-3:]
+    stack.append(nonterminal('arrExp', [c[1]], c[0][0], c[2][1]))
+    states.append(5)
+    return -1
+
+def s62(sym, stack, states):
+    state = shift2.get(sym)
+    if state != None: return state
+    return -3
+
+def s63(sym, stack, states):
+    if sym == 15: return 73
+    c = stack[-1]
+    states.pop()
+    stack[-1] = (c.start_line, c.end_line, [c])
+    states.append(goto37[states[-1]])
+    return -1
+
+def s64(sym, stack, states):
+    c = stack[-1]
+    states.pop()
+    stack[-1] = nonterminal('idLst', c[2], c[0], c[1])
+    states.append(65)
+    return -1
+
+def s65(sym, stack, states):
+    if sym == 7: return 74
+    return -3
+
+def s66(sym, stack, states):
+    state = shift2.get(sym)
+    if state != None: return state
+    return -3
+
+def s67(sym, stack, states):
+    c = stack[-4:]
+    del stack[-4:]
+    del states[-4:]
+    stack.append(nonterminal('funExp', [c[0], c[2]], c[0].start_line, c[3][1]))
+    states.append(16)
+    return -1
+
+def s68(sym, stack, states):
+    c = stack[-4:]
+    del stack[-4:]
+    del states[-4:]
+    stack.append(nonterminal('arrAcc', [c[0], c[2]], c[0].start_line, c[3][1]))
+    states.append(3)
+    return -1
+
+def s69(sym, stack, states):
+    if sym == 8: return 76
+    return -3
+
+def s70(sym, stack, states):
+    if sym == 8: return 77
+    return -3
+
+def s71(sym, stack, states):
+    c = stack[-3:]
+    del stack[-3:]
+    del states[-3:]
+    end = c[2][1]
+    if end == None: end = c[1][1]
+    stack.append((c[0].start_line, end, [c[0], *c[2][2]]))
+    states.append(goto46[states[-1]])
+    return -1
+
+def s72(sym, stack, states):
+    if sym == 21: return 79
+    if sym == 22: return 78
+    return -3
+
+def s73(sym, stack, states):
+    if sym == 5: return 63
+    stack.append((None, None, []))
+    states.append(80)
+    return -1
+
+def s74(sym, stack, states):
+    if sym == 8: return 81
+    return -3
+
+def s75(sym, stack, states):
+    if sym == 7: return 82
+    return -3
+
+def s76(sym, stack, states):
+    state = shift0.get(sym)
+    if state != None: return state
+    stack.append((None, None, []))
+    states.append(83)
+    return -1
+
+def s77(sym, stack, states):
+    state = shift0.get(sym)
+    if state != None: return state
+    stack.append((None, None, []))
+    states.append(83)
+    return -1
+
+def s78(sym, stack, states):
+    state = shift2.get(sym)
+    if state != None: return state
+    return -3
+
+def s79(sym, stack, states):
+    state = shift2.get(sym)
+    if state != None: return state
+    return -3
+
+def s80(sym, stack, states):
+    c = stack[-3:]
+    del stack[-3:]
+    del states[-3:]
+    end = c[2][1]
+    if end == None: end = c[1][1]
+    stack.append((c[0].start_line, end, [c[0], *c[2][2]]))
+    states.append(goto37[states[-1]])
+    return -1
+
+def s81(sym, stack, states):
+    state = shift0.get(sym)
+    if state != None: return state
+    stack.append((None, None, []))
+    states.append(83)
+    return -1
+
+def s82(sym, stack, states):
+    if sym == 8: return 89
+    return -3
+
+def s83(sym, stack, states):
+    c = stack[-1]
+    states.pop()
+    stack[-1] = nonterminal('stmLst', c[2], c[0], c[1])
+    states.append(goto26[states[-1]])
+    return -1
+
+def s84(sym, stack, states):
+    if sym == 9: return 90
+    return -3
+
+def s85(sym, stack, states):
+    if sym == 9: return 91
+    return -3
+
+def s86(sym, stack, states):
+    if sym == 9: return 92
+    return -3
+
+def s87(sym, stack, states):
+    if sym == 9: return 94
+    if sym == 22: return 93
+    return -3
+
+def s88(sym, stack, states):
+    if sym == 9: return 95
+    return -3
+
+def s89(sym, stack, states):
+    state = shift0.get(sym)
+    if state != None: return state
+    stack.append((None, None, []))
+    states.append(83)
+    return -1
+
+def s90(sym, stack, states):
+    if sym == 11: return 97
+    return -3
+
+def s91(sym, stack, states):
+    c = stack[-7:]
+    del stack[-7:]
+    del states[-7:]
+    stack.append(nonterminal('whileBlk', [c[2], c[5]], c[0][0], c[6][1]))
+    states.append(30)
+    return -1
+
+def s92(sym, stack, states):
+    c = stack[-7:]
+    del stack[-7:]
+    del states[-7:]
+    stack.append(nonterminal('arrComp', [c[1], c[3], c[4], c[5]], c[0][0], c[6][1]))
+    states.append(4)
+    return -1
+
+def s93(sym, stack, states):
+    state = shift2.get(sym)
+    if state != None: return state
+    return -3
+
+def s94(sym, stack, states):
+    c = stack[-7:]
+    del stack[-7:]
+    del states[-7:]
+    stack.append(nonterminal('arrComp', [c[1], c[3], c[4], c[5]], c[0][0], c[6][1]))
+    states.append(4)
+    return -1
+
+def s95(sym, stack, states):
+    c = stack[-8:]
+    del stack[-8:]
+    del states[-8:]
+    stack.append(nonterminal('funBlk', [c[1], c[3], c[6]], c[0][0], c[7][1]))
+    states.append(15)
+    return -1
+
+def s96(sym, stack, states):
+    if sym == 9: return 99
+    return -3
+
+def s97(sym, stack, states):
+    if sym == 8: return 100
+    return -3
+
+def s98(sym, stack, states):
+    if sym == 9: return 101
+    return -3
+
+def s99(sym, stack, states):
+    c = stack[-9:]
+    del stack[-9:]
+    del states[-9:]
+    stack.append(nonterminal('forBlk', [c[2], c[4], c[7]], c[0][0], c[8][1]))
+    states.append(14)
+    return -1
+
+def s100(sym, stack, states):
+    state = shift0.get(sym)
+    if state != None: return state
+    stack.append((None, None, []))
+    states.append(83)
+    return -1
+
+def s101(sym, stack, states):
+    c = stack[-9:]
+    del stack[-9:]
+    del states[-9:]
+    stack.append(nonterminal('arrComp', [c[1], c[3], c[4], c[5], c[6], c[7]], c[0][0], c[8][1]))
+    states.append(4)
+    return -1
+
+def s102(sym, stack, states):
+    if sym == 9: return 103
+    return -3
+
+def s103(sym, stack, states):
+    c = stack[-11:]
+    del stack[-11:]
+    del states[-11:]
+    stack.append(nonterminal('ifBlk', [c[2], c[5], c[9]], c[0][0], c[10][1]))
+    states.append(19)
+    return -1
+
+goto26 = {76: 84, 77: 85, 81: 88, 89: 96, 100: 102}
+goto27 = {0: 27, 26: 46, 76: 83, 77: 83, 81: 83, 89: 83, 100: 83}
+goto37 = {53: 64, 73: 80}
+goto38 = {0: 9, 2: 9, 11: 36, 25: 9, 26: 9, 31: 9, 39: 9, 41: 9, 42: 9, 47: 9, 60: 9, 62: 9, 66: 9, 76: 9, 77: 9, 78: 9, 79: 9, 81: 9, 89: 9, 93: 9, 100: 9}
+goto39 = {0: 10, 2: 32, 25: 45, 26: 10, 31: 49, 39: 49, 41: 57, 42: 58, 47: 59, 60: 49, 62: 72, 66: 75, 76: 10, 77: 10, 78: 86, 79: 87, 81: 10, 89: 10, 93: 98, 100: 10}
+goto41 = {0: 12, 2: 12, 11: 37, 25: 12, 26: 12, 31: 12, 39: 12, 41: 12, 42: 12, 47: 12, 60: 12, 62: 12, 66: 12, 76: 12, 77: 12, 78: 12, 79: 12, 81: 12, 89: 12, 93: 12, 100: 12}
+goto45 = {31: 50, 39: 56}
+goto46 = {31: 48, 39: 48, 60: 71}
+step = [s0, s1, s2, s3, s4, s5, s6, s7, s8, s9, s10, s11, s12, s13, s14, s15, s16, s17, s18, s19, s20, s21, s22, s23, s24, s25, s26, s27, s28, s29, s30, s31, s32, s33, s34, s35, s36, s37, s38, s39, s40, s41, s42, s43, s44, s45, s46, s47, s48, s49, s50, s51, s52, s53, s54, s55, s56, s57, s58, s59, s60, s61, s62, s63, s64, s65, s66, s67, s68, s69, s70, s71, s72, s73, s74, s75, s76, s77, s78, s79, s80, s81, s82, s83, s84, s85, s86, s87, s88, s89, s90, s91, s92, s93, s94, s95, s96, s97, s98, s99, s100, s101, s102, s103]
 
 # Return an abstract syntax tree given a lexer object.
 def parse(lexer):
@@ -62,75 +762,90 @@ def parse(lexer):
     stack = []
     prev = None
     token = None
-    act = None
+    sym = None
 
     while True:
 
-        # print('stack: %s' % str(stack))
-        # print('state stack: %s' % str(state_stk))
-
         # Get next token and action
         if not token:
             try:
                 token = lexer.next()
-                act = table[state_stk[-1]][token.label]
+                sym = sym_ids.get(token.label, unknown_id)
             except StopIteration:
                 token = end_sym
-                act = table[state_stk[-1]][end_sym]
-        elif type(token) != str:
-            act = table[state_stk[-1]][token.label]
-        else:
-            act = table[state_stk[-1]][end_sym]
+                sym = end_id
+        try:
+            act = step[state_stk[-1]](sym, stack, state_stk)
+        except operator_error as err:
+            error(lexer, err.op.start_line, err.op.value)
 
-        # print('token: %s' % str(token))
-        # print('action: %s' % act)
+        if act == -1:                       # REDUCE (done by the state)
 
-        if not act:                         # ERROR
+            continue
 
-            val = None
+        elif act >= 0:                      # SHIFT
 
-            if type(token) == str:
-                token = prev
-                val = 'EOF'
+            if sym_kind[sym] == 1:
+                stack.append(node.terminal(token.label, token.value, token.start_line, token.end_line))
             else:
-                val = token.value
+                stack.append((token.start_line, token.end_line))
+            state_stk.append(act)
+            prev = token
+            token = None
 
-            frag = lexer.excerpt(token.start_line, 3, lexer.prog_str)
-            raise SyntaxError('line %d: unexpected token "%s".\n%s'\
-                % (token.start_line, val, frag))
+        elif act == -2:                     # ACCEPT
 
-        elif type(act) == action.SHIFT:     # SHIFT
+            return tree(stack[-1])
 
-            t = node.terminal(token.label, token.value, token.start_line, token.end_line)
-            # print('t.sym: %s' % t.sym)
-            # print('t.value: %s' % t.value)
-            stack.append(t)
-            state_stk.append(act.state_num)
-            prev = token
-            token = None
+        else:                               # ERROR
+
+            if type(token) == str:
+                error(lexer, prev.start_line if prev else 1, 'EOF')
+            error(lexer, token.start_line, token.value)
+
+# Return an abstract syntax tree given a token buffer (see tok.buffer) and the
+# lexer object that produced it. Tokens are read straight from the buffer
+# columns, without creating token objects.
+def parse_buffer(buf, lexer):
+
+    state_stk = [0]
+    stack = []
+    ids = buf.ids
+    labels = buf.labels
+    sym_of = [sym_ids.get(label, unknown_id) for label in labels]   # Label id -> symbol id
+    n = len(ids)
+    i = 0
+    sym = sym_of[ids[0]] if n else end_id
+
+    while True:
 
-        elif type(act) == action.REDUCE:    # REDUCE
-
-            children = stack[len(stack)-act.pop_num:]
-            for i in range(act.pop_num):
-                stack.pop()
-                state_stk.pop()
-            if len(children):
-                start = children[0].start_line
-                for child in reversed(children):
-                    end = child.end_line
-                    if end != None: break
+        try:
+            act = step[state_stk[-1]](sym, stack, state_stk)
+        except operator_error as err:
+            error(lexer, err.op.start_line, err.op.value)
+
+        if act == -1:                       # REDUCE (done by the state)
+
+            continue
+
+        elif act >= 0:                      # SHIFT
+
+            val = buf.value(i)
+            line = buf.line(i)
+            if sym_kind[sym] == 1:
+                stack.append(node.terminal(labels[ids[i]], val, line, line+val.count('\n')))
             else:
-                start = None
-                end = None
-            t = node.nonterminal(act.nt, children, start, end)
-            # print('t.sym: %s' % t.sym)
-            # print('t.children: %s' % t.children)
-            stack.append(t)
-            act = table[state_stk[-1]][act.nt]
-            state_stk.append(act.state_num)
-            # print('action: %s' % act)
-
-        elif type(act) == action.ACCEPT:    # ACCEPT
-
-            return ast(stack[-1])
\ No newline at end of file
+                stack.append((line, line+val.count('\n')))
+            state_stk.append(act)
+            i += 1
+            sym = sym_of[ids[i]] if i < n else end_id
+
+        elif act == -2:                     # ACCEPT
+
+            return tree(stack[-1])
+
+        else:                               # ERROR
+
+            if i == n:
+                error(lexer, buf.line(n-1) if n else 1, 'EOF')
+            error(lexer, buf.line(i), buf.value(i))
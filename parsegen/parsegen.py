@@ -40,17 +40,73 @@
 # around in the generated parse tree. The other separator "<" denotes a
 # nonterminal that will be contracted from the parse tree (i.e., it's children
 # become the children of the parent of the contracted nonterminal node).
-
-import re, time, pickle
-import action
+#
+# The abstract syntax tree:
+# The parser builds the abstract syntax tree as it reduces, so no concrete
+# syntax tree is ever built. Each symbol is kept, contracted or discarded (see
+# symbol_kind), and the stack holds a node for a kept symbol, a (start line,
+# end line, children) triple for a contracted nonterminal and a (start line,
+# end line) pair for a discarded terminal. A reduce splices the children of
+# contracted children into the children of its node and drops discarded ones,
+# while the line numbers of every child still count for those of the node.
+#
+# The binary table:
+# The parse table is written as a binary file of little-endian 32-bit integers that the parser loads with the array module.
+# The file starts with a header of the magic number, the format version, the
+# 32-byte spec hash of the parser it belongs to (see spec_hash) and the length
+# of each of the following arrays, in order:
+#
+#       prod_nt         Symbol id of the nonterminal of each production
+#       prod_len        Length of each production
+#       prod_rhs        Symbol ids of the right-hand side of each production,
+#                       concatenated in production order
+#       sym_kind        Kind of each symbol in the abstract syntax tree (see
+#                       symbol_kind)
+#       default         Default action of each state (applies to any terminal
+#                       not in the state's row)
+#       action_base     Row displacement of each state in the action arrays
+#       action_next     Terminal actions, packed as a comb vector
+#       action_check    State owning each slot of action_next
+#       goto_base       Row displacement of each state in goto_next
+#       goto_next       Goto states, packed as a comb vector
+#
+# An action is 0 for an error, s+1 to shift and go to state s, or -p-1 to
+# reduce by production p. Production 0 is the auxiliary start production, and
+# reducing by it accepts. The action of state s on terminal (symbol id) t is
+# action_next[action_base[s]+t] if action_check[action_base[s]+t] is s, and
+# default[s] otherwise. The goto state of state s on nonterminal n is
+# goto_next[goto_base[s]+n], which is only looked up when it exists.
+#
+# The parser cache:
+# Generated parsers carry the hash of the spec they were generated from, the
+# generator version and the generation options (see spec_hash). The parsegen
+# cache module uses it to check that a parser is up to date with its spec when
+# it is loaded, and keeps parsers for other specs in a cache directory of files
+# named after their hashes (see cached_parser_file).
+
+import os, re, sys, time, json, pickle, hashlib, multiprocessing
+from array import array
 from collections import defaultdict, OrderedDict
+if __package__:
+    from . import action
+else:
+    import action
 
 # Configuration variables
 
+version = 3                                 # Generator version (bump when generated parsers change)
+template_dir = os.path.dirname(os.path.abspath(__file__))   # Directory of the templates
 template_path = 'parser_template.py'        # Filepath of the template parser
 parser_suffix = '.py'                       # File suffix for parser
-dump_suffix = '_table.dump'                 # File suffix for parse table dump
+dump_suffix = '_table.dump'                 # File suffix for pickled parse table (see dumpable)
+bin_suffix = '_table.bin'                   # File suffix for binary parse table
+graph_suffix = '_graph.dump'                # File suffix for saved state graph
+stats_suffix = '_stats.json'                # File suffix for generation statistics
+code_template_path = 'parser_code_template.py'  # Filepath of the direct-dispatch template
+bin_magic = 0x54504c53                      # Magic number of binary parse tables
+bin_version = 3                             # Format version of binary parse tables
 dump_path = 'parse.out'                     # File to dump table to (if conflicts)
+batches = 4                                 # Batches per job of each level (see generate_graph_pool)
 
 # The grammar object.
 class grammar(object):
@@ -62,9 +118,17 @@ class grammar(object):
         self.rules = rules                  # Dictionary of production rules
         self.prec = prec                    # Dictionary of precedence numbers
         self.assoc = assoc                  # Dictionary of associativities
-        self.first = defaultdict(set)       # Dictionary of first sets
-        self.follow = defaultdict(set)      # Dictionary of follow sets
+        self.terms = []                     # List of terminals (bit i is terms[i])
+        self.bits = dict()                  # Dictionary of terminal bits
+        self.first = defaultdict(int)       # Dictionary of first sets (bitsets)
+        self.follow = defaultdict(int)      # Dictionary of follow sets (bitsets)
         self.nullable = defaultdict(bool)   # Dictionary of nullabilities
+        self.items = []                     # List of interned items (by id)
+        self.item_ids = dict()              # Dictionary of item ids by (nt, prod, dot)
+        self.starts = defaultdict(list)     # Dictionary of initial item ids
+        self.graph = None                   # Canonical LR(1) states and edges
+        self.reuse = None                   # Results of reusable for a saved graph
+        self.ops = dict()                   # Operator layers (see operator_layer)
         self.start_sym = 'START_SYM'        # Start symbol
         self.end_sym = 'END_SYM'            # End symbols
 
@@ -180,113 +244,260 @@ def parse_spec(spec):
 
     return grammar(root, tlist, clist, rules, prec, assoc)
 
+# Operator layers.
+# An operator nonterminal is one whose alternatives (its productions, or those
+# of "wrapper" nonterminals that are used only as one of its alternatives) are
+# operands, which neither start nor end with the nonterminal, and operators:
+# binary productions "nt op nt" and prefix productions "... op nt", where op
+# is a terminal with a precedence. An LR table resolves the conflicts between
+# the operators with states for every operator in every context. The operator
+# layer of the nonterminal instead has the table parse an expression as a flat
+# sequence of prefix operators, operands and binary operators, and the parser
+# builds the tree from the sequence as it goes by precedence climbing (see
+# push_operator in the templates), giving the same tree and errors the table
+# would. The layer of nonterminal nt replaces its operator productions with
+#
+#       nt@     : nt | nt@ops nt
+#       nt@ops  : nt@pre | nt op | nt@ops nt@pre | nt@ops nt op
+#       nt@pre  : ... op
+#
+# where nt keeps the operand productions, nt@ takes the place of nt in every
+# other production and nt@pre has a production for each prefix production.
+# Binary operators that are used nowhere else in the grammar share the terminal
+# nt@op, which the parser maps their labels to.
+
+# Return the kind of the given alternative of nonterminal nt: "binary",
+# "prefix", "operand", or None if it is none of them.
+def operator_kind(grammar, nt, prod):
+    if prod and prod[0] == nt:
+        if len(prod) == 3 and prod[2] == nt and not grammar.rules[prod[1]] and grammar.prec[prod[1]]:
+            return 'binary'
+        return None
+    elif prod and prod[-1] == nt:
+        if len(prod) > 1 and not grammar.rules[prod[-2]] and grammar.prec[prod[-2]]:
+            return 'prefix'
+        return None
+    return 'operand'
+
+# Add the operator layer of each operator nonterminal in the given grammar.
+def operator_layers(grammar):
+    for nt in [nt for (nt, prods) in grammar.rules.items() if prods]:
+        layer = operator_layer(grammar, nt)
+        if layer: grammar.ops[nt] = layer
+
+# Replace the operator productions of nonterminal nt in the given grammar with
+# its operator layer (see above) and return the layer, or return None if nt is
+# not an operator nonterminal. The layer is a dictionary of its nonterminals,
+# its binary operators and their wrappers (None for productions of nt), the
+# operators that share the terminal of the layer, and its prefix productions
+# and their wrappers.
+def operator_layer(grammar, nt):
+    rules = grammar.rules
+    top, ops_nt, pre, cls = nt+'@', nt+'@ops', nt+'@pre', nt+'@op'
+    uses = defaultdict(int)                 # Number of uses of each symbol
+    for prods in rules.values():
+        for prod in prods:
+            for sym in prod: uses[sym] += 1
+    if not rules[nt] or any(sym in rules or sym in uses for sym in (top, ops_nt, pre, cls)):
+        return None
+
+    # Sort the alternatives of nt into operands and operators
+    operands = []
+    binary = dict()                         # Wrapper of each binary operator
+    prefix = []                             # Prefix productions and their wrappers
+    for prod in rules[nt]:
+        wrapper = prod[0] if len(prod) == 1 and prod[0] != nt and rules[prod[0]] else None
+        alts = rules[wrapper] if wrapper else [prod]
+        kinds = [operator_kind(grammar, nt, alt) for alt in alts]
+        if None in kinds: return None
+        if kinds.count('operand') == len(kinds):
+            operands.append(prod)
+            continue
+        if 'operand' in kinds or wrapper and (uses[wrapper] > 1 or wrapper == grammar.root):
+            return None
+        for (alt, kind) in zip(alts, kinds):
+            if kind == 'binary':
+                if alt[1] in binary: return None
+                binary[alt[1]] = wrapper
+            else:
+                prefix.append((alt[:-1], wrapper))
+    if not binary or [] in operands: return None
+    wrappers = list(binary.values()) + [wrapper for (_, wrapper) in prefix]
+    if nt in grammar.clist or any(wrapper in grammar.clist for wrapper in wrappers) or\
+       any(op not in grammar.tlist for op in binary):
+        return None                         # The layer only builds kept nodes
+    shared = [op for op in binary if uses[op] == 1]
+
+    # Replace the operator productions
+    for wrapper in set(binary.values()) | set(wrapper for (_, wrapper) in prefix):
+        if wrapper: del rules[wrapper]
+    rename = lambda prod: [top if sym == nt else sym for sym in prod]
+    ops = [op for op in binary if op not in shared] + ([cls] if shared else [])
+    grammar.rules = defaultdict(list)
+    for (sym, prods) in rules.items():
+        grammar.rules[sym] = [rename(prod) for prod in (operands if sym == nt else prods)]
+        if sym == nt:
+            grammar.rules[top] = [[nt], [ops_nt, nt]]
+            grammar.rules[ops_nt] = ([[pre]] if prefix else []) + [[nt, op] for op in ops] +\
+                                 ([[ops_nt, pre]] if prefix else []) + [[ops_nt, nt, op] for op in ops]
+            if prefix: grammar.rules[pre] = [rename(alt) for (alt, _) in prefix]
+    if grammar.root == nt: grammar.root = top
+
+    return {
+        'top': top,
+        'ops': ops_nt,
+        'pre': pre,
+        'binary': binary,
+        'shared': dict((op, cls) for op in shared),
+        'prefix': dict((tuple(rename(alt)), wrapper) for (alt, wrapper) in prefix)
+    }
+
+# Return the kind and the operator nonterminal of the given production if it
+# is in an operator layer, or None. The kind is what its reduce does: "pass"
+# on an operand as it is, "end" a sequence, "start" or "add" a prefix or binary
+# operator to a sequence, or make a "prefix" operator.
+def layer_production(grammar, nt, prod):
+    for (op_nt, layer) in grammar.ops.items():
+        if nt == layer['top']:
+            return ('pass' if len(prod) == 1 else 'end', op_nt)
+        elif nt == layer['ops']:
+            kind = 'add_' if prod[0] == nt else 'start_'
+            return (kind + ('prefix' if prod[-1] == layer['pre'] else 'binary'), op_nt)
+        elif nt == layer['pre']:
+            return ('prefix', op_nt)
+    return None
+
 # LR(1) Parser generator.
 
-# An LR(1) parse table item.
+# An LR(0) item: a production and a dot position. Items are interned by the
+# grammar (see intern_items), and an LR(1) state is a dictionary of item ids
+# to lookahead bitsets (dict<item id, bitset>), so each item appears once per
+# state however many lookaheads it has.
 class item(object):
 
-    def __init__(self, nt, prod, dot, la):
+    def __init__(self, nt, prod, dot):
         self.nt = nt            # Nonterminal symbol
         self.prod = prod        # Production symbol list
         self.dot = dot          # Dot position
-        self.la = la            # Lookahead symbol
+        self.sym = None         # Next symbol (i.e., the one on the dot) or None
+        self.first = 0          # First set of the symbols after the next one
+        self.nullable = True    # Whether the symbols after the next one are nullable
+        if dot < len(prod):
+            self.sym = prod[dot]
 
     def __repr__(self):
         rhs = self.prod[:]
         rhs.insert(self.dot, '.')
         rhs = ' '.join(rhs)
-        return 'item(%s -> %s, %s)' % (self.nt, rhs, self.la)
-
-    def __eq__(self, other):
-        return other and self.nt == other.nt\
-                     and self.prod == other.prod\
-                     and self.dot == other.dot\
-                     and self.la == other.la
-
-    def __ne__(self, other):
-        return not self.__eq__(other)
-
-    def __hash__(self):
-        return hash((self.nt, str(self.prod), self.dot, self.la))
+        return 'item(%s -> %s)' % (self.nt, rhs)
 
     # Return whether the item is completed (i.e., the dot is at the end).
     def completed(self):
-        return self.dot >= len(self.prod)
+        return self.sym == None
 
     # Return the next symbol (i.e., the one on the dot) or None.
     def next(self):
-        return None if self.completed() else self.prod[self.dot]
-
-    # Return a copy of the item with the dot advanced and the specified
-    # lookahead symbol (defaults to the current lookahead symbol). If the item
-    # is already completed, raise an error. Note: The "copy" will still point to
-    # the same nt and prod (since these shouldn't ever change). Only the dot and
-    # la will be updated.
-    def advance(self, la=None):
-        if self.completed():
-            raise ValueError('cannot advance completed item %s.' % str(self))
-        return item(self.nt, self.prod, self.dot+1, la if la else self.la)
-
+        return self.sym
 
-# Compute the first and nullable properties for each symbol in the given
-# grammar.
+# Intern the items of every production in the given grammar, whose props must
+# already be computed. The items of a production are numbered consecutively,
+# so advancing the dot of item i gives item i+1.
+def intern_items(grammar):
+    for (nt, prods) in grammar.rules.items():
+        for prod in prods:
+            grammar.starts[nt].append(len(grammar.items))
+            for dot in range(len(prod)+1):
+                it = item(nt, prod, dot)
+                if not it.completed():
+                    it.first = first(grammar, prod[dot+1:])
+                    it.nullable = nullable(grammar, prod[dot+1:])
+                grammar.item_ids.setdefault((nt, tuple(prod), dot), len(grammar.items))
+                grammar.items.append(it)
+
+# Compute the first, follow and nullable properties for each symbol in the
+# given grammar. First and follow sets are bitsets over the terminals. Each
+# property is computed by propagating changes along its dependencies with a
+# worklist, so a symbol is only revisited when something it depends on changed.
 def compute_props(grammar):
 
-    # Initialize all terminal first sets to contain just that terminal
+    # Assign a bit to each terminal and initialize its first set to contain
+    # just that terminal
     for prods in grammar.rules.values():
         for prod in prods:
             for sym in prod:
-                if not grammar.rules.get(sym):
-                    grammar.first[sym] = set([sym])
-
-    changed = True
-
-    # Compute nonterminal first sets iteratively until fixpoint
-    while changed:
-
-        changed = False
-
-        for (nt, prods) in grammar.rules.items():
-
-            for prod in prods:
-
-                # Set nullable
-                if not prod or all(grammar.nullable[sym] for sym in prod):
-                    old_val = grammar.nullable[nt]
-                    grammar.nullable[nt] = True
-                    changed = changed or not old_val
-
-                # Extend first and follow sets
-                for i in range(len(prod)):
-
-                    if all(grammar.nullable[sym] for sym in prod[:i]):
-
-                        # print('%s: %s' % (nt, grammar.first[nt]))
-                        # print('%s: %s' % (prod[i], grammar.first[prod[i]]))
-                        old_len = len(grammar.first[nt])
-                        grammar.first[nt] |= grammar.first[prod[i]]
-                        # print('%s: %s' % (nt, grammar.first[nt]))
-                        changed = changed or old_len != len(grammar.first[nt])
-
-                    if all(grammar.nullable[sym] for sym in prod[i+1:]):
-
-                        old_len = len(grammar.follow[prod[i]])
-                        grammar.follow[prod[i]] |= grammar.follow[nt]
-                        changed = changed or old_len != len(grammar.follow[prod[i]])
-
-                    for j in range(i+1, len(prod)):
-
-                        if all(grammar.nullable[sym] for sym in prod[i+1:j]):
-
-                            old_len = len(grammar.follow[prod[i]])
-                            grammar.follow[prod[i]] |= grammar.first[prod[j]]
-                            changed = changed or old_len != len(grammar.follow[prod[i]])
-
+                if not grammar.rules.get(sym) and sym not in grammar.bits:
+                    grammar.bits[sym] = 1 << len(grammar.terms)
+                    grammar.terms.append(sym)
+                    grammar.first[sym] = grammar.bits[sym]
+
+    prods = [(nt, prod) for (nt, nt_prods) in grammar.rules.items() for prod in nt_prods]
+
+    # Compute nullability: a production is nullable once its count of symbols
+    # not known to be nullable drops to zero
+    count = [len(prod) for (nt, prod) in prods]
+    uses = defaultdict(list)
+    for (k, (nt, prod)) in enumerate(prods):
+        for sym in prod:
+            uses[sym].append(k)
+    work = [nt for (k, (nt, prod)) in enumerate(prods) if not count[k]]
+    while work:
+        sym = work.pop()
+        if grammar.nullable[sym]: continue
+        grammar.nullable[sym] = True
+        for k in uses[sym]:
+            count[k] -= 1
+            if not count[k]: work.append(prods[k][0])
+
+    # Compute first sets: the first set of each symbol that starts a production
+    # after a nullable prefix flows into the first set of the nonterminal
+    succ = defaultdict(set)
+    for (nt, prod) in prods:
+        for sym in prod:
+            succ[sym].add(nt)
+            if not grammar.nullable[sym]: break
+    propagate(grammar.first, succ, list(grammar.terms))
+
+    # Compute follow sets: scanning each production from the right, every
+    # symbol is followed by the first set of the nullable-prefixed rest, and
+    # the follow set of the nonterminal flows into symbols with a nullable rest
+    succ = defaultdict(set)
+    for (nt, prod) in prods:
+        rest = 0
+        rest_nullable = True
+        for sym in reversed(prod):
+            grammar.follow[sym] |= rest
+            if rest_nullable: succ[nt].add(sym)
+            rest = grammar.first[sym] | (rest if grammar.nullable[sym] else 0)
+            rest_nullable = rest_nullable and grammar.nullable[sym]
+    propagate(grammar.follow, succ, list(grammar.follow))
+
+# Add the bitset of each symbol to the bitsets of its successors (dict<symbol,
+# set<symbol>>) until no bitset changes, starting from the given symbols.
+def propagate(sets, succ, work):
+    while work:
+        sym = work.pop()
+        bits = sets[sym]
+        for other in succ[sym]:
+            if bits & ~sets[other]:
+                sets[other] |= bits
+                work.append(other)
+
+# Return the list of terminals in the given bitset.
+def bit_syms(grammar, bits):
+    res = []
+    while bits:
+        low = bits & -bits
+        res.append(grammar.terms[low.bit_length()-1])
+        bits ^= low
+    return res
 
+# Return whether the terminal is in the given bitset.
+def has_bit(grammar, sym, bits):
+    return bool(grammar.bits.get(sym, 0) & bits)
 
-# Return the first set for a given list of symbols.
+# Return the first set for a given list of symbols as a bitset.
 def first(grammar, syms):
-    res = set()
+    res = 0
     for sym in syms:
         res |= grammar.first[sym]
         if not grammar.nullable[sym]: break
@@ -296,98 +507,318 @@ def first(grammar, syms):
 def nullable(grammar, syms):
     return all(grammar.nullable[sym] for sym in syms)
 
-# Return the closure set given a set of items.
-def closure_set(grammar, items):
-
-    changed = True
-    done = defaultdict(bool)
-
-    while changed:
-
-        changed = False
-
-        for it in list(items):
-
-            if done[it]: continue
-
-            for prod in grammar.rules[it.next()]:
-
-                # subprod_str = str(it.prod[it.dot+1:])
-                first_set = first(grammar, it.prod[it.dot+1:])
-
-                if nullable(grammar, it.prod[it.dot+1:]):
-                    first_set.add(it.la)
-
-                for sym in first_set:
-
-                    old_len = len(items)
-                    items.add(item(it.next(), prod, 0, sym))
-                    changed = changed or len(items) != old_len
-
-            done[it] = True
-
-    return items
+# Return the closure state given the kernel items as (item id, lookahead
+# bitset) pairs. An item is revisited only when its lookaheads grow.
+def closure_set(grammar, kern):
+
+    items = grammar.items
+    state = dict(kern)
+    work = list(state)
+
+    while work:
+
+        i = work.pop()
+        it = items[i]
+        starts = grammar.starts.get(it.sym)
+        if not starts: continue
+
+        la = it.first
+        if it.nullable: la |= state[i]
+
+        for k in starts:
+            old = state.get(k, 0)
+            if la & ~old:
+                state[k] = old | la
+                work.append(k)
+
+    return state
+
+# Return the kernel of a state as a sorted tuple of (item id, lookahead bitset)
+# pairs: the items whose dot is not at the start, and the start item.
+def kernel(grammar, state):
+    items = grammar.items
+    return tuple(sorted((i, la) for (i, la) in state.items()
+                        if items[i].dot or items[i].nt == grammar.start_sym))
+
+# Return a dictionary of the goto kernel of a state for each symbol after a dot
+# (dict<symbol, kernel>): the items with the symbol on the dot, with the dot
+# advanced past it.
+def goto_kernels(grammar, state):
+    res = defaultdict(list)
+    for (i, la) in state.items():
+        sym = grammar.items[i].sym
+        if sym: res[sym].append((i+1, la))
+    return dict((sym, tuple(sorted(kern))) for (sym, kern) in res.items())
 
 # Return the goto set of items given a state and symbol.
 def goto_set(grammar, state, sym):
-    j = set(it.advance() for it in state if it.next() == sym)
-    return closure_set(grammar, j)
-
-# Return the index and state or an equivalent state in the given state list and
-# add the state if it is not in the state list. Note: This function assumes that
-# states are disjoint.
-def add_state(states, new):
-    for (i, state) in enumerate(states):
-        if state == new:
-            return (i, state)
-    # exit(1)
-    states.append(new)
-    return (len(states)-1, new)
+    return closure_set(grammar, goto_kernels(grammar, state)[sym])
+
+# Return the index of the state with the given kernel in the given state list,
+# using the index dictionary (dict<kernel, state number>), and add the closure
+# of the kernel as a new state if there is none yet. A state is determined by
+# its kernel, so states are only closed when they are first found, or not at
+# all if the reuse dictionary (dict<kernel, state>) already has the state.
+def add_state(grammar, states, index, kern, reuse=None):
+    i = index.get(kern)
+    if i == None:
+        i = index[kern] = len(states)
+        state = reuse.get(kern) if reuse else None
+        states.append(state if state != None else closure_set(grammar, kern))
+    return i
 
 # Return the list of states and the set of (goto and shift) edges between states
-# given a grammar and start state.
-def generate_graph(grammar, start):
+# given a grammar and start state. States are processed once each in the order
+# they are found, and their successors are found in symbol order, so the
+# numbering is the same on every run. States in the optional reuse dictionary
+# (see add_state) are not closed again. With more than one job, the states are
+# closed in a process pool (see generate_graph_pool).
+def generate_graph(grammar, start, reuse=None, jobs=1):
+
+    if jobs > 1: return generate_graph_pool(grammar, start, reuse, jobs)
 
     states = [start]
+    index = {kernel(grammar, start): 0}
     edges = set()
-    changed = True
-    checked = defaultdict(lambda: defaultdict(bool))
-    done = defaultdict(bool)
 
     # Generate states and goto edges
-    while changed:
+    i = 0
+    while i < len(states):
+        kerns = goto_kernels(grammar, states[i])
+        for sym in sorted(kerns):
+            j = add_state(grammar, states, index, kerns[sym], reuse)
+            edges.add((i, sym, j))
+        i += 1
 
-        changed = False
+    return (states, edges)
 
-        for (i, state) in enumerate(states):
+# Parallel generation.
+# The states are found level by level: the successors of the states found in
+# one level make up the next. The kernels of a level are numbered in the order
+# the sequential search would number them, since it also processes every state
+# of a level before any state of the next, and are then closed in batches by
+# a pool of worker processes that each hold a copy of the grammar. So the
+# graph is the same whatever the number of jobs.
+
+worker_grammar = None                       # Grammar of a pool worker process
+
+# Set the grammar of a pool worker process.
+def init_worker(grammar):
+    global worker_grammar
+    worker_grammar = grammar
+
+# Return the closure state and goto kernels (see goto_kernels) of each kernel in
+# the given batch, in a pool worker process.
+def expand_batch(kerns):
+    res = []
+    for kern in kerns:
+        state = closure_set(worker_grammar, kern)
+        res.append((state, goto_kernels(worker_grammar, state)))
+    return res
 
-            if done[i]: continue
+# Return the list of states and the set of edges between states given a grammar
+# and start state, like generate_graph, closing each level of new states in a
+# pool of the given number of processes.
+def generate_graph_pool(grammar, start, reuse, jobs):
 
-            for sym in set(it.next() for it in state if it.next() and not checked[i][it.next()]):
+    states = [start]
+    gotos = [goto_kernels(grammar, start)]
+    index = {kernel(grammar, start): 0}
+    edges = set()
 
-                checked[i][sym] = True
-                new_state = goto_set(grammar, state, sym)
-                old_state_len = len(states)
-                j, new_state = add_state(states, new_state)
-                # print(len(states))
-                old_edge_len = len(edges)
-                edges.add((i, sym, j))
-                updated = len(states) != old_state_len or len(edges) != old_edge_len
-                changed = changed or updated
-                done[i] = not updated
+    pool = multiprocessing.Pool(jobs, init_worker, (grammar,))
+    try:
+        lo = 0
+        while lo < len(states):
+            hi = len(states)
+
+            # Number the successors of the level, keeping reused states
+            todo = []
+            for i in range(lo, hi):
+                kerns = gotos[i]
+                for sym in sorted(kerns):
+                    kern = kerns[sym]
+                    j = index.get(kern)
+                    if j == None:
+                        j = index[kern] = len(states)
+                        state = reuse.get(kern) if reuse else None
+                        states.append(state)
+                        gotos.append(goto_kernels(grammar, state) if state != None else None)
+                        if state == None: todo.append((j, kern))
+                    edges.add((i, sym, j))
+
+            # Close the new states in batches
+            size = max(1, -(-len(todo) // (jobs*batches)))
+            chunks = [todo[k:k+size] for k in range(0, len(todo), size)]
+            results = pool.map(expand_batch, [[kern for (_, kern) in chunk] for chunk in chunks])
+            for (chunk, res) in zip(chunks, results):
+                for ((j, _), (state, kerns)) in zip(chunk, res):
+                    states[j] = state
+                    gotos[j] = kerns
+
+            lo = hi
+    finally:
+        pool.terminate()
 
     return (states, edges)
 
+# Incremental generation.
+# A graph saved from an earlier run (see saved_graph) holds its states in terms
+# of symbols rather than item ids (and its lookahead bits in terms of its own
+# terminal list), along with the rules and symbol properties they were computed
+# with. A saved state can be reused as it is if
+# its closure does not involve an affected symbol: one whose productions, first
+# set or nullability changed. Its items are then the same in the new grammar.
+
+# Return the graph of the given grammar, whose table has been computed, in a
+# picklable form that does not depend on item ids or terminal bits.
+def saved_graph(grammar):
+    states, edges = grammar.graph
+    items = grammar.items
+    return {
+        'version': version,
+        'rules': dict((nt, [tuple(prod) for prod in prods])
+                      for (nt, prods) in grammar.rules.items() if prods),
+        'first': dict((sym, bit_syms(grammar, bits)) for (sym, bits) in grammar.first.items()),
+        'nullable': set(sym for (sym, val) in grammar.nullable.items() if val),
+        'terms': grammar.terms,
+        'states': [[((items[i].nt, tuple(items[i].prod), items[i].dot), la)
+                    for (i, la) in state.items()] for state in states]
+    }
+
+# Return the set of affected symbols of the grammar given a saved graph.
+def affected(grammar, old):
+    rules = dict((nt, [tuple(prod) for prod in prods])
+                 for (nt, prods) in grammar.rules.items() if prods)
+    res = set(nt for nt in set(rules) | set(old['rules'])
+              if rules.get(nt) != old['rules'].get(nt))
+    for sym in set(grammar.first) | set(old['first']):
+        if set(bit_syms(grammar, grammar.first[sym])) != set(old['first'].get(sym, [])):
+            res.add(sym)
+    for sym in set(grammar.nullable) | old['nullable']:
+        if grammar.nullable[sym] != (sym in old['nullable']):
+            res.add(sym)
+    return res
+
+# Return a dictionary of the reusable states of a saved graph by their kernels
+# in the given grammar (dict<kernel, state>), and a dictionary of the old state
+# number of every saved state that still exists in the grammar by its kernel,
+# whether reusable or not.
+def reusable(grammar, old, syms):
+    reuse = dict()
+    old_nums = dict()
+    old_terms = old['terms']
+    bits = dict()                           # New bitset of each old bitset (or None)
+    for (n, old_state) in enumerate(old['states']):
+        state = dict()
+        for ((nt, prod, dot), old_la) in old_state:
+            i = grammar.item_ids.get((nt, prod, dot))
+            if old_la not in bits:
+                las = [old_terms[k] for k in range(len(old_terms)) if old_la >> k & 1]
+                bits[old_la] = None
+                if all(la in grammar.bits for la in las):
+                    bits[old_la] = sum(grammar.bits[la] for la in las)
+            if i == None or bits[old_la] == None: break
+            state[i] = bits[old_la]
+        else:
+            kern = kernel(grammar, state)
+            old_nums[kern] = n
+            if not any(nt in syms or any(sym in syms for sym in prod[dot:])
+                       for ((nt, prod, dot), las) in old_state):
+                reuse[kern] = state
+    return (reuse, old_nums)
+
+# Return how the states of the grammar, whose table has been computed, differ
+# from those of a saved graph: the affected symbols, the numbers of the reused,
+# recomputed (with their old numbers) and new states, and the old numbers of
+# the removed states.
+def graph_changes(grammar, old):
+    states = grammar.graph[0]
+    syms, reuse, old_nums = grammar.reuse
+    changes = {'symbols': sorted(syms), 'reused': [], 'recomputed': [], 'new': []}
+    found = set()
+    for (i, state) in enumerate(states):
+        kern = kernel(grammar, state)
+        if kern in reuse:
+            changes['reused'].append(i)
+        elif kern in old_nums:
+            changes['recomputed'].append([i, old_nums[kern]])
+        else:
+            changes['new'].append(i)
+        if kern in old_nums: found.add(old_nums[kern])
+    changes['removed'] = [n for n in range(len(old['states'])) if n not in found]
+    return changes
+
+# Return a report (a list of lines) of the given state graph changes (see
+# graph_changes), listing at most the given number of example states per kind.
+def graph_report(changes, examples=5):
+    def sample(nums):
+        return ', '.join(nums[:examples]) + (', ...' if len(nums) > examples else '') or 'none'
+    counts = tuple(len(changes[kind]) for kind in ('reused', 'recomputed', 'new', 'removed'))
+    return ['Affected symbols: %s' % (' '.join(changes['symbols']) or 'none'),
+            'States: %d (%d reused, %d recomputed, %d new), %d old states removed' %
+            ((sum(counts[:3]),) + counts),
+            'Recomputed: %s' % sample(['%d (was %d)' % (i, n) for (i, n) in changes['recomputed']]),
+            'New: %s' % sample([str(i) for i in changes['new']]),
+            'Removed (old numbers): %s' % sample([str(n) for n in changes['removed']])]
+
+# Return the core of a state: its item ids without lookaheads.
+def core(state):
+    return frozenset(state)
+
+# Return the LALR(1) states and edges given the canonical LR(1) states and
+# edges, by merging states that have the same core, and a list of the merged
+# state number of each canonical state. Merged states are numbered in order of
+# their first canonical state, so the start state stays state 0.
+def merge_states(states, edges):
+    index = dict()
+    merged = []
+    where = []
+    for state in states:
+        j = index.setdefault(core(state), len(merged))
+        if j == len(merged): merged.append(dict())
+        for (i, la) in state.items():
+            merged[j][i] = merged[j].get(i, 0) | la
+        where.append(j)
+    merged_edges = set((where[i], x, where[j]) for (i, x, j) in edges)
+    return (merged, merged_edges, where)
+
+# Return a dictionary of the productions each lookahead reduces by in the state.
+def reductions(grammar, state):
+    res = defaultdict(set)
+    for (i, la) in state.items():
+        it = grammar.items[i]
+        if it.completed():
+            for sym in bit_syms(grammar, la):
+                res[sym].add((it.nt, tuple(it.prod)))
+    return res
+
+# Return the reduce-reduce conflicts introduced by merging canonical LR(1)
+# states into LALR(1) states, as a list of (state number, lookahead,
+# productions) triples. A conflict counts as introduced if none of the merged
+# canonical states already had it.
+def merge_conflicts(grammar, states, merged, where):
+    canonical = set()
+    for (i, state) in enumerate(states):
+        for (la, prods) in reductions(grammar, state).items():
+            if len(prods) > 1: canonical.add((where[i], la))
+    res = []
+    for (j, state) in enumerate(merged):
+        for (la, prods) in reductions(grammar, state).items():
+            if len(prods) > 1 and (j, la) not in canonical:
+                res.append((j, la, sorted(prods)))
+    return res
+
 # Return the last terminal symbol in the symbol list or None.
 def last_terminal(grammar, syms):
     terms = [sym for sym in syms if not grammar.rules[sym]]
     if len(terms): return terms[-1]
     return None
 
-# Return whether the item is an acceptable item.
-def is_acceptable(grammar, it):
+# Return whether the item is an acceptable item with the given lookahead.
+def is_acceptable(grammar, it, la):
     return it.nt == grammar.start_sym and it.next() == grammar.end_sym\
-                                      and it.la == grammar.end_sym
+                                      and la == grammar.end_sym
 
 # Return the parse table and a list of conflicts given a grammar and state
 # graph.
@@ -412,93 +843,97 @@ def generate_table(grammar, states, edges):
     # Fill in reduce actions
     for (i, state) in enumerate(states):
 
-        for it in (it for it in state if it.la):
+        for (k, la_bits) in sorted(state.items()):
+
+            it = grammar.items[k]
 
-            if is_acceptable(grammar, it):                  # Accept
+            for la in bit_syms(grammar, la_bits):
 
-                table[i][it.la] = action.ACCEPT()
+                if is_acceptable(grammar, it, la):              # Accept
 
-            elif it.completed():                            # Reduce
+                    table[i][la] = action.ACCEPT()
 
-                new_action = action.REDUCE(last_terminal(grammar, it.prod), it.nt, it.prod)
-                old_action = table[i][it.la]
+                elif it.completed():                            # Reduce
 
-                if not old_action:
+                    new_action = action.REDUCE(last_terminal(grammar, it.prod), it.nt, it.prod)
+                    old_action = table[i][la]
 
-                    if len(it.prod):
-                        table[i][it.la] = new_action
+                    if not old_action:
 
-                    elif it.la in grammar.follow[it.nt] - grammar.first[it.nt]:
-                        table[i][it.la] = new_action
+                        if len(it.prod):
+                            table[i][la] = new_action
 
-                else:                                       # Conflict
+                        elif has_bit(grammar, la, grammar.follow[it.nt] & ~grammar.first[it.nt]):
+                            table[i][la] = new_action
 
-                    if type(old_action) == action.REDUCE:   # Reduce-reduce
+                    else:                                       # Conflict
 
-                        if len(old_action.prod) + len(new_action.prod) == 0:
-                            table[i][it.la] = [old_action, new_action]
-                            conflicts.append([old_action, new_action])
-                        elif len(new_action.prod):
-                            table[i][it.la] = new_action
+                        if type(old_action) == action.REDUCE:   # Reduce-reduce
 
-                    else:                                   # Shift-reduce
+                            if len(old_action.prod) + len(new_action.prod) == 0:
+                                table[i][la] = [old_action, new_action]
+                                conflicts.append([old_action, new_action])
+                            elif len(new_action.prod):
+                                table[i][la] = new_action
 
-                        # print('action.SHIFT-action.REDUCE conflict')
+                        else:                                   # Shift-reduce
 
-                        s = old_action
-                        r = new_action
+                            # print('action.SHIFT-action.REDUCE conflict')
 
-                        # print('  s: {0}, {1}'.format(s, grammar.prec[s.sym]))
-                        # print('  r: {0}, {1}'.format(r, grammar.prec[r.sym]))
+                            s = old_action
+                            r = new_action
 
-                        if s.sym == r.sym or grammar.prec[s.sym] == grammar.prec[r.sym]:
+                            # print('  s: {0}, {1}'.format(s, grammar.prec[s.sym]))
+                            # print('  r: {0}, {1}'.format(r, grammar.prec[r.sym]))
 
-                            # print('  same prec')
+                            if s.sym == r.sym or grammar.prec[s.sym] == grammar.prec[r.sym]:
 
-                            direction = grammar.assoc[s.sym]
-                            # print('s: %s, dir: %s' % (s, direction))
+                                # print('  same prec')
 
-                            if direction == 'left':
-                                table[i][it.la] = r
-                            elif direction == 'right':
-                                continue
-                            else:
-                                # print('set to None:')
-                                # print('  s: %s' % s.sym)
-                                # print('  r: %s' % r.sym)
-                                table[i][it.la] = None
+                                direction = grammar.assoc[s.sym]
+                                # print('s: %s, dir: %s' % (s, direction))
 
-                        elif grammar.prec[s.sym] and grammar.prec[r.sym]:
+                                if direction == 'left':
+                                    table[i][la] = r
+                                elif direction == 'right':
+                                    continue
+                                else:
+                                    # print('set to None:')
+                                    # print('  s: %s' % s.sym)
+                                    # print('  r: %s' % r.sym)
+                                    table[i][la] = None
 
-                            # print('  different prec')
+                            elif grammar.prec[s.sym] and grammar.prec[r.sym]:
 
-                            if grammar.prec[s.sym] < grammar.prec[r.sym]:
-                                continue
-                            else:
-                                table[i][it.la] = r
+                                # print('  different prec')
 
-                        elif not len(it.prod) and it.la in\
-                            grammar.follow[it.nt] - grammar.first[it.nt]:
-                            table[i][it.la] = r
+                                if grammar.prec[s.sym] < grammar.prec[r.sym]:
+                                    continue
+                                else:
+                                    table[i][la] = r
 
-                        else:                               # Unresolved
+                            elif not len(it.prod) and has_bit(grammar, la,\
+                                grammar.follow[it.nt] & ~grammar.first[it.nt]):
+                                table[i][la] = r
 
-                            table[i][it.la] = [old_action, new_action]
-                            conflicts.append([old_action, new_action])
+                            else:                               # Unresolved
+
+                                table[i][la] = [old_action, new_action]
+                                conflicts.append([old_action, new_action])
 
     return (table, conflicts)
 
 # Print the parse table and a list of conflicts. If a file is specified, write
 # the output to the file.
-def print_table(states, table, f=None):
+def print_table(grammar, states, table, f=None):
     write = print
     if f: write = lambda x: f.write('\n'+str(x))
     conflicts = []
     for (i, state) in enumerate(table):
         write('State %d:' % i)
         write('  Items:')
-        for it in states[i]:
-            write('    %s' % it)
+        for (k, la) in states[i].items():
+            write('    %s, %s' % (grammar.items[k], '/'.join(bit_syms(grammar, la))))
         write('  Actions:')
         for (la, action) in state.items():
             write('    %s%s->  %s%s' %\
@@ -512,44 +947,98 @@ def print_table(states, table, f=None):
 
 # Return a generated LR(1) parse table (dict<state number, dict<lookahead
 # symbol, action>>), a list of any conflicts, and a list of items in states,
-# given a grammar object.
-def get_table(grammar):
-
-    # Start item
-    start_prod = [grammar.root, grammar.end_sym]
-    start_item = item(grammar.start_sym, start_prod, 0, None)
-    start_set = set([start_item])
+# given a grammar object. If mode is "lalr", states with the same core are
+# merged into an LALR(1) table and any reduce-reduce conflicts the merge
+# introduces are added to the conflicts. If a saved graph (see saved_graph) of
+# an earlier version of the grammar is given, its unaffected states are reused.
+# The states are closed in a pool of the given number of jobs if it is over one.
+# If a stats dictionary is given, the time of each phase is recorded in it.
+def get_table(grammar, mode='lr1', old=None, jobs=1, stats=None):
 
     # Add auxiliary root production rule
+    start_prod = [grammar.root, grammar.end_sym]
     grammar.rules[grammar.start_sym] = [start_prod]
 
     # Compute first set and nullability for each symbol in the grammar
+    t = time.perf_counter()
     compute_props(grammar)
+    t = lap(stats, 'compute_props', t)
+    intern_items(grammar)
+    t = lap(stats, 'intern_items', t)
 
     # print(grammar.first)
     # print(grammar.nullable)
 
-    # Initialize the graph
-    start_state = closure_set(grammar, start_set)
+    # Initialize the graph with the start item (which has no lookahead)
+    start_item = grammar.starts[grammar.start_sym][0]
+    start_state = closure_set(grammar, [(start_item, 0)])
+    t = lap(stats, 'start_closure', t)
     # print(start_state)
     # exit(0)
 
+    # Find the states of the saved graph that can be reused
+    reuse = None
+    if old:
+        syms = affected(grammar, old)
+        reuse, old_nums = reusable(grammar, old, syms)
+        grammar.reuse = (syms, reuse, old_nums)
+        t = lap(stats, 'reusable', t)
+
     # Construct rest of states
-    states, edges = generate_graph(grammar, start_state)
+    states, edges = generate_graph(grammar, start_state, reuse, jobs)
+    grammar.graph = (states, edges)
+    t = lap(stats, 'generate_graph', t)
+    extra = []
+
+    # Merge states with the same core
+    if mode == 'lalr':
+        merged, edges, where = merge_states(states, edges)
+        extra = merge_conflicts(grammar, states, merged, where)
+        states = merged
+        t = lap(stats, 'merge_states', t)
+    elif mode != 'lr1':
+        raise ValueError('unknown table mode "%s".' % mode)
 
     # Construct table and get any conflicts
     table, conflicts = generate_table(grammar, states, edges)
+    lap(stats, 'generate_table', t)
+    for (i, la, prods) in extra:
+        conflicts.append('LALR merge in state %d on %s: %s' % (i, la,
+            ', '.join('%s -> %s' % (nt, ' '.join(prod) or 'EMPTY') for (nt, prod) in prods)))
     return (table, conflicts, states)
 
-# Return a dumpable object given a parse table.
-def dumpable(table):
+# Return the list of grammar symbols, whose indices are their symbol ids: the
+# end symbol, then the other terminals and the nonterminals in order of first
+# appearance in the rules.
+def symbol_list(grammar):
+    syms = [grammar.end_sym]
+    nts = [nt for (nt, prods) in grammar.rules.items() if prods]
+    for nt in nts:
+        for prod in grammar.rules[nt]:
+            syms.extend(sym for sym in prod if sym not in syms and sym not in nts)
+    syms.extend(nt for nt in nts if nt not in syms)
+    return syms
+
+# Return the kind of the given symbol in the abstract syntax tree: 0 if it is
+# a discarded terminal, 1 if it is kept and 2 if it is a contracted nonterminal.
+# The nonterminals and shared terminals of operator layers are kept.
+def symbol_kind(grammar, sym):
+    if grammar.rules.get(sym): return 2 if sym in grammar.clist else 1
+    if sym in grammar.tlist: return 1
+    if any(sym in layer['shared'].values() for layer in grammar.ops.values()): return 1
+    return 0
+
+# Return a dumpable object given a parse table and the symbol ids. The generated
+# parsers do not load it; it is only written for inspection (see parser_file).
+def dumpable(table, sym_ids):
 
     res = [[] for _ in table]
 
     for (i, state) in enumerate(table):
         for (sym, act) in state.items():
             if not act: continue
-            elif type(act) == action.SHIFT:
+            sym = sym_ids[sym]
+            if type(act) == action.SHIFT:
                 tup = (sym, ('SHIFT', act.state_num, act.sym))
                 res[i].append(tup)
             elif type(act) == action.GOTO:
@@ -561,43 +1050,526 @@ def dumpable(table):
             else:
                 tup = (sym, ('ACCEPT'))
                 res[i].append(tup)
+        res[i].sort(key=lambda tup: tup[0])
+
+    return res
+
+# Return the row displacement packing of the given rows (list<dict<column,
+# value>>) of a table with the given number of columns, as lists of the base of
+# each row and of the packed values and the row owning each slot (-1 if free).
+# Rows are placed densest first at the lowest base where they fit. If share is
+# True, identical rows are placed at the same base (and the owners are only
+# meaningful for the first of them).
+def pack(rows, width, share=False):
+    base = [0]*len(rows)
+    values = []
+    owner = []
+    placed = dict()                         # Base of each distinct row
+    used = 0                                # Bitset of used slots
+    for r in sorted(range(len(rows)), key=lambda r: -len(rows[r])):
+        row = rows[r]
+        if not row: continue
+        key = tuple(sorted(row.items())) if share else r
+        if key in placed:
+            base[r] = placed[key]
+            continue
+
+        # Bit d of clash is set if the row does not fit at base d, so the
+        # lowest base is its lowest clear bit
+        clash = 0
+        for c in row:
+            clash |= used >> c
+        d = (~clash & (clash+1)).bit_length() - 1
+
+        if d+width > len(owner):
+            values.extend([0]*(d+width-len(owner)))
+            owner.extend([-1]*(d+width-len(owner)))
+        for (c, value) in row.items():
+            values[d+c] = value
+            owner[d+c] = r
+            used |= 1 << (d+c)
+        base[r] = placed[key] = d
+    values.extend([0]*(width-len(values)))
+    owner.extend([-1]*(width-len(owner)))
+    return (base, values, owner)
+
+# Return the list of (nonterminal, production) pairs of the given grammar,
+# numbered with the auxiliary start production first.
+def productions(grammar):
+    prods = [(grammar.start_sym, grammar.rules[grammar.start_sym][0])]
+    prods.extend((nt, prod) for (nt, nt_prods) in grammar.rules.items()
+                 if nt != grammar.start_sym for prod in nt_prods)
+    return prods
+
+# Return the integer-encoded actions (see above) of the given parse table as
+# lists of the default action of each state, the terminal actions of each state
+# (dict<symbol id, action>) and the goto states of each state (dict<symbol id,
+# state number>), given the grammar, the productions and the symbol ids. A
+# state gets the most common reduce action of its row as its default, unless
+# the table explicitly has no action (None) for some terminal in the state,
+# which must stay an error.
+def encode(grammar, table, prods, sym_ids):
+
+    prod_ids = dict()
+    for (p, (nt, prod)) in enumerate(prods):
+        prod_ids.setdefault((nt, tuple(prod)), p)
+
+    default = []
+    actions = []
+    gotos = []
+    for state in table:
+        row = dict()
+        goto_row = dict()
+        explicit_error = False
+        for (sym, act) in state.items():
+            if type(act) == action.GOTO:
+                goto_row[sym_ids[sym]] = act.state_num
+            elif type(act) == action.SHIFT:
+                row[sym_ids[sym]] = act.state_num+1
+            elif type(act) == action.REDUCE:
+                row[sym_ids[sym]] = -prod_ids[(act.nt, tuple(act.prod))]-1
+            elif type(act) == action.ACCEPT:
+                row[sym_ids[sym]] = -1
+            elif not act:
+                explicit_error = True
+        reduces = [act for act in row.values() if act < -1]
+        best = 0
+        if reduces and not explicit_error:
+            best = max(sorted(set(reduces), reverse=True), key=reduces.count)
+            row = dict((sym, act) for (sym, act) in row.items() if act != best)
+        default.append(best)
+        actions.append(row)
+        gotos.append(goto_row)
+
+    return (default, actions, gotos)
+
+# Return the arrays of the binary table (see above) of the given parse table,
+# given the grammar and the symbol ids.
+def table_arrays(grammar, table, sym_ids):
+
+    prods = productions(grammar)
+    default, actions, gotos = encode(grammar, table, prods, sym_ids)
+    width = len(sym_ids)+1                  # Columns include the unknown symbol
+
+    action_base, action_next, action_check = pack(actions, width)
+    goto_base, goto_next, _ = pack(gotos, width, True)
+    arrays = [
+        [sym_ids[nt] for (nt, prod) in prods],
+        [len(prod) for (nt, prod) in prods],
+        [sym_ids[sym] for (nt, prod) in prods for sym in prod],
+        [symbol_kind(grammar, sym) for sym in sorted(sym_ids, key=sym_ids.get)],
+        default, action_base, action_next, action_check, goto_base, goto_next
+    ]
+    return arrays
+
+# Return the binary table (see above) with the given arrays (see table_arrays)
+# as bytes, given the spec hash.
+def binary_table(arrays, key):
+
+    header = array('i', [bin_magic, bin_version])
+    res = array('i', [len(a) for a in arrays])
+    for a in arrays:
+        res.extend(a)
+    if sys.byteorder == 'big':
+        header.byteswap()
+        res.byteswap()
+    return header.tobytes() + bytes.fromhex(key) + res.tobytes()
+
+# Return the Python source that pops the children of the given nonempty
+# production off the stacks of a state function, and the expressions of the
+# children of its abstract syntax tree node, its start line and its end line
+# (see above). The children are bound to c, which for a single child is the
+# child itself and stays on the stack to be replaced.
+def children_code(grammar, prod):
+    n = len(prod)
+    kinds = [symbol_kind(grammar, sym) for sym in prod]
+    if n == 1:
+        c = ['c']
+        res = ['c = stack[-1]', 'states.pop()']
+    else:
+        c = ['c[%d]' % i for i in range(n)]
+        res = ['c = stack[-%d:]' % n, 'del stack[-%d:]' % n, 'del states[-%d:]' % n]
+    def line(i, end):
+        if kinds[i] == 1: return '%s.%s' % (c[i], 'end_line' if end else 'start_line')
+        return '%s[%d]' % (c[i], end)
+
+    # The end line is that of the last child that has one
+    i = n-1
+    end = line(i, 1)
+    if i and grammar.nullable[prod[i]]:
+        res.append('end = %s' % end)
+        while i and grammar.nullable[prod[i]]:
+            i -= 1
+            res.append('if end == None: end = %s' % line(i, 1))
+        end = 'end'
+
+    kept = [(c[i], kind) for (i, kind) in enumerate(kinds) if kind]
+    if n > 1 and kinds.count(1) == n:
+        children = 'c'
+    elif len(kept) == 1 and kept[0][1] == 2:
+        children = '%s[2]' % kept[0][0]
+    else:
+        children = '[%s]' % ', '.join(item if kind == 1 else '*%s[2]' % item for (item, kind) in kept)
+    return (res, children, line(0, 0), end)
+
+# Return the Python source of the reduce by production p (a nonterminal and
+# production pair), indented for a state function, that goes to the given goto
+# state or looks it up in the goto dictionary of the nonterminal if it is None.
+# The reduce pushes the abstract syntax tree node of the nonterminal if it is
+# kept, or a triple of its line numbers and children if it is contracted. The
+# productions of an operator layer build its operator sequences instead (see
+# layer_production and push_operator in the templates).
+def reduce_code(grammar, p, x, goto):
+    nt, prod = p
+    n = len(prod)
+    kind, op_nt = layer_production(grammar, nt, prod) or (None, None)
+    res = []
+    if kind == 'pass':
+        res.append('states.pop()')
+    elif kind == 'end':
+        res.append('operand = stack.pop()')
+        res.append('stack[-1] = end_operators(stack[-1], operand, %r)' % op_nt)
+        res.append('del states[-2:]')
+    elif kind == 'start_prefix':
+        res.append('stack[-1] = ([], [stack[-1]])')
+        res.append('states.pop()')
+    elif kind == 'start_binary':
+        res.append('op = stack.pop()')
+        res.append('stack[-1] = ([stack[-1]], [])')
+        res.append('push_operator(stack[-1], op, %r)' % op_nt)
+        res.append('del states[-2:]')
+    elif kind == 'add_prefix':
+        res.append('pre = stack.pop()')
+        res.append('stack[-1][1].append(pre)')
+        res.append('del states[-2:]')
+    elif kind == 'add_binary':
+        res.append('op = stack.pop()')
+        res.append('operand = stack.pop()')
+        res.append('stack[-1][0].append(operand)')
+        res.append('push_operator(stack[-1], op, %r)' % op_nt)
+        res.append('del states[-3:]')
+    elif n == 1 and symbol_kind(grammar, nt) == symbol_kind(grammar, prod[0]) == 2:
+        res.append('states.pop()')          # The children are the same
+    elif n:
+        lines, children, start, end = children_code(grammar, prod)
+        res.extend(lines)
+        if kind == 'prefix':
+            item = '(%d, %r, %s, %s)' % (grammar.prec[prod[-1]],
+                                         grammar.ops[op_nt]['prefix'][tuple(prod)], children, start)
+        elif symbol_kind(grammar, nt) == 1:
+            item = 'nonterminal(%r, %s, %s, %s)' % (nt, children, start, end)
+        else:
+            item = '(%s, %s, %s)' % (start, end, children)
+        res.append(('stack[-1] = %s' if n == 1 else 'stack.append(%s)') % item)
+    elif symbol_kind(grammar, nt) == 1:
+        res.append('stack.append(nonterminal(%r, [], None, None))' % nt)
+    else:
+        res.append('stack.append((None, None, []))')
+    if goto == None:
+        res.append('states.append(goto%d[states[-1]])' % x)
+    else:
+        res.append('states.append(%d)' % goto)
+    res.append('return -1')
+    return res
 
+# Return the Python source of the operator layer tables of a parser (see
+# push_operator in the templates) given the grammar: the precedence and
+# associativity of each binary operator, its wrapper in each operator
+# nonterminal, the terminal its label is mapped to if it shares one, and the
+# kind (see layer_production), operator nonterminal, and for prefix operators
+# the precedence and wrapper of each operator layer production.
+def operator_code(grammar):
+    prec = dict()
+    wrap = dict()
+    shared = dict()
+    for (nt, layer) in grammar.ops.items():
+        for op in layer['binary']:
+            prec[op] = (grammar.prec[op], grammar.assoc[op])
+        wrap[nt] = layer['binary']
+        shared.update(layer['shared'])
+    prods = dict()
+    for (p, (nt, prod)) in enumerate(productions(grammar)):
+        layer = layer_production(grammar, nt, prod)
+        if not layer: continue
+        if layer[0] == 'prefix':
+            layer += (grammar.prec[prod[-1]], grammar.ops[layer[1]]['prefix'][tuple(prod)])
+        prods[p] = layer
+    return '\n'.join(['op_prec = %r' % prec, 'op_wrap = %r' % wrap,
+                      'op_shared = %r' % shared, 'op_prods = %r' % prods])
+
+# Return the Python source of the state functions of a direct-dispatch parser
+# (see parser_code_template.py) given the grammar, parse table and symbol ids.
+# Each state function takes the lookahead symbol id and the node and state
+# stacks, and returns the state to shift to, or -1 after reducing, -2 to
+# accept or -3 on an error. The goto state after a reduce is a constant if
+# every state the reduce can uncover goes to the same state.
+def parser_code(grammar, table, sym_ids):
+
+    prods = productions(grammar)
+    default, actions, gotos = encode(grammar, table, prods, sym_ids)
+    end_id = sym_ids[grammar.end_sym]
+
+    # Find the predecessors of each state
+    preds = [set() for state in table]
+    for (i, state) in enumerate(table):
+        for act in state.values():
+            if type(act) in (action.SHIFT, action.GOTO):
+                preds[act.state_num].add(i)
+
+    # Return the goto state of the reduce by production p in state i, or None
+    # if it depends on the uncovered state
+    def goto_of(i, p):
+        uncovered = set([i])
+        for _ in prods[p][1]:
+            uncovered = set(j for k in uncovered for j in preds[k])
+        x = sym_ids[prods[p][0]]
+        targets = set(gotos[j][x] for j in uncovered if x in gotos[j])
+        if len(targets) == 1: return targets.pop()
+        return None
+
+    consts = []                             # Shift dictionaries
+    shift_names = dict()                    # Name of each distinct shift dictionary
+    lines = []
+    used = set()                            # Nonterminals needing goto dictionaries
+    for (i, row) in enumerate(actions):
+        lines.append('def s%d(sym, stack, states):' % i)
+        shifts = dict((sym, act-1) for (sym, act) in row.items() if act > 0)
+        reduces = defaultdict(list)
+        for (sym, act) in sorted(row.items()):
+            if act < -1: reduces[-act-1].append(sym)
+        if len(shifts) > 2:
+            shifts = repr(dict(sorted(shifts.items())))
+            if shifts not in shift_names:
+                shift_names[shifts] = 'shift%d' % i
+                consts.append('%s = %s' % (shift_names[shifts], shifts))
+            lines.append('    state = %s.get(sym)' % shift_names[shifts])
+            lines.append('    if state != None: return state')
+        else:
+            for (sym, state) in sorted(shifts.items()):
+                lines.append('    if sym == %d: return %d' % (sym, state))
+        if row.get(end_id) == -1:
+            lines.append('    if sym == %d: return -2' % end_id)
+        for (p, syms) in sorted(reduces.items()):
+            goto = goto_of(i, p)
+            if goto == None: used.add(sym_ids[prods[p][0]])
+            if len(syms) == 1:
+                lines.append('    if sym == %d:' % syms[0])
+            else:
+                lines.append('    if sym in {%s}:' % ', '.join(str(sym) for sym in syms))
+            lines.extend('        '+line for line in reduce_code(grammar, prods[p], sym_ids[prods[p][0]], goto))
+        if default[i]:
+            p = -default[i]-1
+            goto = goto_of(i, p)
+            if goto == None: used.add(sym_ids[prods[p][0]])
+            lines.extend('    '+line for line in reduce_code(grammar, prods[p], sym_ids[prods[p][0]], goto))
+        else:
+            lines.append('    return -3')
+        lines.append('')
+
+    # Goto dictionaries and the state function list
+    for x in sorted(used):
+        lines.append('goto%d = %r' % (x, dict((j, gotos[j][x]) for j in range(len(gotos)) if x in gotos[j])))
+    lines.append('step = [%s]' % ', '.join('s%d' % i for i in range(len(actions))))
+    kinds = 'sym_kind = %r' % [symbol_kind(grammar, sym) for sym in sorted(sym_ids, key=sym_ids.get)]
+    return '\n'.join([kinds] + consts + [''] + lines)
+
+# Statistics.
+# With the stats option, parser_file records how long each phase of generation
+# takes (see lap) and measures the states and table it generated (see
+# table_stats), and writes it all as JSON to a stats file next to the parser.
+
+# Record the time since t as the given phase in the given stats dictionary, if
+# there is one, and return the current time.
+def lap(stats, phase, t):
+    now = time.perf_counter()
+    if stats != None: stats['phases'][phase] = now - t
+    return now
+
+# Return the statistics of the given states and parse table, given the grammar
+# and the arrays of the binary table (see table_arrays). Densities are the
+# fraction of (state, symbol) cells that have an entry, and the fill of a
+# packed array is the fraction of its slots in use.
+def table_stats(grammar, table, states, arrays):
+    terms = [sym for sym in symbol_list(grammar) if not grammar.rules[sym]]
+    nts = [nt for (nt, prods) in grammar.rules.items() if prods]
+    sizes = [len(state) for state in states]
+    shifts = reduces = gotos = 0
+    for row in table:
+        for act in row.values():
+            if type(act) == action.GOTO: gotos += 1
+            elif type(act) == action.REDUCE: reduces += 1
+            elif act: shifts += 1
+    default, action_next, action_check, goto_next = arrays[4], arrays[6], arrays[7], arrays[9]
+    return {
+        'grammar': {
+            'terminals': len(terms),
+            'nonterminals': len(nts),
+            'productions': sum(len(grammar.rules[nt]) for nt in nts),
+            'items': len(grammar.items)
+        },
+        'states': {
+            'lr1': len(grammar.graph[0]),
+            'count': len(states),
+            'items': sum(sizes),
+            'items_per_state': sum(sizes)/len(sizes),
+            'max_items': max(sizes)
+        },
+        'table': {
+            'shifts': shifts,
+            'reduces': reduces,
+            'gotos': gotos,
+            'action_density': (shifts+reduces)/(len(states)*len(terms)),
+            'goto_density': gotos/(len(states)*len(nts)),
+            'default_reduces': sum(1 for act in default if act),
+            'action_slots': len(action_next),
+            'action_fill': sum(1 for i in action_check if i >= 0)/max(len(action_next), 1),
+            'goto_slots': len(goto_next)
+        }
+    }
+
+# Return a report (a list of lines) of the given statistics.
+def stats_report(stats):
+    phases = stats['phases']
+    width = max(len(phase) for phase in phases)
+    res = ['%s  %8.4fs' % (phase.ljust(width), secs) for (phase, secs) in phases.items()]
+    states, table = stats['states'], stats['table']
+    res.append('States: %d (%d LR(1)), %.1f items per state (max %d)' %
+               (states['count'], states['lr1'], states['items_per_state'], states['max_items']))
+    res.append('Table: %.1f%% action density, %.1f%% goto density, %d action and %d goto slots' %
+               (100*table['action_density'], 100*table['goto_density'],
+                table['action_slots'], table['goto_slots']))
+    res.append('Files: %s' % ', '.join('%s %d bytes' % (suffix, size)
+                                       for (suffix, size) in stats['files'].items()))
     return res
 
-# Create a parser Python program file and a parse table pickled file at the
-# given path, given a spec string. If dump is True and there are any conflicts,
-# dump the table into a file called "parse.out" for inspection.
-def parser_file(path, spec, dump):
+# Create a parser Python program file, a parse table pickled file and a binary
+# parse table file at the given path, given a spec string. If dump is True and
+# there are any conflicts, dump the table into a file called "parse.out" for
+# inspection. The mode is "lr1" for a canonical LR(1) table or "lalr" for an
+# LALR(1) table. If code is True, the parser is a direct-dispatch parser with
+# the table compiled into its code instead of one that loads the binary table.
+# If inc is True, the state graph is saved to a graph file at the path, and the
+# graph saved by the previous run (if any) is reused and a summary of the changed
+# states is printed (the full lists go to the stats file). The states are generated with the given number of jobs
+# (see generate_graph), which does not change the result. If stats is True,
+# generation statistics are written to a stats file at the path and printed. If
+# prec is True, operator nonterminals are parsed by precedence climbing over
+# their operator layers (see operator_layer). If pickled is True, the table is
+# also pickled to a dump file at the path (see dumpable).
+def parser_file(path, spec, dump, mode='lr1', code=False, inc=False, jobs=1, stats=False,
+                prec=False, pickled=False):
+    stats = {'mode': mode, 'code': code, 'prec': prec, 'jobs': jobs, 'phases': dict()} if stats else None
+    t = start = time.perf_counter()
     grammar = parse_spec(spec)
+    t = lap(stats, 'parse_spec', t)
+    if prec:
+        operator_layers(grammar)
+        lap(stats, 'operator_layers', t)
+    key = spec_hash(spec, mode, code, prec)
+    name = os.path.basename(path)
 
     # print(grammar.prec)
     # print(grammar.assoc)
 
-    table, conflicts, states = get_table(grammar)
+    # Load the previous state graph
+    old = None
+    if inc and os.path.exists(path+graph_suffix):
+        f = open(path+graph_suffix, 'rb')
+        old = pickle.load(f)
+        f.close()
+        if old.get('version') != version: old = None
+
+    table, conflicts, states = get_table(grammar, mode, old, jobs, stats)
+    if old:
+        changes = graph_changes(grammar, old)
+        print('\n'.join(graph_report(changes)))
+        if stats != None: stats['graph'] = changes
 
     # Check for conflicts
     if len(conflicts):
         if dump:                            # Present -q flag
             f = open(dump_path, 'w')
-            print_table(states, table, f)
+            print_table(grammar, states, table, f)
             f.close()
             raise Exception('conflicts (%d) so dumping table to "parse.out".' % len(conflicts))
         else:                               # No -q flag
             raise Exception('conflicts (%d):\n%s' %\
                 (len(conflicts), '\n'.join(str(conflict) for conflict in conflicts)))
 
+    # Save state graph
+    if inc:
+        f = open(path+graph_suffix, 'wb')
+        pickle.dump(saved_graph(grammar), f)
+        f.close()
+
     # Pickle parse table
-    f = open(path+dump_suffix, 'wb')
-    pickle.dump(dumpable(table), f)
+    t = time.perf_counter()
+    syms = symbol_list(grammar)
+    sym_ids = dict((sym, i) for (i, sym) in enumerate(syms))
+    if pickled:
+        f = open(path+dump_suffix, 'wb')
+        pickle.dump(dumpable(table, sym_ids), f)
+        f.close()
+        t = lap(stats, 'dump', t)
+
+    # Write binary parse table
+    arrays = table_arrays(grammar, table, sym_ids)
+    f = open(path+bin_suffix, 'wb')
+    f.write(binary_table(arrays, key))
     f.close()
+    t = lap(stats, 'binary_table', t)
 
     # Generate parser file
-    temp_str = open(template_path, 'r').read()
+    temp_str = open(os.path.join(template_dir, code_template_path if code else template_path), 'r').read()
     tlist = ', '.join('\'{0}\''.format(t) for t in grammar.tlist)
     clist = ', '.join('\'{0}\''.format(c) for c in grammar.clist)
+    syms = ', '.join('\'{0}\''.format(sym) for sym in syms)
     f = open(path+parser_suffix, 'w')
-    f.write(temp_str.format(grammar.end_sym, tlist, clist, path+dump_suffix))
+    f.write(temp_str.format(grammar.end_sym, tlist, clist, name+dump_suffix, syms,
+                            name+bin_suffix, parser_code(grammar, table, sym_ids) if code else '',
+                            key, operator_code(grammar)))
     f.close()
+    lap(stats, 'parser', t)
+
+    # Write statistics
+    if stats != None:
+        lap(stats, 'total', start)
+        stats.update(table_stats(grammar, table, states, arrays))
+        stats['files'] = dict((suffix, os.path.getsize(path+suffix))
+                              for suffix in (parser_suffix, dump_suffix, bin_suffix)
+                              if os.path.exists(path+suffix))
+        f = open(path+stats_suffix, 'w')
+        json.dump(stats, f, indent=2)
+        f.close()
+        print('\n'.join(stats_report(stats)))
+
+# Return the hash of a spec string and the generator version and options, which
+# identifies the parser generated from them.
+def spec_hash(spec, mode='lr1', code=False, prec=False):
+    key = '%d\n%s\n%s\n%s\n%s' % (version, mode, code, prec, spec)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+# Return the filepath (without suffix) of the parser for the given spec string
+# and options in the cache directory at the given path, generating the parser
+# first if it is not cached. The parser is generated in a temporary directory
+# and moved into the cache with the parser file last, so a parser file in the
+# cache is always complete.
+def cached_parser_file(cache_path, spec, mode='lr1', code=False, prec=False):
+    name = 'p' + spec_hash(spec, mode, code, prec)
+    fpath = os.path.join(cache_path, name)
+    if os.path.exists(fpath+parser_suffix): return fpath
+    os.makedirs(cache_path, exist_ok=True)
+    tmp_path = os.path.join(cache_path, 'tmp%d' % os.getpid())
+    os.makedirs(tmp_path, exist_ok=True)
+    try:
+        parser_file(os.path.join(tmp_path, name), spec, False, mode, code, prec=prec)
+        for suffix in (bin_suffix, parser_suffix):
+            os.replace(os.path.join(tmp_path, name+suffix), fpath+suffix)
+    finally:
+        for fname in os.listdir(tmp_path):
+            os.remove(os.path.join(tmp_path, fname))
+        os.rmdir(tmp_path)
+    return fpath
 
 # # Test code
 
@@ -607,18 +1579,32 @@ def parser_file(path, spec, dump):
 
 # When executed, take filepath fpath and spec filepath sfpath arguments and
 # write a parser program to fpath given the spec at sfpath. If there are any
-# conflicts, dump the table into a file called "parse.out". An optional first
+# conflicts, dump the table into a file called "parse.out". An optional
 # argument "-q" (quiet) alters this behavior by only printing conflicts to
-# stderr and does not generate "parse.out".
+# stderr and does not generate "parse.out". An optional argument "-lalr"
+# generates an LALR(1) table instead of a canonical LR(1) table. An optional
+# argument "-code" generates a direct-dispatch parser (see parser_code). An
+# optional argument "-inc" reuses the states of the previous "-inc" run that a
+# grammar edit did not affect and prints a report of the changed states. An
+# optional argument "-jN" generates the states in N processes, or in one
+# process per CPU for "-j". An optional argument "-stats" writes the time of
+# each phase and the size of the states and table to a stats file and prints
+# them. An optional argument "-prec" parses operator nonterminals by precedence
+# climbing (see operator_layer). An optional argument "-pickle" also writes the
+# table to a pickled dump file (see dumpable).
 if __name__ == "__main__":
     from sys import argv
-    if len(argv) == 3:                      # No -q flag
-        fpath = argv[1]
-        spec = open(argv[2], 'r').read()
-        parser_file(fpath, spec, True)
-    elif len(argv) == 4:                    # Present -q flag
-        fpath = argv[2]
-        spec = open(argv[3], 'r').read()
-        parser_file(fpath, spec, False)
-    else:
-        raise ValueError('expected 2 or 3 arguments but got %d instead.' % len(argv)-1)
\ No newline at end of file
+    flags = [arg for arg in argv[1:] if arg[0] == '-']
+    args = [arg for arg in argv[1:] if arg[0] != '-']
+    jobs = [flag[2:] for flag in flags if flag[:2] == '-j']
+    flags = [flag for flag in flags if flag[:2] != '-j']
+    if len(args) != 2 or set(flags) - set(['-q', '-lalr', '-code', '-inc', '-stats', '-prec', '-pickle'])\
+                      or len(jobs) > 1 or not all(n.isdigit() for n in jobs if n):
+        raise ValueError('expected arguments [-q] [-lalr] [-code] [-inc] [-jN] [-stats] [-prec]' +
+                         ' [-pickle] fpath sfpath.')
+    fpath = args[0]
+    spec = open(args[1], 'r').read()
+    jobs = (int(jobs[0]) if jobs[0] else os.cpu_count()) if jobs else 1
+    parser_file(fpath, spec, '-q' not in flags, 'lalr' if '-lalr' in flags else 'lr1',
+                '-code' in flags, '-inc' in flags, jobs, '-stats' in flags, '-prec' in flags,
+                '-pickle' in flags)
\ No newline at end of file
@@ -0,0 +1,190 @@
+# A direct-dispatch LR(1) parser generated by parsegen.py. This file is
+# automatically generated. Do not edit.
+#
+# Each parser state is compiled into a state function (see parsegen.parser_code)
+# that branches on the lookahead symbol id and performs reduces inline, building
+# the abstract syntax tree as it goes.
+
+from sys import intern
+from . import node
+
+nonterminal = node.nonterminal
+
+# Symbol names are interned, so comparing them to other interned strings (such
+# as string literals in the interpreter) is an identity check.
+end_sym = intern('{0}')
+tlist = [{1}]
+clist = [{2}]
+symbols = [intern(sym) for sym in [{4}]]
+sym_ids = dict((sym, i) for (i, sym) in enumerate(symbols))
+end_id = sym_ids[end_sym]
+unknown_id = len(symbols)                   # Id of labels not in the grammar
+spec_hash = '{7}'                           # Hash of the spec (see parsegen.spec_hash)
+
+# Operator layers (see parsegen.operator_layer)
+{8}
+sym_ids.update((op, sym_ids[sym]) for (op, sym) in op_shared.items())
+
+# Return the abstract syntax tree given the stack item of the root (see
+# parsegen.symbol_kind). If the root is contracted, then the abstract syntax
+# tree will be a list of trees.
+def tree(item):
+    if type(item) != tuple: return item
+    if len(item[2]) > 1: return item[2]         # top-level contraction
+    return item[2][0]
+
+# Raise a syntax error for the unexpected token value on the given line.
+def error(lexer, line, val):
+    frag = lexer.excerpt(line, 3)
+    raise SyntaxError('line %d: unexpected token "%s".\n%s'\
+        % (line, val, frag))
+
+# An error at an operator terminal that is not associative but follows an
+# operator of the same precedence.
+class operator_error(Exception):
+
+    def __init__(self, op):
+        self.op = op
+
+# Apply the operator on top of the given operator stack to the operands on top
+# of the given operand stack, given the operator nonterminal.
+def apply_operator(operators, operands, nt):
+    top = operators.pop()
+    if len(top) == 4:                       # Prefix operator
+        operand = operands.pop()
+        children = top[2]
+        children.append(operand)
+        start = top[3]
+        if top[1]: children = [node.nonterminal(top[1], children, start, operand.end_line)]
+        operands.append(node.nonterminal(nt, children, start, operand.end_line))
+    else:                                   # Binary operator
+        rhs = operands.pop()
+        lhs = operands.pop()
+        children = [lhs, top[1], rhs]
+        wrapper = op_wrap[nt][top[1].sym]
+        if wrapper: children = [node.nonterminal(wrapper, children, lhs.start_line, rhs.end_line)]
+        operands.append(node.nonterminal(nt, children, lhs.start_line, rhs.end_line))
+
+# Push the given binary operator terminal onto the given operator sequence of
+# operator nonterminal nt (see parsegen.operator_layer), a pair of an operand
+# stack and a stack of operators: (precedence, terminal) pairs and prefix
+# operators (precedence, wrapper, children, start line). The operators on the stack are
+# applied first if the LR table would reduce their productions before shifting
+# the operator, so the tree and any error are the same.
+def push_operator(seq, op, nt):
+    operands, operators = seq
+    prec, assoc = op_prec[op.sym]
+    while operators and operators[-1][0] <= prec:
+        if operators[-1][0] == prec:
+            if assoc == 'right': break
+            if assoc != 'left': raise operator_error(op)
+        apply_operator(operators, operands, nt)
+    operators.append((prec, op))
+
+# Return the node of operator nonterminal nt for the given operator sequence
+# (see push_operator) ended by the given operand.
+def end_operators(seq, operand, nt):
+    operands, operators = seq
+    operands.append(operand)
+    while operators:
+        apply_operator(operators, operands, nt)
+    return operands[0]
+
+# State functions
+
+{6}
+
+# Return an abstract syntax tree given a lexer object.
+def parse(lexer):
+
+    state_stk = [0]
+    stack = []
+    prev = None
+    token = None
+    sym = None
+
+    while True:
+
+        # Get next token and action
+        if not token:
+            try:
+                token = lexer.next()
+                sym = sym_ids.get(token.label, unknown_id)
+            except StopIteration:
+                token = end_sym
+                sym = end_id
+        try:
+            act = step[state_stk[-1]](sym, stack, state_stk)
+        except operator_error as err:
+            error(lexer, err.op.start_line, err.op.value)
+
+        if act == -1:                       # REDUCE (done by the state)
+
+            continue
+
+        elif act >= 0:                      # SHIFT
+
+            if sym_kind[sym] == 1:
+                stack.append(node.terminal(token.label, token.value, token.start_line, token.end_line))
+            else:
+                stack.append((token.start_line, token.end_line))
+            state_stk.append(act)
+            prev = token
+            token = None
+
+        elif act == -2:                     # ACCEPT
+
+            return tree(stack[-1])
+
+        else:                               # ERROR
+
+            if type(token) == str:
+                error(lexer, prev.start_line if prev else 1, 'EOF')
+            error(lexer, token.start_line, token.value)
+
+# Return an abstract syntax tree given a token buffer (see tok.buffer) and the
+# lexer object that produced it. Tokens are read straight from the buffer
+# columns, without creating token objects.
+def parse_buffer(buf, lexer):
+
+    state_stk = [0]
+    stack = []
+    ids = buf.ids
+    labels = buf.labels
+    sym_of = [sym_ids.get(label, unknown_id) for label in labels]   # Label id -> symbol id
+    n = len(ids)
+    i = 0
+    sym = sym_of[ids[0]] if n else end_id
+
+    while True:
+
+        try:
+            act = step[state_stk[-1]](sym, stack, state_stk)
+        except operator_error as err:
+            error(lexer, err.op.start_line, err.op.value)
+
+        if act == -1:                       # REDUCE (done by the state)
+
+            continue
+
+        elif act >= 0:                      # SHIFT
+
+            val = buf.value(i)
+            line = buf.line(i)
+            if sym_kind[sym] == 1:
+                stack.append(node.terminal(labels[ids[i]], val, line, line+val.count('\n')))
+            else:
+                stack.append((line, line+val.count('\n')))
+            state_stk.append(act)
+            i += 1
+            sym = sym_of[ids[i]] if i < n else end_id
+
+        elif act == -2:                     # ACCEPT
+
+            return tree(stack[-1])
+
+        else:                               # ERROR
+
+            if i == n:
+                error(lexer, buf.line(n-1) if n else 1, 'EOF')
+            error(lexer, buf.line(i), buf.value(i))
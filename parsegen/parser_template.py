@@ -1,59 +1,198 @@
 # An LR(1) parser generated by parsegen.py. This file is automatically
 # generated. Do not edit.
 
-import pickle
+import sys
+from array import array
 from os import path
-from collections import defaultdict
-from . import node, action
-
-# Return a parse table usable in a parser given a table object loaded from a
-# parse table dump.
-def usable(dump_table):
-    table = [defaultdict(lambda: None) for state in dump_table]
-
-    for (i, state) in enumerate(dump_table):
-
-        for (sym, act_tup) in state:
-            act = None
-            if act_tup[0] == 'SHIFT':
-                act = action.SHIFT(*act_tup[1:])
-            elif act_tup[0] == 'GOTO':
-                act = action.GOTO(*act_tup[1:])
-            elif act_tup[0] == 'REDUCE':
-                act = action.REDUCE(*act_tup[1:])
-            else:
-                act = action.ACCEPT()
-            table[i][sym] = act
+from sys import intern
+from . import node
 
-    return table
+# Return the arrays of the binary parse table (see parsegen.py) in the file at
+# the given path, as a tuple of lists (which index faster than arrays). Raise an
+# error if the table was not generated with this parser.
+def load(fpath):
+    f = open(fpath, 'rb')
+    header = array('i')
+    header.fromfile(f, 2)
+    if sys.byteorder == 'big': header.byteswap()
+    if header[0] != 0x54504c53 or header[1] != 3:
+        raise ValueError('"%s" is not a version 3 binary parse table.' % fpath)
+    if f.read(32) != bytes.fromhex(spec_hash):
+        raise ValueError('"%s" is stale (its spec hash does not match the parser).' % fpath)
+    lens = array('i')
+    lens.fromfile(f, 10)
+    if sys.byteorder == 'big': lens.byteswap()
+    res = []
+    for n in lens:
+        a = array('i')
+        a.fromfile(f, n)
+        if sys.byteorder == 'big': a.byteswap()
+        res.append(a.tolist())
+    f.close()
+    return tuple(res)
 
-end_sym = '{0}'
+# Symbol names are interned, so comparing them to other interned strings (such
+# as string literals in the interpreter) is an identity check.
+end_sym = intern('{0}')
 tlist = [{1}]
 clist = [{2}]
-table = usable(pickle.load(open(path.dirname(__file__)+'/{3}', 'rb')))
+symbols = [intern(sym) for sym in [{4}]]
+sym_ids = dict((sym, i) for (i, sym) in enumerate(symbols))
+end_id = sym_ids[end_sym]
+unknown_id = len(symbols)                   # Id of labels not in the grammar
+spec_hash = '{7}'                           # Hash of the spec (see parsegen.spec_hash)
+prod_nt, prod_len, prod_rhs, sym_kind, default, action_base, action_next, action_check, goto_base,\
+    goto_next = load(path.dirname(__file__)+'/{5}')
+
+# The kinds of the children of each production (see parsegen.symbol_kind), and
+# whether they are all kept
+prod_kinds = []
+k = 0
+for n in prod_len:
+    prod_kinds.append([sym_kind[sym] for sym in prod_rhs[k:k+n]])
+    k += n
+prod_kept = [kinds.count(1) == len(kinds) for kinds in prod_kinds]
+
+# Operator layers (see parsegen.operator_layer)
+{8}
+sym_ids.update((op, sym_ids[sym]) for (op, sym) in op_shared.items())
 
-# Return the abstract syntax tree given a concrete syntax tree. If the root of
-# the concrete syntax tree is contracted, then the resulting abstract syntax
+# Return the abstract syntax tree given the stack item of the root (see
+# parsegen.symbol_kind). If the root is contracted, then the abstract syntax
 # tree will be a list of trees.
-def ast(cst):
-    def rec(cst):
-        if type(cst) == node.nonterminal:       # Nonterminal
-            children = []
-            for child in cst.children:
-                children.extend(rec(child))
-            if cst.sym in clist:                # Contract nonterminal
-                return children
-            else:                               # Keep nonterminal
-                cst.children = children
-                return [cst]
-        elif cst.sym in tlist:                  # Keep terminal
-            return [cst]
-        else:                                   # Discard terminal
-            return []
-
-    res = rec(cst)
-    if len(res) > 1: return res                 # top-level contraction
-    return res[0]
+def tree(item):
+    if type(item) != tuple: return item
+    if len(item[2]) > 1: return item[2]         # top-level contraction
+    return item[2][0]
+
+# Raise a syntax error for the unexpected token value on the given line.
+def error(lexer, line, val):
+    frag = lexer.excerpt(line, 3)
+    raise SyntaxError('line %d: unexpected token "%s".\n%s'\
+        % (line, val, frag))
+
+# An error at an operator terminal that is not associative but follows an
+# operator of the same precedence.
+class operator_error(Exception):
+
+    def __init__(self, op):
+        self.op = op
+
+# Apply the operator on top of the given operator stack to the operands on top
+# of the given operand stack, given the operator nonterminal.
+def apply_operator(operators, operands, nt):
+    top = operators.pop()
+    if len(top) == 4:                       # Prefix operator
+        operand = operands.pop()
+        children = top[2]
+        children.append(operand)
+        start = top[3]
+        if top[1]: children = [node.nonterminal(top[1], children, start, operand.end_line)]
+        operands.append(node.nonterminal(nt, children, start, operand.end_line))
+    else:                                   # Binary operator
+        rhs = operands.pop()
+        lhs = operands.pop()
+        children = [lhs, top[1], rhs]
+        wrapper = op_wrap[nt][top[1].sym]
+        if wrapper: children = [node.nonterminal(wrapper, children, lhs.start_line, rhs.end_line)]
+        operands.append(node.nonterminal(nt, children, lhs.start_line, rhs.end_line))
+
+# Push the given binary operator terminal onto the given operator sequence of
+# operator nonterminal nt (see parsegen.operator_layer), a pair of an operand
+# stack and a stack of operators: (precedence, terminal) pairs and prefix
+# operators (precedence, wrapper, children, start line). The operators on the stack are
+# applied first if the LR table would reduce their productions before shifting
+# the operator, so the tree and any error are the same.
+def push_operator(seq, op, nt):
+    operands, operators = seq
+    prec, assoc = op_prec[op.sym]
+    while operators and operators[-1][0] <= prec:
+        if operators[-1][0] == prec:
+            if assoc == 'right': break
+            if assoc != 'left': raise operator_error(op)
+        apply_operator(operators, operands, nt)
+    operators.append((prec, op))
+
+# Return the node of operator nonterminal nt for the given operator sequence
+# (see push_operator) ended by the given operand.
+def end_operators(seq, operand, nt):
+    operands, operators = seq
+    operands.append(operand)
+    while operators:
+        apply_operator(operators, operands, nt)
+    return operands[0]
+
+# Return the children of the abstract syntax tree node of production p and its
+# start and end lines, given the stack items of the children of the production
+# (see parsegen.symbol_kind).
+def node_parts(items, p):
+    if not items: return ([], None, None)
+    kinds = prod_kinds[p]
+    start = items[0].start_line if kinds[0] == 1 else items[0][0]
+    for k in range(len(items)-1, -1, -1):
+        end = items[k].end_line if kinds[k] == 1 else items[k][1]
+        if end != None: break
+    if prod_kept[p]: return (items, start, end)
+    children = []
+    for (item, kind) in zip(items, kinds):
+        if kind == 1: children.append(item)
+        elif kind == 2: children.extend(item[2])
+    return (children, start, end)
+
+# Pop the children of production p off the stacks, push the stack item of their
+# parent nonterminal (its node if it is kept) and its goto state.
+def reduce(stack, state_stk, p):
+    k = len(stack)-prod_len[p]
+    children, start, end = node_parts(stack[k:], p)
+    del stack[k:]
+    del state_stk[k+1:]
+    nt = prod_nt[p]
+    if sym_kind[nt] == 1:
+        stack.append(node.nonterminal(symbols[nt], children, start, end))
+    else:
+        stack.append((start, end, children))
+    state_stk.append(goto_next[goto_base[state_stk[-1]]+nt])
+
+# Reduce by operator layer production p (see parsegen.layer_production),
+# building its operator sequence (see push_operator) instead of a node.
+def reduce_layer(stack, state_stk, p):
+    layer = op_prods[p]
+    kind, nt = layer[:2]
+    n = prod_len[p]
+    if kind == 'end':
+        operand = stack.pop()
+        stack[-1] = end_operators(stack[-1], operand, nt)
+    elif kind == 'start_prefix':
+        stack[-1] = ([], [stack[-1]])
+    elif kind == 'start_binary':
+        op = stack.pop()
+        stack[-1] = ([stack[-1]], [])
+        push_operator(stack[-1], op, nt)
+    elif kind == 'add_prefix':
+        pre = stack.pop()
+        stack[-1][1].append(pre)
+    elif kind == 'add_binary':
+        op = stack.pop()
+        operand = stack.pop()
+        stack[-1][0].append(operand)
+        push_operator(stack[-1], op, nt)
+    elif kind == 'prefix':
+        k = len(stack)-n
+        children, start, end = node_parts(stack[k:], p)
+        del stack[k:]
+        stack.append((layer[2], layer[3], children, start))
+    del state_stk[len(state_stk)-n:]
+    state_stk.append(goto_next[goto_base[state_stk[-1]]+prod_nt[p]])
+
+reducers = [reduce]*len(prod_len)           # Reduce function of each production
+for p in op_prods:
+    reducers[p] = reduce_layer
+
+# Return the action of the given state on the given terminal symbol id.
+def get_action(state, sym):
+    k = action_base[state]+sym
+    if action_check[k] == state: return action_next[k]
+    return default[state]
 
 # Return an abstract syntax tree given a lexer object.
 def parse(lexer):
@@ -62,7 +201,7 @@ def parse(lexer):
     stack = []
     prev = None
     token = None
-    act = None
+    sym = None
 
     while True:
 
@@ -73,64 +212,89 @@ def parse(lexer):
         if not token:
             try:
                 token = lexer.next()
-                act = table[state_stk[-1]][token.label]
+                sym = sym_ids.get(token.label, unknown_id)
             except StopIteration:
                 token = end_sym
-                act = table[state_stk[-1]][end_sym]
-        elif type(token) != str:
-            act = table[state_stk[-1]][token.label]
-        else:
-            act = table[state_stk[-1]][end_sym]
+                sym = end_id
+        act = get_action(state_stk[-1], sym)
 
         # print('token: %s' % str(token))
-        # print('action: %s' % act)
+        # print('action: %d' % act)
+
+        if act > 0:                         # SHIFT
+
+            if sym_kind[sym] == 1:
+                stack.append(node.terminal(token.label, token.value, token.start_line, token.end_line))
+            else:
+                stack.append((token.start_line, token.end_line))
+            state_stk.append(act-1)
+            prev = token
+            token = None
 
-        if not act:                         # ERROR
+        elif act < -1:                      # REDUCE
 
-            val = None
+            p = -act-1
+            try:
+                reducers[p](stack, state_stk, p)
+            except operator_error as err:
+                error(lexer, err.op.start_line, err.op.value)
+
+        elif act:                           # ACCEPT
+
+            return tree(stack[-1])
+
+        else:                               # ERROR
 
             if type(token) == str:
-                token = prev
-                val = 'EOF'
-            else:
-                val = token.value
+                error(lexer, prev.start_line if prev else 1, 'EOF')
+            error(lexer, token.start_line, token.value)
 
-            frag = lexer.excerpt(token.start_line, 3, lexer.prog_str)
-            raise SyntaxError('line %d: unexpected token "%s".\n%s'\
-                % (token.start_line, val, frag))
+# Return an abstract syntax tree given a token buffer (see tok.buffer) and the
+# lexer object that produced it. Tokens are read straight from the buffer
+# columns, without creating token objects.
+def parse_buffer(buf, lexer):
 
-        elif type(act) == action.SHIFT:     # SHIFT
+    state_stk = [0]
+    stack = []
+    ids = buf.ids
+    labels = buf.labels
+    sym_of = [sym_ids.get(label, unknown_id) for label in labels]   # Label id -> symbol id
+    n = len(ids)
+    i = 0
 
-            t = node.terminal(token.label, token.value, token.start_line, token.end_line)
-            # print('t.sym: %s' % t.sym)
-            # print('t.value: %s' % t.value)
-            stack.append(t)
-            state_stk.append(act.state_num)
-            prev = token
-            token = None
+    while True:
 
-        elif type(act) == action.REDUCE:    # REDUCE
-
-            children = stack[len(stack)-act.pop_num:]
-            for i in range(act.pop_num):
-                stack.pop()
-                state_stk.pop()
-            if len(children):
-                start = children[0].start_line
-                for child in reversed(children):
-                    end = child.end_line
-                    if end != None: break
+        # Get next token symbol and action
+        sym = sym_of[ids[i]] if i < n else end_id
+        state = state_stk[-1]
+        k = action_base[state]+sym
+        act = action_next[k] if action_check[k] == state else default[state]
+
+        if act > 0:                         # SHIFT
+
+            val = buf.value(i)
+            line = buf.line(i)
+            if sym_kind[sym] == 1:
+                stack.append(node.terminal(labels[ids[i]], val, line, line+val.count('\n')))
             else:
-                start = None
-                end = None
-            t = node.nonterminal(act.nt, children, start, end)
-            # print('t.sym: %s' % t.sym)
-            # print('t.children: %s' % t.children)
-            stack.append(t)
-            act = table[state_stk[-1]][act.nt]
-            state_stk.append(act.state_num)
-            # print('action: %s' % act)
-
-        elif type(act) == action.ACCEPT:    # ACCEPT
-
-            return ast(stack[-1])
\ No newline at end of file
+                stack.append((line, line+val.count('\n')))
+            state_stk.append(act-1)
+            i += 1
+
+        elif act < -1:                      # REDUCE
+
+            p = -act-1
+            try:
+                reducers[p](stack, state_stk, p)
+            except operator_error as err:
+                error(lexer, err.op.start_line, err.op.value)
+
+        elif act:                           # ACCEPT
+
+            return tree(stack[-1])
+
+        else:                               # ERROR
+
+            if i == n:
+                error(lexer, buf.line(n-1) if n else 1, 'EOF')
+            error(lexer, buf.line(i), buf.value(i))
\ No newline at end of file
@@ -18,6 +18,7 @@ class repl(cmd.Cmd):
     ret_prompt = ''
     last_run = None
     exec_list = []
+    bufs = dict()                           # Token buffer of each run script
     cnt = 0
 
     # Utility functions
@@ -34,17 +35,28 @@ class repl(cmd.Cmd):
     def update_out_prompt(self):
         self.ret_prompt = self.out_prompt % self.cnt
 
-    # Read in Slang line. This is the default action.
-    def default(self, line):
-        if line == 'EOF': exit(0)
+    # Print the result of the given run function, or its error.
+    def output(self, run):
         try:
-            res = slang.run(line)
+            res = run()
             res = res.res
             print(self.out_prompt % (self.cnt, str(res)))
         except Exception as err:
             self.error(err)
         self.cnt += 1
 
+    # Run the script, re-lexing only what changed since it was last run.
+    def run_script(self, fpath, script):
+        if fpath not in self.bufs:
+            slang.lexer.set_str(script)
+            self.bufs[fpath] = slang.lexer.buffer()
+        return slang.run(script, self.bufs[fpath])
+
+    # Read in Slang line. This is the default action.
+    def default(self, line):
+        if line == 'EOF': exit(0)
+        self.output(lambda: slang.run(line, tree_cache=False))
+
     # Commands
 
     def do_exit(self, arg):
@@ -63,7 +75,7 @@ class repl(cmd.Cmd):
         try:
             self.last_run = fpath
             script = open(fpath, 'r').read()
-            self.default(script)
+            self.output(lambda: self.run_script(fpath, script))
         except Exception as err:
             self.error('"%s": %s' % (fpath, err))
 
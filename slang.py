@@ -17,7 +17,6 @@
 #   expression and places each result into the return array.
 
 # BUGS:
-# - variable names that have keywords as prefixes aren't tokenized correctly
 # - fix env stack so function calls can only see local and global envs
 
 # TODO:
@@ -36,38 +35,318 @@
 # - Currying?
 # - optional static type-checking?
 # - strong typing?
-# - "compilation" into condensed format or even bytecode?
 # - include other useful built-in functions
 # - robust pattern-matching
 # - either support or disallow nested functions and closures
 
+import contextlib, copy, hashlib, io, json, multiprocessing, os, pickle, time
 from collections import deque
-from parsegen import parse, node
+from parsegen import cache, node
 from lexgen import lex
 import repl
-from interpreter import env, execute
+from interpreter import env, execute, closures, bytecode
 
-# Instantiate lexer
+# Configuration variables
+
+compact = False                             # Whether to keep program trees compact (see node.tree)
+evaluator = 'closures'                      # Executor of programs: tree, closures or vm (see executors)
+tree_cache = False                          # Whether to cache program trees (or bytecode) on disk
+tree_cache_path = os.path.join(cache.cache_root, 'trees')  # Directory of cached trees
+tree_cache_size = 64 << 20                  # Maximum total size of cached files in bytes
+tree_suffix = '.tree'                       # File suffix for cached trees
+tree_version = 1                            # Format version of cached trees (bump when node.tree changes)
+code_suffix = '.code'                       # File suffix for cached bytecode
+chunks = 4                                  # Chunks of scripts per worker (see run_batch)
+
+# Executor of each evaluator name: the tree-walking reference executor, the
+# closure compiler and the bytecode VM
+executors = {
+    'tree': execute.execute,
+    'closures': closures.execute,
+    'vm': bytecode.execute
+}
+
+# Instantiate lexer and load the parser (regenerating it if slang.syn changed)
 lexer = lex.lexer()
+parse = cache.load()
+
+# Program tree cache.
+# Parsed programs are pickled as compact trees (see node.flatten) into the cache
+# directory, in files named after the hash of the program string, the parser's
+# and lexer's spec hashes (which cover the grammar and token spec, the table
+# options or lexer backend and the generator versions) and the tree format
+# version. A program that was parsed before is then loaded without lexing or
+# parsing it. Programs run on the VM are cached as serialized bytecode instead
+# (see bytecode.dumps), so they are not even compiled again. The cache lives in
+# the user's cache directory, is skipped if that cannot be written to, and has
+# its least recently used files evicted once it outgrows tree_cache_size.
+
+# Return the path of the cache file of the program string, given the format
+# version and the file suffix.
+def cache_file(p, version, suffix):
+    key = '%d\n%s\n%s\n%s' % (version, parse.spec_hash, lex.spec_hash, p)
+    return os.path.join(tree_cache_path, hashlib.sha256(key.encode('utf-8')).hexdigest()+suffix)
+
+# Return the path of the cached tree of the program string.
+def tree_path(p):
+    return cache_file(p, tree_version, tree_suffix)
+
+# Return the path of the cached bytecode of the program string.
+def code_path(p):
+    return cache_file(p, bytecode.version, code_suffix)
+
+# Return the contents of the cache file at the given path, or None if it cannot
+# be read. The file is marked as recently used (see prune_cache).
+def read_cache(fpath):
+    try:
+        f = open(fpath, 'rb')
+        try:
+            data = f.read()
+        finally:
+            f.close()
+    except OSError:
+        return None
+    with contextlib.suppress(OSError):
+        os.utime(fpath)
+    return data
+
+# Write the given bytes to the cache file at the given path. The file is written
+# under a temporary name first, so concurrent runs never read a partial file,
+# and a cache directory that cannot be written to is ignored.
+def write_cache(fpath, data):
+    tmp_path = '%s.tmp%d' % (fpath, os.getpid())
+    try:
+        os.makedirs(tree_cache_path, exist_ok=True)
+        f = open(tmp_path, 'wb')
+        try:
+            f.write(data)
+        finally:
+            f.close()
+        os.replace(tmp_path, fpath)
+    except OSError:
+        if os.path.exists(tmp_path): os.remove(tmp_path)
+        return
+    prune_cache()
+
+# Remove the least recently used files from the cache directory until their
+# total size is at most tree_cache_size. Files that disappear meanwhile (e.g.,
+# pruned by a concurrent run) are skipped.
+def prune_cache():
+    files = []
+    with contextlib.suppress(OSError):
+        for entry in os.scandir(tree_cache_path):
+            with contextlib.suppress(OSError):
+                st = entry.stat()
+                files.append((st.st_mtime, st.st_size, entry.path))
+    total = sum(size for (_, size, _) in files)
+    if total <= tree_cache_size: return
+    for (_, size, fpath) in sorted(files):
+        with contextlib.suppress(OSError):
+            os.remove(fpath)
+            total -= size
+        if total <= tree_cache_size: break
+
+# Return the cached tree of the program string (compact if compact is set), or
+# None if it is not cached or the cache file cannot be read.
+def cached_tree(p, compact=compact):
+    data = read_cache(tree_path(p))
+    try:
+        tree = pickle.loads(data) if data != None else None
+    except (EOFError, pickle.UnpicklingError):
+        tree = None
+    if tree == None: return None
+    (tree[0] if type(tree) == list else tree).tree.intern()
+    return tree if compact else node.unflatten(tree)
+
+# Cache the given compact tree of the program string.
+def cache_tree(p, tree):
+    write_cache(tree_path(p), pickle.dumps(tree, pickle.HIGHEST_PROTOCOL))
 
-# Run the program string.
-def run(p):
-    lexer.set_str(p)
+# Return the cached bytecode of the program string, or None if it is not cached
+# or the cache file cannot be read.
+def cached_code(p):
+    data = read_cache(code_path(p))
+    try:
+        return bytecode.loads(data) if data != None else None
+    except ValueError:
+        return None
+
+# Cache the given bytecode of the program string.
+def cache_code(p, code):
+    write_cache(code_path(p), bytecode.dumps(code))
+
+# Return the parse tree of the program string. If the token buffer of an
+# earlier version of the program is given, only the edited part of the program
+# is re-lexed and the buffer is updated in place.
+def parse_str(p, buf=None):
+    if buf:
+        lexer.update(buf, p)                # Re-lex
+    else:
+        lexer.set_str(p)
+        buf = lexer.buffer()                # Lex
+    return parse.parse_buffer(buf, lexer)   # Parse
+
+# Run the program string with the given evaluator (see executors). If the
+# token buffer of an earlier version of the program is given, it is updated
+# (see parse_str). If tree_cache is set, the tree (or, on the VM, the bytecode)
+# of a program that was run before is loaded from the cache instead (leaving
+# the buffer as it is).
+def run(p, buf=None, compact=compact, tree_cache=tree_cache, evaluator=evaluator):
+    if tree_cache and evaluator == 'vm':
+        code = cached_code(p)
+        if code != None:
+            lexer.set_str(p)                # For error excerpts
+        else:
+            code = bytecode.compile_code(parse_str(p, buf).children)
+            cache_code(p, code)
+        return run_code(code)
+    tree = cached_tree(p, compact) if tree_cache else None
+    if tree != None:
+        lexer.set_str(p)                    # For error excerpts
+        return run_tree(tree, compact, evaluator)
+    tree = parse_str(p, buf)
+    if tree_cache:
+        flat = node.flatten(tree)
+        cache_tree(p, flat)
+        if compact: tree = flat
+    return run_tree(tree, compact, evaluator)
+
+# Run the program file with the given evaluator, parsing it as it is read in
+# chunks. If tree_cache is set, the whole file is read into memory first
+# instead, since its tree is looked up by the hash of its contents (see run):
+# this saves lexing and parsing a file that was run before, but gives up
+# streaming, which is why the cache is off by default.
+def run_file(f, compact=compact, tree_cache=tree_cache, evaluator=evaluator):
+    if tree_cache: return run(f.read(), None, compact, tree_cache, evaluator)
+    lexer.set_stream(f)
     lexer.reset()
     tree = parse.parse(lexer)               # Parse
+    return run_tree(tree, compact, evaluator)
+
+# Run the program parse tree with the given evaluator (see executors), stored
+# as a compact tree if compact is set (so functions defined in the program keep
+# only the compact tree alive).
+def run_tree(tree, compact=compact, evaluator=evaluator):
     # node.print_tree(tree)
+    if evaluator not in executors:
+        raise ValueError('unknown evaluator "%s".' % evaluator)
+    if compact and type(tree) != node.view: tree = node.flatten(tree)
     stms = tree.children
+    return run_program(lambda envs: executors[evaluator](envs, stms))
+
+# Run the program bytecode (see bytecode.compile_code) on the VM.
+def run_code(code):
+    return run_program(lambda envs: bytecode.run(code, envs))
+
+# Run a program given as a function of the environment stack. A runtime error is
+# raised again with the line of the statement that raised it and an excerpt of
+# the program around it added to its message, or as a note if its message is
+# not just its argument (e.g., a KeyError's quoted key).
+def run_program(program):
     envs = [env.env]                        # Create environment stack
-    return execute.execute(envs, stms)      # Execute
+    try:
+        return program(envs)                # Execute
+    except Exception as err:
+        line = getattr(err, 'line', None)
+        if line == None: raise
+        frag = lexer.excerpt(line, 3)
+        msg = 'line %d: %s%s' % (line, err, '\n'+frag if frag else '')
+        if len(err.args) == 1 and str(err) == err.args[0]:
+            err.args = (msg,)
+            if isinstance(err, SyntaxError): err.msg = msg
+        else:
+            err.add_note(msg)
+        raise
+
+# Batch mode.
+# A batch of scripts is run in a pool of worker processes, each of which keeps
+# its lexer and parser loaded across scripts. Every script runs in a fresh copy
+# of the global environment with its output captured, so scripts cannot see
+# each other's bindings or interleave their output.
+
+fresh_env = copy.deepcopy(env.env)          # Global environment before any script
+
+# Run the script at the given path in a fresh global environment and return
+# its result: a dictionary of the path, the exit status (0, or 1 if it raised
+# an error), the error message or None, the output and the run time in seconds.
+def run_isolated(fname):
+    env.env = copy.deepcopy(fresh_env)
+    out = io.StringIO()
+    err = None
+    t = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(out):
+            with open(fname, 'r') as f:
+                run_file(f)
+    except Exception as e:
+        err = str(e)
+    return {
+        'path': fname,
+        'status': 1 if err else 0,
+        'error': err,
+        'output': out.getvalue(),
+        'seconds': time.perf_counter() - t
+    }
+
+# Run the scripts at the given paths in the given number of processes, print
+# the output and any error of each script in order, and return the summary of
+# the batch: the results of the scripts (see run_isolated) without their
+# output, the number that failed and the total time in seconds.
+def run_batch(fnames, jobs):
+    t = time.perf_counter()
+    results = []
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs)
+        runs = pool.imap(run_isolated, fnames, max(1, len(fnames)//(jobs*chunks)))
+    else:
+        pool = None
+        runs = map(run_isolated, fnames)
+    try:
+        for res in runs:
+            print(res.pop('output'), end='')
+            if res['error']: print('Error: "%s": %s' % (res['path'], res['error']))
+            results.append(res)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    return {
+        'jobs': jobs,
+        'scripts': results,
+        'failed': sum(res['status'] for res in results),
+        'seconds': time.perf_counter() - t
+    }
 
-# Run Slang as a command-line program.
+# Run Slang as a command-line program. Scripts given as arguments are run one
+# after another, or as a batch (see run_batch) with "-jN" in N processes, or in
+# one process per CPU for "-j". With "-o path", the batch summary is written to
+# path as JSON. A batch exits with status 1 if any script failed.
 if __name__ == "__main__":
     from sys import argv
-    if len(argv) >= 2:                      # Execute script(s)
-        for fname in argv[1:]:
+    args = argv[1:]
+    out = None
+    if '-o' in args:
+        k = args.index('-o')
+        out = args[k+1] if k+1 < len(args) and args[k+1][:1] != '-' else ''  # Path, or '' if none
+        args = args[:k] + args[k+2:]
+    jobs = [arg[2:] for arg in args if arg[:2] == '-j']
+    fnames = [arg for arg in args if arg[:2] != '-j']
+    if out == '' or '-o' in args or len(jobs) > 1 or not all(n.isdigit() and int(n) for n in jobs if n) or \
+       (jobs or out) and not fnames:
+        raise ValueError('expected arguments [-jN] [-o path] fpath* .')
+    if jobs or out:                         # Execute scripts as a batch
+        jobs = (int(jobs[0]) if jobs[0] else os.cpu_count()) if jobs else 1
+        summary = run_batch(fnames, jobs)
+        if out:
+            f = open(out, 'w')
+            json.dump(summary, f, indent=2)
+            f.close()
+        exit(1 if summary['failed'] else 0)
+    elif fnames:                            # Execute script(s)
+        for fname in fnames:
             try:
-                script = open(fname, 'r').read()
-                run(script)
+                with open(fname, 'r') as f:
+                    run_file(f)
             except Exception as err:
                 print('Error: "%s": %s' % (fname, err))
     else:                                   # Launch REPL
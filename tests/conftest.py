@@ -0,0 +1,6 @@
+# Make the Slang packages importable when the tests are run from anywhere.
+
+import sys
+from os import path
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
@@ -0,0 +1,42 @@
+# Tests of the executors: the closure compiler and the bytecode VM must print
+# and return the same as the tree-walking reference executor, and raise the
+# same errors.
+
+import contextlib, copy, io
+from os import listdir, path
+import slang
+from interpreter import env
+
+ex_path = path.join(path.dirname(path.dirname(path.abspath(__file__))), 'examples')
+sources = [open(path.join(ex_path, fname), 'r').read() for fname in sorted(listdir(ex_path))]
+sources.extend([
+    'x = 0; while (x < 3) { x = x + 1; if (x == 2) { break; } else { print(x); } } print(x);',
+    'def f(n) { for (i in 1..n) { if (i == 3) { return i; } else { 0; } } } print(f(5)); print(f(2));',
+    'def f() { for (i in 1..3) { while (1) { break; } if (i == 2) { return i * 10; } else { 1; } } } print(f());',
+    'def f(a) { def g(b) { return a + b; } return g(2); } print(f(1));',
+    'def fact(n) { if (n < 2) { return 1; } else { return n * fact(n - 1); } } print({i in 1..8 -> fact(i)});',
+    'print({i in 1..5 : i % 2 -> i * i}); print(0 || 5); print(1 && 0); print(2 ^ 10); print(7 / 2);',
+    'a = {1, 2, 3}; a[1] = 5; print(a); print(a[3]);',
+    'def f() { q(); } def q() { print(1 / 0); } f();',
+    'print("a" + 1);', 'print(q);', 'break;', 'x = 3; x[0] = 1;'
+])
+
+fresh_env = copy.deepcopy(env.env)
+
+# Return the output of running the program string with the given evaluator in
+# a fresh global environment, followed by its result or error.
+def run(p, evaluator):
+    env.env = copy.deepcopy(fresh_env)
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        try:
+            print('result', repr(slang.run(p, tree_cache=False, evaluator=evaluator)))
+        except Exception as err:
+            print('error', type(err).__name__, err)
+    return out.getvalue()
+
+def test_executors_agree():
+    for p in sources:
+        expected = run(p, 'tree')
+        assert run(p, 'closures') == expected, p
+        assert run(p, 'vm') == expected, p
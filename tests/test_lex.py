@@ -0,0 +1,68 @@
+# Tests of the lexer: streaming in small chunks, the token buffer and
+# incremental re-lexing must all agree with lexing the whole string at once.
+
+import io, random
+from os import listdir, path
+from lexgen import lex
+
+ex_path = path.join(path.dirname(path.dirname(path.abspath(__file__))), 'examples')
+sources = [open(path.join(ex_path, fname), 'r').read() for fname in sorted(listdir(ex_path))]
+sources.append('x = "%s"; # %s\nprint(x);\n' % ('s'*40, 'c'*40))
+
+# Pieces inserted by the random edits: whole tokens, partial tokens that merge
+# with their neighbours, and line breaks.
+pieces = ['x', '1', '23', ' ', '\n', ';', '=', '.', '..', '<', '<=', '!', '"a b"',
+          '# note\n', 'def', 'while', '(', ')', '{', '}']
+
+# Return the tokens of the program string, lexed all at once.
+def tokens(p):
+    lexer = lex.lexer()
+    lexer.set_str(p)
+    return [(t.label, t.value, t.start_line, t.end_line) for t in lexer.lex(p)]
+
+# Return the tokens of a token buffer with their offsets.
+def buffer_tokens(buf):
+    return [(buf.label(i), buf.value(i), buf.line(i), buf.start(i), buf.end(i))
+            for i in range(len(buf))]
+
+# Return the token buffer of the program string, lexed from scratch.
+def fresh_buffer(p):
+    lexer = lex.lexer()
+    lexer.set_str(p)
+    return lexer.buffer()
+
+def test_stream_matches_string():
+    for p in sources:
+        for size in (1, 3, 7, 16, 64):
+            lexer = lex.lexer()
+            lexer.set_stream(io.StringIO(p), size)
+            lexer.reset()
+            assert [(t.label, t.value, t.start_line, t.end_line) for t in lexer.tokens] == tokens(p)
+
+def test_buffer_matches_tokens():
+    for p in sources:
+        buf = fresh_buffer(p)
+        assert [buf.token(i).__dict__ for i in range(len(buf))] == \
+               [t.__dict__ for t in lex.lexer().lex(p)]
+
+def test_relex_matches_full_lex():
+    rand = random.Random(5)
+    lexer = lex.lexer()
+    for p in sources:
+        lexer.set_str(p)
+        buf = lexer.buffer()
+        for _ in range(40):
+            offset = rand.randint(0, len(p))
+            length = min(rand.choice((0, 0, 1, 2, 5)), len(p)-offset)
+            edited = p[:offset] + rand.choice(pieces) + p[offset+length:]
+            try:
+                expected = buffer_tokens(fresh_buffer(edited))
+            except SyntaxError:
+                continue
+            lexer.update(buf, edited)
+            assert buf.source == edited
+            assert buffer_tokens(buf) == expected
+            for offset in range(0, len(edited)+1, 7):
+                assert buf.find(offset) == next((i for i in range(len(buf)) if buf.end(i) >= offset),
+                                                len(buf))
+            p = edited